@@ -0,0 +1,92 @@
+"""Benchmarks the incident message transform against the previous pandas-based
+transform, per message and at process startup. pandas is no longer a dependency of
+the service, so install it first. Run with:
+
+    pip install pandas
+    python3 benchmark_transform.py"""
+
+from statistics import median
+import subprocess
+import sys
+from time import perf_counter
+from timeit import repeat
+from typing import TYPE_CHECKING
+
+from transform import process_xml, transform_data, TIMESTAMP_KEYS, UK_TIMEZONE
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+NS = {"ns": "http://nationalrail.co.uk/xml/incident",
+      "com": "http://nationalrail.co.uk/xml/common"}
+
+MESSAGE_FILENAME = "test_data/test_incident_data.xml"
+
+
+def convert_timestamps(data_frame: "pd.DataFrame", timezone: str) -> "pd.DataFrame":
+    """Converts timestamp to correct datetime format with correct time zone."""
+
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
+    for col in TIMESTAMP_KEYS:
+        if data_frame[col].notnull().any():
+            data_frame[col] = pd.to_datetime(data_frame[col])
+            data_frame[col] = data_frame[col].dt.tz_convert(tz=timezone)
+
+    return data_frame
+
+
+def pandas_transform_data(message: str, namespaces: dict) -> dict:
+    """The previous transform, which converted timestamps through a one-row DataFrame."""
+
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
+    data = process_xml(message, namespaces)
+    data_frame = pd.DataFrame([data])
+    data_frame = convert_timestamps(data_frame, UK_TIMEZONE)
+    return data_frame.to_dict(orient='records')[0]
+
+
+def benchmark_transform(message: str, number: int = 200, repeats: int = 5) -> dict:
+    """Returns the median time per message, in microseconds, of each transform."""
+
+    results = {}
+    for transform in (pandas_transform_data, transform_data):
+        elapsed = median(repeat(lambda transform=transform: transform(message, NS),
+                                number=number, repeat=repeats))
+        results[transform.__name__] = elapsed / number * 1e6
+    return results
+
+
+def benchmark_startup(repeats: int = 5) -> dict:
+    """Returns the median time, in milliseconds, for a new interpreter to import
+       the transform module, with and without pandas."""
+
+    statements = {
+        "import transform": "import transform",
+        "import transform, pandas": "import transform, pandas",
+    }
+
+    results = {}
+    for name, statement in statements.items():
+        timings = []
+        for _ in range(repeats):
+            start = perf_counter()
+            subprocess.run([sys.executable, "-c", statement], check=True)
+            timings.append(perf_counter() - start)
+        results[name] = median(timings) * 1e3
+    return results
+
+
+if __name__ == "__main__":
+
+    with open(MESSAGE_FILENAME, "r", encoding="utf-8") as file:
+        xml_message = file.read()
+
+    print("Per message:")
+    for transform_name, microseconds in benchmark_transform(xml_message).items():
+        print(f"  {transform_name:<25} {microseconds:10.1f} us")
+
+    print("Startup:")
+    for statement_name, milliseconds in benchmark_startup().items():
+        print(f"  {statement_name:<25} {milliseconds:10.1f} ms")
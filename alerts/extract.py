@@ -2,27 +2,36 @@
 Knowledgebase (KB) Real Time Incidents API
 and process each message upon receipt."""
 
-from time import sleep
-from os import environ as ENV
 import logging
 
 from botocore.client import BaseClient
+from psycopg2 import OperationalError
 import stomp
 
-from transform import transform_data
-from load import load_data_to_database
-from publish import send_alerts
+from load import DatabasePool, DEFAULT_MAX_CONNECTIONS
+from incident_cache import IncidentStateCache, DEFAULT_MAX_INCIDENTS
+from processing import (IncidentProcessor, DEFAULT_QUEUE_SIZE,
+                        DEFAULT_LOAD_WORKERS, DEFAULT_SWEEP_INTERVAL_SECONDS,
+                        DEFAULT_REPLAY_INTERVAL_SECONDS)
+from publish import AlertPublisher, DEFAULT_COALESCE_SECONDS
+from outbox import Outbox, DEFAULT_OUTBOX_PATH
+from supervisor import ConnectionSupervisor, DEFAULT_HEARTBEAT_TIMEOUT_SECONDS
 
 NS = {"ns": "http://nationalrail.co.uk/xml/incident",
       "com": "http://nationalrail.co.uk/xml/common"}
 
+STATS_INTERVAL_SECONDS = 60
+
 
 class TrainListener(stomp.ConnectionListener):
-    """Provides methods to handle live data stream."""
+    """Provides methods to handle live data stream on one connection. Connection
+       events are passed to the supervisor, which does any reconnecting."""
 
-    def __init__(self, sns_client: BaseClient, config: dict[str, str]):
-        self.sns_client = sns_client
-        self.config = config
+    def __init__(self, processor: IncidentProcessor, connection: stomp.Connection12,
+                 supervisor: ConnectionSupervisor):
+        self.processor = processor
+        self.connection = connection
+        self.supervisor = supervisor
 
     def on_error(self, frame):
         """Executes on error."""
@@ -31,66 +40,154 @@ class TrainListener(stomp.ConnectionListener):
     def on_disconnected(self):
         """Executes if disconnection occurs."""
 
-        logging.warning('Disconnected - attempting to reconnect...')
-        sleep(15)
-        initialise_connection(ENV, self.sns_client)
+        logging.warning('Disconnected')
+        self.supervisor.notify_lost(self.connection)
+
+    def on_heartbeat_timeout(self):
+        """Executes if the server's heartbeats stop arriving."""
+
+        logging.warning('Heartbeat timed out')
+        self.supervisor.notify_lost(self.connection)
 
     def on_message(self, frame):
-        """Executes when message is received."""
+        """Executes when message is received. Processing happens on the
+           processor's worker threads so the receiver thread is never held up,
+           and the message is acknowledged once it has been recorded in the outbox."""
 
         logging.info('Received message')
-        message = transform_data(frame.body, NS)
-
-        if message:
-            logging.info('Data has been cleaned, incident ID = %s',
-                         message["incident_number"])
-            send_alerts(self.sns_client, message, self.config["TOPIC_ARN"])
-            logging.info('Message sent to subscribers')
-            load_data_to_database(ENV, message)
-            logging.info('Data has been inserted into database')
+        self.supervisor.notify_alive()
+        ack_id = frame.headers.get('ack', frame.headers.get('message-id'))
+        self.processor.submit(frame.body, lambda: self.connection.ack(ack_id))
 
     def on_heartbeat(self):
         """Executes when heartbeat is received from server."""
 
         logging.info("Heartbeat received")
+        self.supervisor.notify_alive()
+
+
+def create_processor(sns_client: BaseClient, config: dict[str, str]) -> IncidentProcessor:
+    """Returns a started incident processor with its own database pool, outbox and
+       an incident state cache seeded from the database."""
+
+    pool = DatabasePool(
+        config, int(config.get("DB_POOL_MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS)))
+
+    incident_cache = IncidentStateCache(
+        int(config.get("INCIDENT_CACHE_SIZE", DEFAULT_MAX_INCIDENTS)))
+    try:
+        with pool.transaction() as conn, conn.cursor() as cur:
+            incident_cache.seed(cur)
+        logging.info('Seeded incident cache with %s incidents',
+                     len(incident_cache.incidents))
+    except OperationalError:
+        logging.exception('Failed to seed incident cache')
+
+    outbox = Outbox(config.get("OUTBOX_PATH", DEFAULT_OUTBOX_PATH))
+
+    publisher = AlertPublisher(
+        sns_client, config["TOPIC_ARN"],
+        coalesce_seconds=float(config.get("PUBLISH_COALESCE_SECONDS",
+                                          DEFAULT_COALESCE_SECONDS)),
+        on_published=outbox.mark_published)
+
+    processor = IncidentProcessor(
+        publisher, pool, NS,
+        queue_size=int(config.get("QUEUE_SIZE", DEFAULT_QUEUE_SIZE)),
+        load_workers=int(config.get("LOAD_WORKERS", DEFAULT_LOAD_WORKERS)),
+        incident_cache=incident_cache,
+        sweep_interval=float(config.get("CLEARANCE_SWEEP_SECONDS",
+                                        DEFAULT_SWEEP_INTERVAL_SECONDS)),
+        outbox=outbox,
+        replay_interval=float(config.get("OUTBOX_REPLAY_SECONDS",
+                                         DEFAULT_REPLAY_INTERVAL_SECONDS)))
+    processor.start()
+    return processor
 
 
 def get_stomp_conn(config: dict[str, str]):
-    """Returns STOMP connection."""
+    """Returns STOMP connection. It makes a single attempt to connect, as the
+       connection supervisor handles retrying."""
 
     return stomp.Connection12([(config["HOST"],
                                 config["STOMP_PORT"])],
                               heartbeats=(30000, 30000),
-                              reconnect_sleep_initial=1,
-                              reconnect_sleep_increase=1,
-                              reconnect_attempts_max=30)
+                              reconnect_attempts_max=1)
 
 
 def connect_and_subscribe(connection: stomp.StompConnection12, admin: str,
-                          passcode: str, sub_topic: str) -> None:
-    """Connects and subscribes to relevant topic."""
+                          passcode: str, sub_topic: str, client_id: str = None) -> None:
+    """Connects and subscribes to relevant topic. Each message must be acknowledged,
+       so any not yet recorded when the connection drops are redelivered. If a client
+       ID is given the subscription is durable, so the broker keeps messages sent while
+       disconnected."""
 
-    connection.connect(admin, passcode, wait=True)
-    connection.subscribe(destination=f'/topic/{sub_topic}', id=1, ack='auto')
+    connect_headers, subscribe_headers = {}, {}
+    if client_id:
+        connect_headers['client-id'] = client_id
+        subscribe_headers['activemq.subscriptionName'] = client_id
 
+    connection.connect(admin, passcode, wait=True, headers=connect_headers)
+    connection.subscribe(destination=f'/topic/{sub_topic}', id=1, ack='client-individual',
+                         headers=subscribe_headers)
 
-def maintain_connection(connection: stomp.Connection12) -> None:
-    """Maintains STOMP connection."""
 
+def open_connection(config: dict[str, str], processor: IncidentProcessor,
+                    supervisor: ConnectionSupervisor) -> stomp.Connection12:
+    """Returns a new subscribed STOMP connection with its own listener."""
+
+    conn = get_stomp_conn(config)
+    conn.set_listener('', TrainListener(processor, conn, supervisor))
     try:
-        logging.info('Listening for KB messages...')
-        while True:
-            sleep(1)
-    except KeyboardInterrupt:
-        logging.info('Exiting...')
-        connection.disconnect()
+        connect_and_subscribe(conn, config["USERNAME"], config["PASSWORD"],
+                              config["INCIDENTS_TOPIC"], config.get("CLIENT_ID"))
+    except Exception:
+        # The failed connection's events mustn't be mistaken for the next one's.
+        conn.remove_listener('')
+        raise
+    return conn
 
 
-def initialise_connection(config: dict[str, str], sns_client: BaseClient) -> None:
-    """Starts/resets connection."""
+def recover_gap(config: dict[str, str], processor: IncidentProcessor, gap: float) -> None:
+    """Runs after reconnecting. A durable subscription is redelivered everything sent
+       during the gap, otherwise those messages are lost and a warning is logged."""
 
-    conn = get_stomp_conn(config)
-    conn.set_listener('', TrainListener(sns_client, config))
-    connect_and_subscribe(conn, config["USERNAME"],
-                          config["PASSWORD"], config["INCIDENTS_TOPIC"])
-    maintain_connection(conn)
+    processor.increment("reconnects")
+    processor.increment("disconnected_seconds", gap)
+    if not config.get("CLIENT_ID"):
+        logging.warning('Messages sent in the last %.1f seconds may have been missed; '
+                        'set CLIENT_ID for a durable subscription', gap)
+
+
+def maintain_connection(supervisor: ConnectionSupervisor,
+                        processor: IncidentProcessor) -> None:
+    """Maintains STOMP connection, logging statistics periodically, until interrupted."""
+
+    def log_stats():
+        logging.info('Processing statistics: %s',
+                     {**processor.stats(), "connection": supervisor.stats()})
+
+    try:
+        logging.info('Listening for KB messages...')
+        supervisor.run(log_stats, STATS_INTERVAL_SECONDS)
+    except KeyboardInterrupt:
+        logging.info('Exiting...')
+        supervisor.stop()
+        processor.shutdown()
+        processor.pool.close()
+        if processor.outbox is not None:
+            processor.outbox.close()
+
+
+def initialise_connection(config: dict[str, str], sns_client: BaseClient,
+                          processor: IncidentProcessor = None) -> None:
+    """Starts the connection, reusing the incident processor if one is given, and
+       keeps it open under a supervisor that reconnects whenever it is lost."""
+
+    processor = processor or create_processor(sns_client, config)
+    supervisor = ConnectionSupervisor(
+        lambda: open_connection(config, processor, supervisor),
+        on_reconnected=lambda gap: recover_gap(config, processor, gap),
+        heartbeat_timeout=float(config.get("HEARTBEAT_TIMEOUT_SECONDS",
+                                           DEFAULT_HEARTBEAT_TIMEOUT_SECONDS)))
+    maintain_connection(supervisor, processor)
@@ -0,0 +1,100 @@
+"""An in-memory record of the last seen state of each incident, used to skip
+messages that the KB feed re-sends without any change."""
+
+from collections import OrderedDict
+from datetime import datetime
+import hashlib
+import json
+from threading import Lock
+
+from psycopg2.extensions import cursor
+
+DEFAULT_MAX_INCIDENTS = 10_000
+
+# The fields that make up an incident's content. A change to any of them is alerted.
+CONTENT_KEYS = ["operator_ref", "start_time", "end_time", "planned", "cleared",
+                "info_link", "routes_affected", "incident_priority", "summary"]
+
+# Incident times are stored without a time zone, having been converted to the
+# session's, so are converted back to be compared with incoming messages.
+SEED_QUERY = """
+    SELECT incident_uuid,
+    MAX(last_updated) AT TIME ZONE current_setting('TimeZone') AS last_updated
+    FROM incidents
+    GROUP BY incident_uuid
+    ORDER BY MAX(last_updated) DESC
+    LIMIT %s;
+    """
+
+
+def get_content_hash(data: dict) -> str:
+    """Returns a hash of the incident's content."""
+
+    content = json.dumps({key: data.get(key) for key in CONTENT_KEYS},
+                         sort_keys=True, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+class IncidentStateCache:
+    """Holds the last updated time and content hash of the most recently seen
+       incidents, keyed by incident number, evicting the least recently seen."""
+
+    def __init__(self, max_incidents: int = DEFAULT_MAX_INCIDENTS):
+        self.max_incidents = max_incidents
+        self.incidents = OrderedDict()
+        self._lock = Lock()
+
+    def seed(self, cur: cursor) -> None:
+        """Loads the last updated time of the most recently updated incidents from the
+           database. Their content isn't known, so an incident re-sent with the same
+           last updated time is taken to be unchanged."""
+
+        cur.execute(SEED_QUERY, (self.max_incidents,))
+        with self._lock:
+            for row in reversed(cur.fetchall()):
+                self._store(row["incident_uuid"], (row["last_updated"], None))
+
+    def _store(self, incident_number: str, state: tuple) -> None:
+        """Stores an incident's state as the most recently seen."""
+
+        self.incidents[incident_number] = state
+        self.incidents.move_to_end(incident_number)
+        if len(self.incidents) > self.max_incidents:
+            self.incidents.popitem(last=False)
+
+    def is_changed(self, data: dict, record: bool = True) -> bool:
+        """Returns whether an incident message is new or changes the incident's content,
+           recording its state if so and record is set. Messages older than the last
+           seen update, and re-sends whose content is unchanged, are not changes."""
+
+        incident_number = data["incident_number"]
+        last_updated = data["last_updated"]
+        content_hash = get_content_hash(data)
+
+        with self._lock:
+            seen = self.incidents.get(incident_number)
+            if seen is not None:
+                seen_last_updated, seen_hash = seen
+                self.incidents.move_to_end(incident_number)
+                if is_before(last_updated, seen_last_updated):
+                    return False
+                if seen_hash == content_hash or (
+                        seen_hash is None and last_updated == seen_last_updated):
+                    return False
+
+            if record:
+                self._store(incident_number, (last_updated, content_hash))
+            return True
+
+    def record(self, data: dict) -> None:
+        """Records an incident message's state as the last seen."""
+
+        with self._lock:
+            self._store(data["incident_number"],
+                        (data["last_updated"], get_content_hash(data)))
+
+
+def is_before(first: datetime, second: datetime) -> bool:
+    """Returns whether the first time is before the second, if both are known."""
+
+    return first is not None and second is not None and first < second
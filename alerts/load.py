@@ -1,8 +1,16 @@
 """Functions to load incident data into the RDS database"""
 
-from psycopg2 import connect
-from psycopg2.extras import RealDictCursor
-from psycopg2.extensions import connection
+from contextlib import contextmanager
+from collections.abc import Iterator
+import logging
+from threading import BoundedSemaphore, Lock
+from time import monotonic
+
+from psycopg2 import connect, InterfaceError, OperationalError
+from psycopg2.extras import execute_values, RealDictCursor
+from psycopg2.extensions import (connection, cursor, QueryCanceledError,
+                                 TransactionRollbackError, TRANSACTION_STATUS_UNKNOWN)
+from psycopg2.pool import ThreadedConnectionPool
 
 
 KEYS = ["created_at", "last_updated",
@@ -11,39 +19,177 @@ KEYS = ["created_at", "last_updated",
         "info_link", "routes_affected",
         "summary", "cleared"]
 
-UPDATE_OR_INSERT_QUERY = """
-    UPDATE incidents SET
-    operator_id = %s,
-    creation_date = %s,
-    last_updated = %s,
-    incident_uuid = %s,
-    start_date = %s,
-    end_date = %s,
-    is_planned = %s,
-    info_link = %s,
-    affected_routes = %s,
-    summary = %s,
-    is_cleared = %s
-    WHERE operator_id = %s AND incident_uuid = %s;
+DEFAULT_MAX_CONNECTIONS = 5
+
+# Connections idle for longer than this are checked with a round trip before use.
+HEALTH_CHECK_INTERVAL_SECONDS = 30
+
+RECONNECT_ATTEMPTS = 3
+
+# Deadlocks, serialization failures and cancelled statements are OperationalErrors,
+# but leave the connection usable, so the transaction is rolled back and retried.
+RETRYABLE_ERRORS = (TransactionRollbackError, QueryCanceledError)
+
+# Resolves operator codes to ids, adding any operators that don't exist yet.
+OPERATOR_IDS_QUERY = """
+    WITH input (operator_code, operator_name) AS (VALUES %s),
+    inserted AS (
+        INSERT INTO operators (operator_code, operator_name)
+        SELECT operator_code, operator_name FROM input
+        ON CONFLICT (operator_code) DO NOTHING
+        RETURNING operator_code, operator_id
+    )
+    SELECT operator_code, operator_id FROM inserted
+    UNION ALL
+    SELECT operator_code, operator_id FROM operators JOIN input USING (operator_code);
+    """
+
+# Inserts incidents, updating any that already exist unless the stored row is newer.
+UPSERT_INCIDENTS_QUERY = """
     INSERT INTO incidents (operator_id, creation_date, last_updated,
                     incident_uuid, start_date, end_date, is_planned,
                     info_link, affected_routes, summary, is_cleared)
-    SELECT %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-    WHERE NOT EXISTS (SELECT 1 FROM incidents WHERE operator_id = %s AND incident_uuid = %s);
+    VALUES %s
+    ON CONFLICT (operator_id, incident_uuid) DO UPDATE SET
+    creation_date = EXCLUDED.creation_date,
+    last_updated = EXCLUDED.last_updated,
+    start_date = EXCLUDED.start_date,
+    end_date = EXCLUDED.end_date,
+    is_planned = EXCLUDED.is_planned,
+    info_link = EXCLUDED.info_link,
+    affected_routes = EXCLUDED.affected_routes,
+    summary = EXCLUDED.summary,
+    is_cleared = EXCLUDED.is_cleared
+    WHERE EXCLUDED.last_updated >= incidents.last_updated;
+    """
+
+# Marks incidents whose end date has passed as cleared. Incident times are stored
+# without a time zone, having been converted to the session's, as LOCALTIMESTAMP is.
+CLEAR_ENDED_INCIDENTS_QUERY = """
+    UPDATE incidents SET is_cleared = TRUE
+    WHERE NOT is_cleared AND end_date <= LOCALTIMESTAMP;
     """
 
 
+def get_connection_params(config: dict[str, str]) -> dict:
+    """Returns the keyword arguments used to connect to the database."""
+
+    return {
+        "dbname": config["DB_NAME"],
+        "user": config.get("DB_USER"),
+        "password": config.get("DB_PASS"),
+        "host": config.get("DB_HOST"),
+        "port": config.get("DB_PORT", 5432),
+        "cursor_factory": RealDictCursor
+    }
+
+
 def get_db_connection(config: dict[str, str]) -> connection:
     """Returns a connection to the database."""
 
-    return connect(
-        dbname=config["DB_NAME"],
-        user=config.get("DB_USER"),
-        password=config.get("DB_PASS"),
-        host=config.get("DB_HOST"),
-        port=config.get("DB_PORT", 5432),
-        cursor_factory=RealDictCursor
-    )
+    return connect(**get_connection_params(config))
+
+
+class DatabasePool:
+    """A long-lived, thread-safe pool of database connections.
+       Connections are health checked before use and broken ones are replaced."""
+
+    def __init__(self, config: dict[str, str],
+                 max_connections: int = DEFAULT_MAX_CONNECTIONS):
+        self.config = config
+        self.max_connections = max_connections
+        self._pool = None
+        self._last_used = {}
+        self._lock = Lock()
+        self._available = BoundedSemaphore(max_connections)
+
+    def _get_pool(self) -> ThreadedConnectionPool:
+        """Returns the underlying pool, creating it on first use
+           (or after the database was unreachable)."""
+
+        with self._lock:
+            if self._pool is None:
+                # psycopg2 closes returned connections beyond minconn, so keep them all.
+                self._pool = ThreadedConnectionPool(
+                    self.max_connections, self.max_connections,
+                    **get_connection_params(self.config))
+            return self._pool
+
+    def _is_healthy(self, conn: connection) -> bool:
+        """Returns whether a pooled connection is usable, checking connections
+           that have been idle for a while with a round trip."""
+
+        if conn.closed or conn.info.transaction_status == TRANSACTION_STATUS_UNKNOWN:
+            return False
+
+        if monotonic() - self._last_used.get(id(conn), 0) < HEALTH_CHECK_INTERVAL_SECONDS:
+            return True
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except (OperationalError, InterfaceError):
+            return False
+
+    def _get_healthy_connection(self, pool: ThreadedConnectionPool) -> connection:
+        """Takes a connection from the pool, replacing any that are broken."""
+
+        for _ in range(self.max_connections):
+            conn = pool.getconn()
+            if self._is_healthy(conn):
+                return conn
+            logging.warning('Discarding broken database connection')
+            self._discard(pool, conn)
+        return pool.getconn()
+
+    def _discard(self, pool: ThreadedConnectionPool, conn: connection) -> None:
+        """Closes a connection and removes it from the pool."""
+
+        self._last_used.pop(id(conn), None)
+        pool.putconn(conn, close=True)
+
+    @contextmanager
+    def transaction(self) -> Iterator[connection]:
+        """Yields a healthy connection for a single transaction, which is committed
+           if the block succeeds and rolled back otherwise. Connections that fail
+           with a connection error are discarded rather than returned to the pool,
+           but those whose transaction failed through contention are kept.
+           Blocks while every connection is in use."""
+
+        with self._available:
+            pool = self._get_pool()
+            conn = self._get_healthy_connection(pool)
+            try:
+                yield conn
+                conn.commit()
+            except RETRYABLE_ERRORS:
+                conn.rollback()
+                pool.putconn(conn)
+                raise
+            except (OperationalError, InterfaceError):
+                self._discard(pool, conn)
+                # The other pooled connections have probably failed too (e.g. the
+                # database restarted), so check each of them before its next use.
+                self._last_used.clear()
+                raise
+            except Exception:
+                conn.rollback()
+                pool.putconn(conn)
+                raise
+
+            self._last_used[id(conn)] = monotonic()
+            pool.putconn(conn)
+
+    def close(self) -> None:
+        """Closes every connection in the pool."""
+
+        with self._lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+                self._last_used.clear()
 
 
 def get_values_for_insertion(data: dict) -> tuple:
@@ -52,55 +198,82 @@ def get_values_for_insertion(data: dict) -> tuple:
     return tuple(data[key] for key in KEYS)
 
 
-def insert_into_db(config: dict[str, str], val: tuple) -> None:
-    """Inserts data into database as a new row if incident doesn't exist.
-       Updates row if incident already exists."""
+def insert_into_db(cur: cursor, rows: list[tuple]) -> None:
+    """Inserts incident rows into the database in a single statement,
+       updating rows for incidents that already exist."""
+
+    execute_values(cur, UPSERT_INCIDENTS_QUERY, rows)
+
+
+def get_operator_ids(cur: cursor, operators: dict[str, str]) -> dict[str, int]:
+    """Returns a mapping of operator code to id for the given operator codes and names,
+       adding any operators that don't exist to the database."""
 
-    conn = get_db_connection(config)
-    with conn.cursor() as cur:
-        cur.execute(UPDATE_OR_INSERT_QUERY, val)
-        conn.commit()
-        conn.close()
+    rows = execute_values(cur, OPERATOR_IDS_QUERY, list(operators.items()), fetch=True)
+    operator_ids = {row["operator_code"]: int(row["operator_id"]) for row in rows}
 
+    # An operator inserted by another load worker at the same time is skipped by the
+    # insert but isn't visible to the statement's snapshot. The insert waits for that
+    # worker's commit, so a second statement sees the operator.
+    missing = {code: name for code, name in operators.items() if code not in operator_ids}
+    if missing:
+        rows = execute_values(cur, OPERATOR_IDS_QUERY, list(missing.items()), fetch=True)
+        operator_ids.update(
+            {row["operator_code"]: int(row["operator_id"]) for row in rows})
 
-def get_operator_id(config: dict[str, str], operator_code: str, operator_name: str) -> int:
-    """Retrieves relevant operator id from the database.
-       If id doesn't exist, executes function to add and return operator id."""
+    return operator_ids
 
-    conn = get_db_connection(config)
-    with conn.cursor() as cur:
-        cur.execute("""SELECT operator_id FROM operators
-                     WHERE operator_code = %s""", (operator_code,))
-        op_id = cur.fetchone()
-        if op_id:
-            conn.close()
-            return int(op_id["operator_id"])
-        op_id = add_operator_id(config, operator_code, operator_name)
-        return op_id
 
+def get_incident_rows(incidents: list[dict], operator_ids: dict[str, int]) -> list[tuple]:
+    """Returns a row for every operator affected by each incident. If an incident
+       appears more than once, only its last version is kept."""
 
-def add_operator_id(config: dict[str, str], operator_code: str, operator_name: str) -> int:
-    """Adds operator code and name to database."""
+    rows = {}
+    for data in incidents:
+        for operator_code in data["operator_ref"]:
+            operator_id = operator_ids[operator_code]
+            rows[(operator_id, data["incident_number"])] = (
+                (operator_id,) + get_values_for_insertion(data))
+    return list(rows.values())
 
-    conn = get_db_connection(config)
-    with conn.cursor() as cur:
-        cur.execute("""INSERT INTO operators ("operator_name", "operator_code")
-        VALUES (%s, %s)
-        RETURNING operator_id;""", (operator_name, operator_code))
-        conn.commit()
-        op_id = cur.fetchone()
-        conn.close()
-        return int(op_id["operator_id"])
 
+def load_incidents_to_database(pool: DatabasePool, incidents: list[dict]) -> None:
+    """Prepares and loads a batch of incidents to the database in a single transaction,
+       retrying if it is rolled back through contention, or on a fresh connection if
+       the connection is lost."""
 
-def load_data_to_database(config: dict[str, str], data: dict) -> None:
+    operators = {}
+    for data in incidents:
+        operators.update(zip(data["operator_ref"], data["operator_name"]))
+
+    for attempt in range(1, RECONNECT_ATTEMPTS + 1):
+        try:
+            with pool.transaction() as conn, conn.cursor() as cur:
+                operator_ids = get_operator_ids(cur, operators) if operators else {}
+                rows = get_incident_rows(incidents, operator_ids)
+                if rows:
+                    insert_into_db(cur, rows)
+            return
+        except RETRYABLE_ERRORS as err:
+            if attempt == RECONNECT_ATTEMPTS:
+                raise
+            logging.warning('Transaction rolled back (%s), retrying...', err)
+        except OperationalError as err:
+            if attempt == RECONNECT_ATTEMPTS:
+                raise
+            logging.warning('Database connection lost (%s), reconnecting...', err)
+
+
+def load_data_to_database(pool: DatabasePool, data: dict) -> None:
     """Prepares and loads incident data to database."""
 
-    operators = dict(zip(data["operator_ref"], data["operator_name"]))
-    incident_uuid = data["incident_number"]
+    load_incidents_to_database(pool, [data])
+
+
+def clear_ended_incidents(pool: DatabasePool) -> int:
+    """Marks every incident whose end date has passed as cleared,
+       returning the number of incidents cleared."""
 
-    for operator_code, operator_name in operators.items():
-        operator_id = get_operator_id(config, operator_code, operator_name)
-        insert_values = (
-            (operator_id,) + get_values_for_insertion(data) + (operator_id, incident_uuid))*2
-        insert_into_db(config, insert_values)
+    with pool.transaction() as conn, conn.cursor() as cur:
+        cur.execute(CLEAR_ENDED_INCIDENTS_QUERY)
+        return cur.rowcount
@@ -0,0 +1,114 @@
+"""A durable on-disk outbox of transformed incidents. Each incident is recorded before
+it is published or loaded and removed once both have succeeded, so that incidents
+still pending after a crash or an outage can be replayed on restart."""
+
+from datetime import datetime
+import json
+import sqlite3
+from threading import Lock
+
+DEFAULT_OUTBOX_PATH = "outbox.sqlite3"
+
+# How long to wait for a previous process to release the outbox when starting.
+OPEN_TIMEOUT_SECONDS = 60
+
+TIMESTAMP_KEYS = ['created_at', 'last_updated', 'start_time', 'end_time']
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS outbox (
+        outbox_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        incident_number TEXT NOT NULL,
+        data TEXT NOT NULL,
+        publish_pending INTEGER NOT NULL DEFAULT 1,
+        load_pending INTEGER NOT NULL DEFAULT 1
+    );
+    """
+
+
+def encode_incident(data: dict) -> str:
+    """Returns a transformed incident as JSON, with its timestamps in ISO 8601."""
+
+    return json.dumps(data, default=datetime.isoformat)
+
+
+def decode_incident(text: str) -> dict:
+    """Returns a transformed incident from its JSON encoding."""
+
+    data = json.loads(text)
+    for key in TIMESTAMP_KEYS:
+        if data.get(key):
+            data[key] = datetime.fromisoformat(data[key])
+    return data
+
+
+class Outbox:
+    """Records incidents in a SQLite database until they have been both published
+       and loaded."""
+
+    def __init__(self, path: str = DEFAULT_OUTBOX_PATH):
+        self.path = path
+        self._lock = Lock()
+        self._conn = sqlite3.connect(path, timeout=OPEN_TIMEOUT_SECONDS,
+                                     check_same_thread=False)
+        # Only one process may use the outbox at a time. Exclusive locking also keeps
+        # write-ahead logging off shared memory, so it works on a network file system
+        # such as EFS, where the outbox is kept in production.
+        self._conn.execute("PRAGMA locking_mode = EXCLUSIVE;")
+        # Write-ahead logging keeps each commit to a single append. Synchronous NORMAL
+        # survives a crash of the process, though not necessarily of the host.
+        self._conn.execute("PRAGMA journal_mode = WAL;")
+        self._conn.execute("PRAGMA synchronous = NORMAL;")
+        self._conn.executescript(SCHEMA)
+
+    def add(self, data: dict) -> int:
+        """Records an incident as pending both publishing and loading, returning its id."""
+
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "INSERT INTO outbox (incident_number, data) VALUES (?, ?);",
+                (data["incident_number"], encode_incident(data)))
+            return cur.lastrowid
+
+    def mark_published(self, outbox_ids: list[int]) -> None:
+        """Records that incidents have been published."""
+
+        self._mark(outbox_ids, "publish_pending")
+
+    def mark_loaded(self, outbox_ids: list[int]) -> None:
+        """Records that incidents have been loaded."""
+
+        self._mark(outbox_ids, "load_pending")
+
+    def _mark(self, outbox_ids: list[int], column: str) -> None:
+        """Clears a pending flag for incidents, removing those with nothing left to do."""
+
+        if not outbox_ids:
+            return
+
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"UPDATE outbox SET {column} = 0 WHERE outbox_id = ?;",
+                [(outbox_id,) for outbox_id in outbox_ids])
+            self._conn.execute(
+                "DELETE FROM outbox WHERE publish_pending = 0 AND load_pending = 0;")
+
+    def pending(self) -> list[tuple[int, dict, bool, bool]]:
+        """Returns every incident still pending, oldest first, as tuples of
+           (outbox id, incident, publish pending, load pending)."""
+
+        with self._lock:
+            rows = self._conn.execute(
+                """SELECT outbox_id, data, publish_pending, load_pending
+                   FROM outbox ORDER BY outbox_id;""").fetchall()
+        return [(outbox_id, decode_incident(data), bool(publish), bool(load))
+                for outbox_id, data, publish, load in rows]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbox;").fetchone()[0]
+
+    def close(self) -> None:
+        """Closes the outbox database."""
+
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,332 @@
+"""A bounded queue and worker pools that process incident messages off the STOMP
+receiver thread. Each message is parsed once, then handed to an alert publisher and a
+pool of load workers, so that a slow database never delays alerts to subscribers.
+Incidents re-sent without any change are skipped if an incident state cache is given.
+If an outbox is given, each incident is recorded in it before the message is
+acknowledged. Incidents not yet published or loaded are replayed on start, and then
+periodically, so that those whose load or alert failed are tried again."""
+
+from collections import Counter
+import logging
+from queue import Queue, Empty, Full
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import Callable
+
+from transform import transform_data
+from load import load_incidents_to_database, clear_ended_incidents, DatabasePool
+from incident_cache import IncidentStateCache
+from publish import AlertPublisher
+from outbox import Outbox
+
+DEFAULT_QUEUE_SIZE = 1000
+DEFAULT_LOAD_WORKERS = 4
+DEFAULT_DRAIN_TIMEOUT_SECONDS = 30
+DEFAULT_SWEEP_INTERVAL_SECONDS = 300
+DEFAULT_REPLAY_INTERVAL_SECONDS = 60
+
+# The most incidents written to the database in one statement.
+MAX_LOAD_BATCH = 100
+
+# Placed on a queue to tell the worker reading it to stop.
+STOP = object()
+
+# Placed on the intake queue to replay the outbox. Replaying on the parse thread, which
+# is the only one adding to the outbox, means no incident is replayed while it is
+# between being recorded and being handed on.
+REPLAY = object()
+
+
+class IncidentProcessor:
+    """Processes incident messages on background threads. Messages wait in bounded
+       queues, and the receiver thread blocks when the intake queue is full.
+       If a sweep interval is given, ended incidents are also periodically cleared,
+       and if an outbox is given, it is replayed every replay_interval seconds."""
+
+    def __init__(self, publisher: AlertPublisher, pool: DatabasePool,
+                 namespaces: dict, queue_size: int = DEFAULT_QUEUE_SIZE,
+                 load_workers: int = DEFAULT_LOAD_WORKERS,
+                 incident_cache: IncidentStateCache = None,
+                 sweep_interval: float = None, outbox: Outbox = None,
+                 replay_interval: float = DEFAULT_REPLAY_INTERVAL_SECONDS):
+        self.publisher = publisher
+        self.pool = pool
+        self.namespaces = namespaces
+        self.incident_cache = incident_cache
+        self.sweep_interval = sweep_interval
+        self.outbox = outbox
+        self.replay_interval = replay_interval
+        self._stopping = Event()
+
+        self.intake = Queue(maxsize=queue_size)
+        # Each incident is always loaded by the same worker, so its updates are
+        # written in the order they were received.
+        self.load_queues = [Queue(maxsize=queue_size) for _ in range(load_workers)]
+
+        self.counters = Counter()
+        self.high_water_marks = Counter()
+        # The outbox ids of the incidents queued for or being loaded.
+        self.loading = set()
+        self._lock = Lock()
+
+        self.threads = {
+            "parse": [Thread(target=self._parse_worker, name="parse", daemon=True)],
+            "load": [Thread(target=self._load_worker, args=(queue,), name=f"load-{index}",
+                            daemon=True)
+                     for index, queue in enumerate(self.load_queues)],
+            "sweep": [Thread(target=self._sweep_worker, name="sweep", daemon=True)]
+                     if sweep_interval else [],
+            "replay": [Thread(target=self._replay_worker, name="replay", daemon=True)]
+                      if outbox is not None else [],
+        }
+
+    def start(self) -> None:
+        """Starts the publisher and the worker threads, then replays any incidents left
+           pending in the outbox."""
+
+        self.publisher.start()
+        for threads in self.threads.values():
+            for thread in threads:
+                thread.start()
+
+        if self.outbox is not None:
+            self.intake.put(REPLAY)
+
+    def replay_outbox(self) -> None:
+        """Publishes and loads every incident in the outbox that is still pending and
+           isn't waiting in the publisher or the load queues, such as those left from
+           before the last shutdown or whose alert or load has failed since."""
+
+        publishing = self.publisher.outbox_ids_in_flight()
+        with self._lock:
+            loading = set(self.loading)
+
+        replayed = 0
+        for outbox_id, message, publish_pending, load_pending in self.outbox.pending():
+            received = monotonic()
+            publish = publish_pending and outbox_id not in publishing
+            load = load_pending and outbox_id not in loading
+            if publish:
+                self.publisher.submit(message, received=received, outbox_id=outbox_id)
+            if load:
+                self._queue_load(received, message, outbox_id)
+            replayed += publish or load
+
+        if replayed:
+            logging.info('Replaying %s incident(s) from the outbox', replayed)
+        self.increment("replayed", replayed)
+
+    def submit(self, body: str, ack: Callable[[], None] = None) -> None:
+        """Queues a raw message for processing, blocking while the intake queue is full
+           so that a backlog pushes back on the broker rather than growing memory.
+           The ack callback, if given, is called once the message needs no redelivery."""
+
+        self._put("intake", self.intake, (monotonic(), body, ack))
+
+    def _put(self, name: str, queue: Queue, item: object) -> None:
+        """Puts an item on a queue, recording how long producers are held up when it is
+           full and how deep it gets."""
+
+        try:
+            queue.put_nowait(item)
+        except Full:
+            start = monotonic()
+            queue.put(item)
+            self.increment(f"{name}_full")
+            self.increment(f"{name}_blocked_seconds", monotonic() - start)
+
+        with self._lock:
+            self.high_water_marks[name] = max(self.high_water_marks[name], queue.qsize())
+
+    def increment(self, name: str, value: float = 1) -> None:
+        """Increments the named counter."""
+
+        with self._lock:
+            self.counters[name] += value
+
+    def _parse_worker(self) -> None:
+        """Parses raw messages and hands them to the publisher and load workers."""
+
+        while (item := self.intake.get()) is not STOP:
+            if item is REPLAY:
+                try:
+                    self.replay_outbox()
+                except Exception:  # pylint: disable=broad-except
+                    logging.exception('Failed to replay the outbox')
+                    self.increment("replay_failed")
+                continue
+
+            received, body, ack = item
+            try:
+                self._process(received, body)
+            except Exception:  # pylint: disable=broad-except
+                # Left unacknowledged, so the broker redelivers it.
+                logging.exception('Failed to record message in the outbox')
+                self.increment("outbox_failed")
+                continue
+
+            if ack:
+                self._acknowledge(ack)
+
+    def _process(self, received: float, body: str) -> None:
+        """Parses a raw message, records it in the outbox and hands it to the publisher
+           and load workers. Messages that can't be parsed are logged and dropped."""
+
+        try:
+            message = transform_data(body, self.namespaces)
+        except Exception:  # pylint: disable=broad-except
+            logging.exception('Failed to parse message')
+            self.increment("parse_failed")
+            return
+
+        if not message:
+            return
+
+        # The incident's state is only recorded once it is in the outbox, so that a
+        # message redelivered after a failed outbox write isn't skipped as unchanged.
+        if self.incident_cache and not self.incident_cache.is_changed(message, record=False):
+            logging.info('Skipping unchanged incident %s', message["incident_number"])
+            self.increment("unchanged")
+            return
+
+        outbox_id = self.outbox.add(message) if self.outbox is not None else None
+        if self.incident_cache:
+            self.incident_cache.record(message)
+
+        logging.info('Data has been cleaned, incident ID = %s',
+                     message["incident_number"])
+        self.increment("parsed")
+        self.publisher.submit(message, received=received, outbox_id=outbox_id)
+        self._queue_load(received, message, outbox_id)
+
+    def _acknowledge(self, ack: Callable[[], None]) -> None:
+        """Acknowledges a message. A failed acknowledgement only means the broker may
+           redeliver the message, so is logged rather than raised."""
+
+        try:
+            ack()
+        except Exception:  # pylint: disable=broad-except
+            logging.exception('Failed to acknowledge message')
+            self.increment("ack_failed")
+
+    def _queue_load(self, received: float, message: dict, outbox_id: int = None) -> None:
+        """Queues an incident for the load worker that handles it."""
+
+        if outbox_id is not None:
+            with self._lock:
+                self.loading.add(outbox_id)
+
+        load_queue = hash(message["incident_number"]) % len(self.load_queues)
+        self._put("load", self.load_queues[load_queue], (received, message, outbox_id))
+
+    def _load_worker(self, queue: Queue) -> None:
+        """Loads parsed messages into the database, writing everything that has queued
+           up since the last write (up to MAX_LOAD_BATCH messages) in one batch."""
+
+        stopping = False
+        while not stopping:
+            batch = []
+            while len(batch) < MAX_LOAD_BATCH:
+                try:
+                    item = queue.get(block=not batch)
+                except Empty:
+                    break
+                if item is STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            if not batch:
+                continue
+
+            messages = [message for _, message, _ in batch]
+            outbox_ids = [outbox_id for _, _, outbox_id in batch if outbox_id is not None]
+            try:
+                self._load_batch(messages, outbox_ids)
+            finally:
+                # Whether loaded or not, the incidents can be replayed from now on.
+                with self._lock:
+                    self.loading.difference_update(outbox_ids)
+
+    def _load_batch(self, messages: list[dict], outbox_ids: list[int]) -> None:
+        """Loads a batch of incidents and records them as loaded in the outbox.
+           Incidents that fail to load stay pending in the outbox and are replayed."""
+
+        try:
+            load_incidents_to_database(self.pool, messages)
+        except Exception:  # pylint: disable=broad-except
+            logging.exception('Failed to load incidents %s',
+                              [message["incident_number"] for message in messages])
+            self.increment("load_failed", len(messages))
+            return
+
+        if self.outbox is not None:
+            try:
+                self.outbox.mark_loaded(outbox_ids)
+            except Exception:  # pylint: disable=broad-except
+                # The incidents stay pending in the outbox, so are loaded again
+                # when replayed, which the upsert makes harmless.
+                logging.exception('Failed to record loaded incidents in the outbox')
+                self.increment("outbox_failed")
+
+        logging.info('%s incident(s) inserted into database', len(messages))
+        self.increment("loaded", len(messages))
+        self.increment("load_batches")
+
+    def _sweep_worker(self) -> None:
+        """Periodically marks incidents whose end date has passed as cleared."""
+
+        while not self._stopping.wait(self.sweep_interval):
+            try:
+                cleared = clear_ended_incidents(self.pool)
+            except Exception:  # pylint: disable=broad-except
+                logging.exception('Failed to clear ended incidents')
+                self.increment("sweep_failed")
+                continue
+
+            if cleared:
+                logging.info('Cleared %s ended incident(s)', cleared)
+            self.increment("swept", cleared)
+
+    def _replay_worker(self) -> None:
+        """Periodically has the parse worker replay the outbox."""
+
+        while not self._stopping.wait(self.replay_interval):
+            self._put("intake", self.intake, REPLAY)
+
+    def stats(self) -> dict:
+        """Returns the current queue depths, their high-water marks and the counters."""
+
+        with self._lock:
+            return {
+                "queue_depths": {
+                    "intake": self.intake.qsize(),
+                    "load": sum(queue.qsize() for queue in self.load_queues),
+                },
+                "high_water_marks": dict(self.high_water_marks),
+                "counters": dict(self.counters),
+                "publish": self.publisher.stats(),
+            }
+
+    def shutdown(self, timeout: float = DEFAULT_DRAIN_TIMEOUT_SECONDS) -> bool:
+        """Stops accepting work once every queued message has been processed, waiting up
+           to timeout seconds in total. Returns whether the queues were fully drained."""
+
+        deadline = monotonic() + timeout
+
+        self._stopping.set()
+        self.intake.put(STOP)
+        for thread in self.threads["parse"]:
+            thread.join(max(deadline - monotonic(), 0))
+
+        for queue in self.load_queues:
+            queue.put(STOP)
+
+        published = self.publisher.close(max(deadline - monotonic(), 0))
+        for thread in self.threads["load"] + self.threads["sweep"] + self.threads["replay"]:
+            thread.join(max(deadline - monotonic(), 0))
+
+        drained = published and not any(
+            thread.is_alive() for threads in self.threads.values() for thread in threads)
+        logging.info('Processor stopped (drained = %s): %s', drained, self.stats())
+        return drained
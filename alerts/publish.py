@@ -1,10 +1,24 @@
 """Functions to publish sms and email messages to SNS topic with attributes attached."""
 
+from collections import Counter
+from dataclasses import dataclass, field
 import json
 import logging
+import random
+from threading import Condition, Thread
+from time import monotonic
+from typing import Callable
 
 from botocore.client import BaseClient, ClientError
+from botocore.exceptions import BotoCoreError
 
+# The most entries SNS accepts in a single publish_batch call.
+MAX_BATCH_SIZE = 10
+
+DEFAULT_COALESCE_SECONDS = 2.0
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BASE_DELAY_SECONDS = 0.5
+DEFAULT_MAX_DELAY_SECONDS = 20.0
 
 OPERATORS = {'VT': 'Avanti West Coast',
              'CC': 'c2c',
@@ -145,3 +159,248 @@ def send_alerts(sns_client: BaseClient, data: dict, topic: str) -> None:
     attributes = get_message_attributes(operators)
     publish_multi_message_with_attributes(
         sns_client, topic, subject, msg, msg, attributes)
+
+
+def create_batch_entry(data: dict) -> dict:
+    """Returns a publish_batch request entry (without an Id) for an incident,
+       with the same content as send_alerts publishes."""
+
+    operators = convert_toc_code_to_name(data["operator_ref"])
+    msg = create_message(data, operators)
+    return {
+        "Message": json.dumps({"default": "default message", "sms": msg, "email": msg}),
+        "Subject": create_subject(data, operators),
+        "MessageStructure": "json",
+        "MessageAttributes": get_message_attributes(operators),
+    }
+
+
+@dataclass
+class PendingAlert:
+    """An alert waiting to be published, with when it was first submitted,
+       when it is next due to be sent, how many attempts have failed and the outbox
+       entries it covers."""
+
+    topic: str
+    incident_number: str
+    entry: dict
+    submitted: float
+    due: float
+    attempts: int = 0
+    outbox_ids: list[int] = field(default_factory=list)
+
+
+class AlertPublisher:
+    """Publishes incident alerts with SNS publish_batch on a background thread.
+
+       Alerts wait for a short coalescing window, during which a later update to the
+       same incident replaces the pending alert, so that a burst of updates sends one
+       alert. Due alerts are sent in batches per topic, and failed entries are retried
+       with jittered exponential backoff. Once an alert is published, or rejected by SNS
+       as invalid, the outbox ids it covers are passed to on_published, if given."""
+
+    def __init__(self, sns_client: BaseClient, topic_arn: str,
+                 coalesce_seconds: float = DEFAULT_COALESCE_SECONDS,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                 base_delay: float = DEFAULT_BASE_DELAY_SECONDS,
+                 max_delay: float = DEFAULT_MAX_DELAY_SECONDS,
+                 on_published: Callable[[list[int]], None] = None):
+        self.sns_client = sns_client
+        self.topic_arn = topic_arn
+        self.coalesce_seconds = coalesce_seconds
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.on_published = on_published
+
+        self.pending = {}
+        self.sending = set()
+        self.counters = Counter()
+        self.max_latency = 0.0
+        self._closing = False
+        self._condition = Condition()
+        self._thread = Thread(target=self._run, name="publisher", daemon=True)
+
+    def start(self) -> None:
+        """Starts the publishing thread."""
+
+        self._thread.start()
+
+    def submit(self, data: dict, topic: str = None, received: float = None,
+               outbox_id: int = None) -> None:
+        """Queues an alert for an incident, replacing any alert for the same incident
+           that has not been sent yet. Publish latency is measured from when the
+           message was received (a monotonic time), if given."""
+
+        topic = topic or self.topic_arn
+        key = (topic, data["incident_number"])
+        entry = create_batch_entry(data)
+
+        with self._condition:
+            now = monotonic()
+            pending = self.pending.get(key)
+            if pending:
+                pending.entry = entry
+                pending.attempts = 0
+                self.counters["coalesced"] += 1
+            else:
+                pending = self.pending[key] = PendingAlert(
+                    topic, data["incident_number"], entry, received or now,
+                    now + self.coalesce_seconds)
+            if outbox_id is not None:
+                pending.outbox_ids.append(outbox_id)
+            self._condition.notify()
+
+    def _take_due(self) -> list[PendingAlert]:
+        """Waits until any alerts are due, then removes and returns them.
+           Returns an empty list once closed with nothing left to send."""
+
+        with self._condition:
+            while True:
+                if self._closing and not self.pending:
+                    return []
+
+                now = monotonic()
+                due = [key for key, alert in self.pending.items() if alert.due <= now]
+                if due:
+                    alerts = [self.pending.pop(key) for key in due]
+                    self.sending = {outbox_id for alert in alerts
+                                    for outbox_id in alert.outbox_ids}
+                    return alerts
+
+                next_due = min((alert.due for alert in self.pending.values()), default=None)
+                self._condition.wait(None if next_due is None else next_due - now)
+
+    def _run(self) -> None:
+        """Sends alerts as they become due, until closed. An unexpected error only loses
+           the batch being sent, so that one bad batch can't stop all publishing."""
+
+        while alerts := self._take_due():
+            by_topic = {}
+            for alert in alerts:
+                by_topic.setdefault(alert.topic, []).append(alert)
+
+            for topic, topic_alerts in by_topic.items():
+                for start in range(0, len(topic_alerts), MAX_BATCH_SIZE):
+                    batch = topic_alerts[start:start + MAX_BATCH_SIZE]
+                    try:
+                        self._publish_batch(topic, batch)
+                    except Exception:  # pylint: disable=broad-except
+                        logging.exception("Failed to publish alerts for incidents %s.",
+                                          [alert.incident_number for alert in batch])
+                        with self._condition:
+                            self.counters["errors"] += 1
+
+            with self._condition:
+                self.sending = set()
+
+    def _publish_batch(self, topic: str, alerts: list[PendingAlert]) -> None:
+        """Publishes up to MAX_BATCH_SIZE alerts to a topic in one call,
+           scheduling retries for any that fail."""
+
+        entries = [{"Id": str(index), **alert.entry} for index, alert in enumerate(alerts)]
+
+        try:
+            response = self.sns_client.publish_batch(
+                TopicArn=topic, PublishBatchRequestEntries=entries)
+        except (ClientError, BotoCoreError):
+            logging.exception("Couldn't publish batch to topic %s.", topic)
+            for alert in alerts:
+                self._retry(alert)
+            return
+
+        now = monotonic()
+        published_ids = []
+        # Resending can't fix an alert SNS rejects as invalid, so it is done with too.
+        rejected_ids = [outbox_id for result in response.get("Failed", [])
+                        if result.get("SenderFault")
+                        for outbox_id in alerts[int(result["Id"])].outbox_ids]
+        with self._condition:
+            self.counters["batches"] += 1
+            for result in response.get("Successful", []):
+                alert = alerts[int(result["Id"])]
+                latency = now - alert.submitted
+                self.counters["published"] += 1
+                self.counters["latency_seconds"] += latency
+                self.max_latency = max(self.max_latency, latency)
+                published_ids.extend(alert.outbox_ids)
+
+        published_ids.extend(rejected_ids)
+        if self.on_published and published_ids:
+            try:
+                self.on_published(published_ids)
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Failed to record %s published alert(s).",
+                                  len(published_ids))
+                with self._condition:
+                    self.counters["on_published_failed"] += 1
+
+        for result in response.get("Failed", []):
+            alert = alerts[int(result["Id"])]
+            logging.warning("Failed to publish alert for incident %s: %s %s",
+                            alert.incident_number, result.get("Code"), result.get("Message"))
+            if result.get("SenderFault"):
+                with self._condition:
+                    self.counters["failed"] += 1
+            else:
+                self._retry(alert)
+
+        logging.info("Published %s alert(s) to topic %s.",
+                     len(response.get("Successful", [])), topic)
+
+    def _retry(self, alert: PendingAlert) -> None:
+        """Schedules a failed alert to be sent again after a jittered, exponentially
+           increasing delay, unless it has run out of attempts or been superseded."""
+
+        alert.attempts += 1
+        if alert.attempts >= self.max_attempts:
+            logging.error("Giving up on alert for incident %s after %s attempts.",
+                          alert.incident_number, alert.attempts)
+            with self._condition:
+                self.counters["failed"] += 1
+            return
+
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** alert.attempts))
+        with self._condition:
+            self.counters["retried"] += 1
+            key = (alert.topic, alert.incident_number)
+            if key in self.pending:
+                # The newer alert for the incident covers this one once it is sent.
+                self.pending[key].outbox_ids.extend(alert.outbox_ids)
+            else:
+                alert.due = monotonic() + delay
+                self.pending[key] = alert
+            self._condition.notify()
+
+    def outbox_ids_in_flight(self) -> set[int]:
+        """Returns the outbox ids of the alerts waiting to be sent or being sent."""
+
+        with self._condition:
+            return self.sending.union(
+                outbox_id for alert in self.pending.values() for outbox_id in alert.outbox_ids)
+
+    def stats(self) -> dict:
+        """Returns the publishing counters and the mean and maximum publish latency."""
+
+        with self._condition:
+            stats = dict(self.counters)
+            stats["pending"] = len(self.pending)
+            stats["max_latency_seconds"] = self.max_latency
+            if self.counters["published"]:
+                stats["mean_latency_seconds"] = (self.counters["latency_seconds"]
+                                                 / self.counters["published"])
+            return stats
+
+    def close(self, timeout: float = None) -> bool:
+        """Sends every pending alert without waiting for the coalescing window, then stops.
+           Returns whether everything was sent within the timeout."""
+
+        with self._condition:
+            self._closing = True
+            now = monotonic()
+            for alert in self.pending.values():
+                alert.due = min(alert.due, now)
+            self._condition.notify()
+
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
@@ -0,0 +1,142 @@
+"""A supervisor that keeps a single connection to the KB feed open, reconnecting with
+jittered exponential backoff as soon as it is lost or falls silent. Listener callbacks
+only notify the supervisor, so they never block the receiver thread."""
+
+from collections import Counter
+import logging
+import random
+from threading import Event, Lock
+from time import monotonic
+from typing import Any, Callable
+from weakref import WeakSet
+
+DEFAULT_HEARTBEAT_TIMEOUT_SECONDS = 90.0
+DEFAULT_BASE_DELAY_SECONDS = 0.5
+DEFAULT_MAX_DELAY_SECONDS = 60.0
+
+
+class ConnectionSupervisor:
+    """Opens a connection with connect and replaces it whenever it is reported lost, or
+       when nothing has been heard on it for heartbeat_timeout seconds. The first
+       reconnection attempt is immediate, and later ones back off. After reconnecting,
+       on_reconnected is called with how many seconds passed since anything was last
+       received, which is the window in which messages may have been missed."""
+
+    def __init__(self, connect: Callable[[], Any],
+                 on_reconnected: Callable[[float], None] = None,
+                 heartbeat_timeout: float = DEFAULT_HEARTBEAT_TIMEOUT_SECONDS,
+                 base_delay: float = DEFAULT_BASE_DELAY_SECONDS,
+                 max_delay: float = DEFAULT_MAX_DELAY_SECONDS):
+        self.connect = connect
+        self.on_reconnected = on_reconnected
+        self.heartbeat_timeout = heartbeat_timeout
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.connection = None
+        self.retired = WeakSet()
+        self.last_activity = monotonic()
+        self.counters = Counter()
+        self._lost = Event()
+        self._stopping = Event()
+        self._lock = Lock()
+
+    def notify_alive(self) -> None:
+        """Records that a message or heartbeat has been received."""
+
+        self.last_activity = monotonic()
+
+    def notify_lost(self, connection: Any = None) -> None:
+        """Reports that a connection has been lost. Reports about a connection that has
+           already been closed by the supervisor are ignored."""
+
+        if connection is None or connection not in self.retired:
+            self._lost.set()
+
+    def run(self, on_tick: Callable[[], None] = None, tick_interval: float = 60) -> None:
+        """Connects, then keeps the connection open until stopped, calling on_tick
+           every tick_interval seconds."""
+
+        self._reconnect()
+        next_tick = monotonic() + tick_interval
+
+        while not self._stopping.is_set():
+            silent_at = self.last_activity + self.heartbeat_timeout
+            timeout = max(min(next_tick, silent_at) - monotonic(), 0)
+
+            if self._lost.wait(timeout):
+                logging.warning('Connection lost - reconnecting...')
+                self._reconnect()
+            elif monotonic() >= self.last_activity + self.heartbeat_timeout:
+                logging.warning('Nothing received for %s seconds - reconnecting...',
+                                self.heartbeat_timeout)
+                self.increment("heartbeat_timeouts")
+                self._reconnect()
+
+            if on_tick and monotonic() >= next_tick:
+                on_tick()
+                next_tick = monotonic() + tick_interval
+
+    def _reconnect(self) -> None:
+        """Closes the current connection, if any, and opens a new one, retrying with
+           jittered exponential backoff until it succeeds or the supervisor is stopped."""
+
+        last_heard = self.last_activity
+        reconnecting = self.connection is not None
+        self._close()
+        self._lost.clear()
+
+        attempt = 0
+        while not self._stopping.is_set():
+            try:
+                self.connection = self.connect()
+                break
+            except Exception:  # pylint: disable=broad-except
+                attempt += 1
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                logging.exception('Failed to connect (attempt %s), retrying in %.1f seconds',
+                                  attempt, delay)
+                self.increment("connect_failures")
+                self._stopping.wait(delay)
+        else:
+            return
+
+        self.notify_alive()
+        if reconnecting:
+            gap = monotonic() - last_heard
+            logging.info('Reconnected, %.1f seconds since anything was received', gap)
+            self.increment("reconnects")
+            if self.on_reconnected:
+                self.on_reconnected(gap)
+
+    def _close(self) -> None:
+        """Disconnects the current connection, ignoring any error from one already lost."""
+
+        connection, self.connection = self.connection, None
+        if connection is None:
+            return
+
+        self.retired.add(connection)
+        try:
+            connection.disconnect()
+        except Exception:  # pylint: disable=broad-except
+            logging.warning('Failed to disconnect cleanly', exc_info=True)
+
+    def increment(self, name: str, value: float = 1) -> None:
+        """Increments the named counter."""
+
+        with self._lock:
+            self.counters[name] += value
+
+    def stats(self) -> dict:
+        """Returns the connection counters."""
+
+        with self._lock:
+            return dict(self.counters)
+
+    def stop(self) -> None:
+        """Stops supervising and disconnects."""
+
+        self._stopping.set()
+        self._lost.set()
+        self._close()
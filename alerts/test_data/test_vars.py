@@ -1,6 +1,9 @@
 """Test variables."""
 
-import pandas as pd
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+UK_ZONE = ZoneInfo("Europe/London")
 
 OUTPUT_AFTER_PROCESSING_XML = {'created_at': '2024-04-24T06:32:48.156Z',
                                'last_updated': '2024-04-24T06:59:20.130Z',
@@ -28,44 +31,25 @@ OUTPUT_AFTER_REPLACE = {'created_at': ['2024-04-24T06:32:48.156Z'],
                         'description': ['A description.']}
 
 TIMESTAMP_WITH_END_TIME = {
-    'created_at': ['2024-04-05T14:46:53.097Z'],
-    'last_updated': ['2024-04-05T14:46:53.097Z'],
-    'start_time': ['2024-04-27T00:00:00.000+01:00'],
-    'end_time': ['2024-04-28T23:59:00.000+01:00']
+    'created_at': '2024-04-05T14:46:53.097Z',
+    'last_updated': '2024-04-05T14:46:53.097Z',
+    'start_time': '2024-04-27T00:00:00.000+01:00',
+    'end_time': '2024-04-28T23:59:00.000+01:00'
 }
 
 TIMESTAMP_WITHOUT_END_TIME = {
-    'created_at': ['2024-04-05T14:46:53.097Z'],
-    'last_updated': ['2024-04-05T14:46:53.097Z'],
-    'start_time': ['2024-04-27T00:00:00.000+01:00'],
-    'end_time': [None]
+    'created_at': '2024-04-05T14:46:53.097Z',
+    'last_updated': '2024-04-05T14:46:53.097Z',
+    'start_time': '2024-04-27T00:00:00.000+01:00',
+    'end_time': None
 }
 
-TIMESTAMP_OUTPUT_1 = {'created_at':
-                      [pd.Timestamp(
-                          '2024-04-05 15:46:53.097000+0100',
-                          tz='Europe/London')],
-                      'last_updated':
-                      [pd.Timestamp(
-                          '2024-04-05 15:46:53.097000+0100',
-                          tz='Europe/London')],
-                      'start_time':
-                      [pd.Timestamp('2024-04-27 00:00:00+0100',
-                                    tz='Europe/London')],
-                      'end_time':
-                      [pd.Timestamp('2024-04-28 23:59:00+0100',
-                                    tz='Europe/London')]}
-
+TIMESTAMP_OUTPUT_1 = {'created_at': datetime(2024, 4, 5, 15, 46, 53, 97000, tzinfo=UK_ZONE),
+                      'last_updated': datetime(2024, 4, 5, 15, 46, 53, 97000, tzinfo=UK_ZONE),
+                      'start_time': datetime(2024, 4, 27, 0, 0, tzinfo=UK_ZONE),
+                      'end_time': datetime(2024, 4, 28, 23, 59, tzinfo=UK_ZONE)}
 
-TIMESTAMP_OUTPUT_2 = {'created_at':
-                      [pd.Timestamp(
-                          '2024-04-05 15:46:53.097000+0100',
-                          tz='Europe/London')],
-                      'last_updated':
-                      [pd.Timestamp(
-                          '2024-04-05 15:46:53.097000+0100',
-                          tz='Europe/London')],
-                      'start_time':
-                      [pd.Timestamp('2024-04-27 00:00:00+0100',
-                                    tz='Europe/London')],
-                      'end_time': [None]}
+TIMESTAMP_OUTPUT_2 = {'created_at': datetime(2024, 4, 5, 15, 46, 53, 97000, tzinfo=UK_ZONE),
+                      'last_updated': datetime(2024, 4, 5, 15, 46, 53, 97000, tzinfo=UK_ZONE),
+                      'start_time': datetime(2024, 4, 27, 0, 0, tzinfo=UK_ZONE),
+                      'end_time': None}
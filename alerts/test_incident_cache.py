@@ -0,0 +1,54 @@
+"""Unit tests to test the incident state cache"""
+
+from datetime import datetime, timezone
+from unittest.mock import MagicMock
+
+from incident_cache import IncidentStateCache
+from transform import UK_ZONE
+
+INCIDENT = {"incident_number": "ABC123",
+            "last_updated": datetime(2024, 5, 1, 9, tzinfo=UK_ZONE),
+            "operator_ref": ["NT"],
+            "summary": "Disruption between Leeds and York",
+            "cleared": False}
+
+
+def test_unchanged_incidents_are_skipped():
+    cache = IncidentStateCache()
+
+    assert cache.is_changed(INCIDENT)
+    assert not cache.is_changed(dict(INCIDENT))
+    assert not cache.is_changed(
+        {**INCIDENT, "last_updated": datetime(2024, 5, 1, 10, tzinfo=UK_ZONE)})
+    assert cache.is_changed(
+        {**INCIDENT, "last_updated": datetime(2024, 5, 1, 11, tzinfo=UK_ZONE),
+         "cleared": True})
+
+
+def test_older_updates_are_skipped():
+    cache = IncidentStateCache()
+    cache.is_changed(INCIDENT)
+
+    assert not cache.is_changed(
+        {**INCIDENT, "last_updated": datetime(2024, 5, 1, 8, tzinfo=UK_ZONE),
+         "summary": "An earlier summary"})
+
+
+def test_least_recently_seen_incidents_are_evicted():
+    cache = IncidentStateCache(max_incidents=2)
+    for incident_number in ["A", "B", "C"]:
+        cache.is_changed({**INCIDENT, "incident_number": incident_number})
+
+    assert list(cache.incidents) == ["B", "C"]
+
+
+def test_seeded_incidents_are_skipped_if_not_updated():
+    cur = MagicMock()
+    cur.fetchall.return_value = [{"incident_uuid": "ABC123",
+                                  "last_updated": datetime(2024, 5, 1, 8, tzinfo=timezone.utc)}]
+    cache = IncidentStateCache()
+    cache.seed(cur)
+
+    assert not cache.is_changed(INCIDENT)
+    assert cache.is_changed(
+        {**INCIDENT, "last_updated": datetime(2024, 5, 1, 10, tzinfo=UK_ZONE)})
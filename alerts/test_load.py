@@ -0,0 +1,130 @@
+"""Unit tests to test load functions"""
+
+from contextlib import contextmanager
+from unittest.mock import MagicMock
+
+import pytest
+from psycopg2 import OperationalError
+from psycopg2.extensions import TransactionRollbackError
+
+import load
+from load import DatabasePool, get_incident_rows, get_operator_ids, load_data_to_database
+
+INCIDENT = {"operator_ref": ["NT", "TP"],
+            "operator_name": ["Northern", "TransPennine Express"],
+            "incident_number": "ABC123",
+            "created_at": "2024-05-01 08:00:00",
+            "last_updated": "2024-05-01 09:00:00",
+            "start_time": "2024-05-01 08:00:00",
+            "end_time": None,
+            "planned": False,
+            "info_link": "https://www.nationalrail.co.uk/",
+            "routes_affected": "Leeds to York",
+            "summary": "Disruption between Leeds and York",
+            "cleared": False}
+
+
+class FakePool:
+    """A pool whose first transactions fail with the given error."""
+
+    def __init__(self, failures: int,
+                 error: Exception = OperationalError("server closed the connection")):
+        self.failures = failures
+        self.error = error
+
+    @contextmanager
+    def transaction(self):
+        """Yields a connection, failing the first few times."""
+
+        if self.failures:
+            self.failures -= 1
+            raise self.error
+        yield MagicMock()
+
+
+def test_get_incident_rows_keeps_last_version_of_each_incident():
+    update = {**INCIDENT, "operator_ref": ["NT"], "operator_name": ["Northern"],
+              "last_updated": "2024-05-01 10:00:00"}
+
+    rows = get_incident_rows([INCIDENT, update], {"NT": 1, "TP": 2})
+
+    assert [(row[0], row[2], row[3]) for row in rows] == [
+        (1, "2024-05-01 10:00:00", "ABC123"),
+        (2, "2024-05-01 09:00:00", "ABC123")]
+
+
+def test_load_data_to_database_reconnects_on_connection_error(monkeypatch):
+    inserted = []
+    monkeypatch.setattr(load, "get_operator_ids",
+                        lambda cur, operators: {"NT": 1, "TP": 2})
+    monkeypatch.setattr(load, "insert_into_db", lambda cur, rows: inserted.extend(rows))
+
+    load_data_to_database(FakePool(failures=2), INCIDENT)
+
+    assert [row[0] for row in inserted] == [1, 2]
+
+
+def test_load_data_to_database_retries_on_deadlock(monkeypatch):
+    inserted = []
+    monkeypatch.setattr(load, "get_operator_ids",
+                        lambda cur, operators: {"NT": 1, "TP": 2})
+    monkeypatch.setattr(load, "insert_into_db", lambda cur, rows: inserted.extend(rows))
+
+    load_data_to_database(
+        FakePool(failures=1, error=TransactionRollbackError("deadlock detected")), INCIDENT)
+
+    assert [row[0] for row in inserted] == [1, 2]
+
+
+def test_get_operator_ids_finds_operators_inserted_concurrently(monkeypatch):
+    statements = []
+
+    def execute_values(cur, query, operators, fetch=False):
+        statements.append(operators)
+        # The first statement misses TP, which another worker has just inserted.
+        return [{"operator_code": code, "operator_id": index}
+                for index, (code, _) in enumerate(operators, 1)
+                if len(statements) > 1 or code != "TP"]
+
+    monkeypatch.setattr(load, "execute_values", execute_values)
+
+    operator_ids = get_operator_ids(MagicMock(), {"NT": "Northern",
+                                                  "TP": "TransPennine Express"})
+
+    assert operator_ids == {"NT": 1, "TP": 1}
+    assert statements[1] == [("TP", "TransPennine Express")]
+
+
+class RecordingPool:
+    """A psycopg2 pool that records whether each returned connection was closed."""
+
+    def __init__(self):
+        self.returned = []
+
+    def getconn(self):
+        """Returns a new mock connection."""
+
+        return MagicMock()
+
+    def putconn(self, conn, close=False):
+        """Records whether the connection was closed."""
+
+        self.returned.append(close)
+
+
+@pytest.mark.parametrize("error, closed", [
+    (TransactionRollbackError("deadlock detected"), False),
+    (OperationalError("server closed the connection unexpectedly"), True)])
+def test_transaction_only_discards_lost_connections(monkeypatch, error, closed):
+    recording_pool = RecordingPool()
+    pool = DatabasePool({})
+    pool._last_used = {1: 0.0}  # pylint: disable=protected-access
+    monkeypatch.setattr(pool, "_get_pool", lambda: recording_pool)
+    monkeypatch.setattr(pool, "_is_healthy", lambda _: True)
+
+    with pytest.raises(type(error)):
+        with pool.transaction():
+            raise error
+
+    assert recording_pool.returned == [closed]
+    assert bool(pool._last_used) is not closed  # pylint: disable=protected-access
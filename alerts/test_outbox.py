@@ -0,0 +1,32 @@
+"""Unit tests to test the incident outbox"""
+
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from outbox import Outbox
+
+INCIDENT = {"incident_number": "ABC123",
+            "operator_ref": ["NT", "TP"],
+            "start_time": datetime(2024, 4, 30, 9, 0, tzinfo=ZoneInfo("Europe/London")),
+            "end_time": None,
+            "cleared": False}
+
+
+def test_pending_incidents_survive_reopening(tmp_path):
+    path = str(tmp_path / "outbox.sqlite3")
+    outbox = Outbox(path)
+    outbox_id = outbox.add(INCIDENT)
+    outbox.close()
+
+    assert Outbox(path).pending() == [(outbox_id, INCIDENT, True, True)]
+
+
+def test_incidents_are_removed_once_published_and_loaded(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox.sqlite3"))
+    first, second = outbox.add(INCIDENT), outbox.add(INCIDENT)
+
+    outbox.mark_published([first, second])
+    outbox.mark_loaded([first])
+
+    assert [entry[0] for entry in outbox.pending()] == [second]
+    assert outbox.pending()[0][2:] == (False, True)
@@ -0,0 +1,212 @@
+"""Unit tests to test the incident processor"""
+
+from threading import Event
+from time import sleep
+
+import processing
+from processing import IncidentProcessor
+from outbox import Outbox
+from incident_cache import IncidentStateCache
+
+
+class FakePublisher:
+    """Records the incidents it is asked to publish."""
+
+    def __init__(self):
+        self.published = []
+
+    def start(self):
+        """Does nothing, as there is no publishing thread."""
+
+    def submit(self, data, topic=None, received=None, outbox_id=None):
+        """Records the incident as published."""
+
+        self.published.append(data["incident_number"])
+
+    def outbox_ids_in_flight(self):
+        """Returns nothing, as nothing is pending."""
+
+        return set()
+
+    def stats(self):
+        """Returns the number of incidents published."""
+
+        return {"published": len(self.published)}
+
+    def close(self, timeout=None):
+        """Does nothing, as nothing is pending."""
+
+        return True
+
+
+def test_slow_loads_do_not_delay_alerts(monkeypatch):
+    publisher, loaded = FakePublisher(), []
+    release_loads = Event()
+
+    def slow_load(pool, messages):
+        release_loads.wait(5)
+        loaded.extend(message["incident_number"] for message in messages)
+
+    monkeypatch.setattr(processing, "transform_data",
+                        lambda body, namespaces: {"incident_number": body})
+    monkeypatch.setattr(processing, "load_incidents_to_database", slow_load)
+
+    processor = IncidentProcessor(publisher, None, {}, queue_size=10, load_workers=2)
+    processor.start()
+    for body in ["A", "B", "C"]:
+        processor.submit(body)
+
+    for _ in range(500):
+        if len(publisher.published) == 3:
+            break
+        sleep(0.01)
+
+    assert publisher.published == ["A", "B", "C"]
+    assert not loaded
+
+    release_loads.set()
+    assert processor.shutdown(timeout=5)
+    assert sorted(loaded) == ["A", "B", "C"]
+    assert processor.stats()["counters"]["loaded"] == 3
+
+
+def test_failed_messages_are_counted(monkeypatch):
+    def fail(*args):
+        raise ValueError("bad message")
+
+    monkeypatch.setattr(processing, "transform_data", fail)
+
+    processor = IncidentProcessor(FakePublisher(), None, {}, load_workers=1)
+    processor.start()
+    processor.submit("<xml/>")
+
+    assert processor.shutdown(timeout=5)
+    assert processor.stats()["counters"] == {"parse_failed": 1}
+
+
+def test_messages_are_acknowledged_once_recorded_and_replayed(monkeypatch, tmp_path):
+    acknowledged = []
+
+    def fail_load(pool, messages):
+        raise ConnectionError("database unavailable")
+
+    monkeypatch.setattr(processing, "transform_data",
+                        lambda body, namespaces: {"incident_number": body})
+    monkeypatch.setattr(processing, "load_incidents_to_database", fail_load)
+
+    outbox = Outbox(str(tmp_path / "outbox.sqlite3"))
+    processor = IncidentProcessor(FakePublisher(), None, {}, load_workers=1, outbox=outbox)
+    processor.start()
+    processor.submit("A", lambda: acknowledged.append(len(outbox)))
+
+    assert processor.shutdown(timeout=5)
+    assert acknowledged == [1]
+    assert processor.stats()["counters"]["load_failed"] == 1
+
+    loaded = []
+    monkeypatch.setattr(processing, "load_incidents_to_database",
+                        lambda pool, messages: loaded.extend(messages))
+
+    publisher = FakePublisher()
+    processor = IncidentProcessor(publisher, None, {}, load_workers=1, outbox=outbox)
+    processor.start()
+
+    assert processor.shutdown(timeout=5)
+    assert publisher.published == ["A"]
+    assert loaded == [{"incident_number": "A"}]
+
+
+def test_redelivered_messages_are_processed_after_a_failed_outbox_write(monkeypatch,
+                                                                        tmp_path):
+    acknowledged, publisher = [], FakePublisher()
+
+    class FailingOutbox(Outbox):
+        """Fails to record the first incident."""
+
+        failed = False
+
+        def add(self, data):
+            if not self.failed:
+                self.failed = True
+                raise OSError("disk full")
+            return super().add(data)
+
+    monkeypatch.setattr(processing, "transform_data",
+                        lambda body, namespaces: {"incident_number": body,
+                                                  "last_updated": None})
+    monkeypatch.setattr(processing, "load_incidents_to_database",
+                        lambda pool, messages: None)
+
+    outbox = FailingOutbox(str(tmp_path / "outbox.sqlite3"))
+    processor = IncidentProcessor(publisher, None, {}, load_workers=1,
+                                  incident_cache=IncidentStateCache(), outbox=outbox)
+    processor.start()
+    processor.submit("A", lambda: acknowledged.append(1))
+    processor.submit("A", lambda: acknowledged.append(2))
+
+    assert processor.shutdown(timeout=5)
+    assert acknowledged == [2]
+    assert publisher.published == ["A"]
+    counters = processor.stats()["counters"]
+    assert (counters["outbox_failed"], counters["parsed"], counters["loaded"]) == (1, 1, 1)
+    assert "unchanged" not in counters
+
+
+def test_load_workers_continue_after_the_outbox_fails(monkeypatch, tmp_path):
+    loaded = []
+
+    class FailingOutbox(Outbox):
+        """Fails to record that incidents were loaded."""
+
+        def mark_loaded(self, outbox_ids):
+            raise OSError("disk full")
+
+    monkeypatch.setattr(processing, "transform_data",
+                        lambda body, namespaces: {"incident_number": body})
+    monkeypatch.setattr(processing, "load_incidents_to_database",
+                        lambda pool, messages: loaded.extend(messages))
+
+    outbox = FailingOutbox(str(tmp_path / "outbox.sqlite3"))
+    processor = IncidentProcessor(FakePublisher(), None, {}, load_workers=1, outbox=outbox)
+    processor.start()
+    processor.submit("A")
+    for _ in range(500):
+        if loaded:
+            break
+        sleep(0.01)
+    processor.submit("B")
+
+    assert processor.shutdown(timeout=5)
+    assert [message["incident_number"] for message in loaded] == ["A", "B"]
+    assert processor.stats()["counters"]["outbox_failed"] == 2
+
+
+def test_failed_loads_are_replayed_from_the_outbox(monkeypatch, tmp_path):
+    loaded, attempts = [], []
+
+    def load_after_outage(pool, messages):
+        attempts.append(len(messages))
+        if len(attempts) == 1:
+            raise ConnectionError("database unavailable")
+        loaded.extend(message["incident_number"] for message in messages)
+
+    monkeypatch.setattr(processing, "transform_data",
+                        lambda body, namespaces: {"incident_number": body})
+    monkeypatch.setattr(processing, "load_incidents_to_database", load_after_outage)
+
+    outbox = Outbox(str(tmp_path / "outbox.sqlite3"))
+    processor = IncidentProcessor(FakePublisher(), None, {}, load_workers=1, outbox=outbox,
+                                  replay_interval=0.05)
+    processor.start()
+    processor.submit("A")
+
+    for _ in range(500):
+        if loaded:
+            break
+        sleep(0.01)
+    sleep(0.2)
+
+    assert processor.shutdown(timeout=5)
+    assert loaded == ["A"]
+    assert processor.stats()["counters"]["load_failed"] == 1
+    assert [load_pending for _, _, _, load_pending in outbox.pending()] == [False]
@@ -0,0 +1,124 @@
+"""Unit tests to test the alert publisher against a local SNS stub"""
+
+import json
+from time import sleep
+
+import boto3
+from moto import mock_aws
+import pytest
+
+from publish import AlertPublisher
+
+REGION = "eu-west-2"
+
+INCIDENT = {"incident_number": "ABC123",
+            "operator_ref": ["NT"],
+            "summary": "Disruption between Leeds and York",
+            "routes_affected": "Leeds to York",
+            "info_link": "https://www.nationalrail.co.uk/"}
+
+
+@pytest.fixture
+def sns_topic():
+    """Yields an SNS client and a topic subscribed to by an SQS queue."""
+
+    with mock_aws():
+        sns = boto3.client("sns", region_name=REGION)
+        sqs = boto3.client("sqs", region_name=REGION)
+        topic_arn = sns.create_topic(Name="alerts")["TopicArn"]
+        queue_url = sqs.create_queue(QueueName="alerts")["QueueUrl"]
+        queue_arn = sqs.get_queue_attributes(
+            QueueUrl=queue_url, AttributeNames=["QueueArn"])["Attributes"]["QueueArn"]
+        sns.subscribe(TopicArn=topic_arn, Protocol="sqs", Endpoint=queue_arn)
+        yield sns, sqs, topic_arn, queue_url
+
+
+def receive_messages(sqs, queue_url: str) -> list[dict]:
+    """Returns every message delivered to the queue."""
+
+    messages = []
+    while batch := sqs.receive_message(QueueUrl=queue_url,
+                                       MaxNumberOfMessages=10).get("Messages"):
+        messages.extend(json.loads(message["Body"]) for message in batch)
+    return messages
+
+
+def test_updates_within_window_are_coalesced(sns_topic):
+    sns, sqs, topic_arn, queue_url = sns_topic
+    published_ids = []
+    publisher = AlertPublisher(sns, topic_arn, coalesce_seconds=60,
+                               on_published=published_ids.extend)
+    publisher.start()
+
+    publisher.submit(INCIDENT, outbox_id=1)
+    publisher.submit({**INCIDENT, "summary": "Lines reopened between Leeds and York"},
+                     outbox_id=2)
+    publisher.submit({**INCIDENT, "incident_number": "DEF456"}, outbox_id=3)
+
+    assert publisher.close(timeout=5)
+    assert [message["Subject"] for message in receive_messages(sqs, queue_url)] == [
+        "Incident Update (Northern Trains)", "Incident Notice (Northern Trains)"]
+    assert publisher.stats()["coalesced"] == 1
+    assert publisher.stats()["published"] == 2
+    assert sorted(published_ids) == [1, 2, 3]
+
+
+def test_batches_are_split_and_failed_calls_retried(sns_topic):
+    sns, sqs, topic_arn, queue_url = sns_topic
+    calls = []
+    publish_batch = sns.publish_batch
+
+    def flaky_publish_batch(**kwargs):
+        calls.append(len(kwargs["PublishBatchRequestEntries"]))
+        if len(calls) == 1:
+            raise sns.exceptions.ThrottledException(
+                {"Error": {"Code": "Throttled", "Message": "Rate exceeded"}},
+                "PublishBatch")
+        return publish_batch(**kwargs)
+
+    sns.publish_batch = flaky_publish_batch
+    publisher = AlertPublisher(sns, topic_arn, coalesce_seconds=0, base_delay=0.01)
+    for index in range(12):
+        publisher.submit({**INCIDENT, "incident_number": f"INC{index}"})
+    publisher.start()
+
+    assert publisher.close(timeout=5)
+    assert len(receive_messages(sqs, queue_url)) == 12
+    assert max(calls) == 10
+    assert publisher.stats()["retried"] >= 1
+
+
+def test_publishing_continues_after_on_published_fails(sns_topic):
+    sns, sqs, topic_arn, queue_url = sns_topic
+    recorded = []
+
+    def record_once(outbox_ids):
+        if not recorded:
+            recorded.append(None)
+            raise OSError("disk full")
+        recorded.extend(outbox_ids)
+
+    publisher = AlertPublisher(sns, topic_arn, coalesce_seconds=0,
+                               on_published=record_once)
+    publisher.start()
+    publisher.submit(INCIDENT, outbox_id=1)
+    for _ in range(500):
+        if recorded:
+            break
+        sleep(0.01)
+    publisher.submit({**INCIDENT, "incident_number": "DEF456"}, outbox_id=2)
+
+    assert publisher.close(timeout=5)
+    assert len(receive_messages(sqs, queue_url)) == 2
+    assert recorded == [None, 2]
+    assert publisher.stats()["on_published_failed"] == 1
+
+
+def test_outbox_ids_of_pending_alerts_are_in_flight(sns_topic):
+    sns, _, topic_arn, _ = sns_topic
+    publisher = AlertPublisher(sns, topic_arn, coalesce_seconds=60)
+
+    publisher.submit(INCIDENT, outbox_id=1)
+    publisher.submit({**INCIDENT, "summary": "Lines reopened"}, outbox_id=2)
+
+    assert publisher.outbox_ids_in_flight() == {1, 2}
@@ -0,0 +1,97 @@
+"""Unit tests to test the connection supervisor"""
+
+from threading import Thread
+from time import sleep
+
+from supervisor import ConnectionSupervisor
+
+
+class FakeConnection:
+    """Records whether it has been disconnected."""
+
+    def __init__(self):
+        self.connected = True
+
+    def disconnect(self):
+        """Marks the connection as disconnected."""
+
+        self.connected = False
+
+
+def wait_for(condition, timeout: float = 5) -> bool:
+    """Returns whether the condition becomes true within the timeout."""
+
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return True
+        sleep(0.01)
+    return False
+
+
+def make_connector(connections: list):
+    """Returns a connect function that records each connection it opens."""
+
+    def connect():
+        connections.append(FakeConnection())
+        return connections[-1]
+    return connect
+
+
+def start(supervisor: ConnectionSupervisor) -> Thread:
+    """Runs the supervisor on a background thread."""
+
+    thread = Thread(target=supervisor.run, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_lost_connections_are_replaced_immediately():
+    connections, gaps = [], []
+    supervisor = ConnectionSupervisor(make_connector(connections),
+                                      on_reconnected=gaps.append)
+    thread = start(supervisor)
+    assert wait_for(lambda: len(connections) == 1)
+
+    supervisor.notify_lost(connections[0])
+    assert wait_for(lambda: len(connections) == 2)
+
+    # The first connection's own disconnect event doesn't cause another reconnection.
+    supervisor.notify_lost(connections[0])
+    sleep(0.1)
+
+    supervisor.stop()
+    thread.join(5)
+    assert len(connections) == 2
+    assert [connection.connected for connection in connections] == [False, False]
+    assert len(gaps) == 1
+    assert supervisor.stats() == {"reconnects": 1}
+
+
+def test_silent_connections_are_replaced():
+    connections = []
+    supervisor = ConnectionSupervisor(make_connector(connections), heartbeat_timeout=0.05)
+    thread = start(supervisor)
+
+    assert wait_for(lambda: len(connections) >= 3)
+    supervisor.stop()
+    thread.join(5)
+    assert supervisor.stats()["heartbeat_timeouts"] >= 2
+
+
+def test_failed_connections_are_retried_with_backoff():
+    attempts = []
+
+    def connect():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionRefusedError("broker unavailable")
+        return FakeConnection()
+
+    supervisor = ConnectionSupervisor(connect, base_delay=0.01)
+    thread = start(supervisor)
+
+    assert wait_for(lambda: supervisor.connection is not None)
+    supervisor.stop()
+    thread.join(5)
+    assert len(attempts) == 3
+    assert supervisor.stats() == {"connect_failures": 2}
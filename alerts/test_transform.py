@@ -1,16 +1,14 @@
 """Unit tests to test transform functions"""
 
-import pandas as pd
-from pandas.testing import assert_frame_equal
+from datetime import datetime, timezone
 
-from transform import process_xml, convert_timestamps
+from transform import process_xml, convert_timestamp, transform_data, UK_ZONE
 from test_data.test_vars import (OUTPUT_AFTER_PROCESSING_XML,
                                  TIMESTAMP_WITH_END_TIME,
                                  TIMESTAMP_WITHOUT_END_TIME,
                                  TIMESTAMP_OUTPUT_1,
                                  TIMESTAMP_OUTPUT_2)
 
-UK_TIMEZONE = 'Europe/London'
 NS = {"ns": "http://nationalrail.co.uk/xml/incident",
       "com": "http://nationalrail.co.uk/xml/common"}
 
@@ -34,20 +32,49 @@ def test_process_xml_bad_input():
     assert process_xml(empty_msg, NS) is None
 
 
-def test_convert_timestamps_with_end_time_normal_input():
+def test_convert_timestamp_with_end_time_normal_input():
     """Tests converting timestamps with all timestamps."""
 
-    timestamps = pd.DataFrame(TIMESTAMP_WITH_END_TIME)
-    converted = convert_timestamps(
-        timestamps, UK_TIMEZONE)
-    expected_df = pd.DataFrame(TIMESTAMP_OUTPUT_1)
-    assert_frame_equal(converted, expected_df)
+    converted = {key: convert_timestamp(timestamp, UK_ZONE)
+                 for key, timestamp in TIMESTAMP_WITH_END_TIME.items()}
+    assert converted == TIMESTAMP_OUTPUT_1
+    assert all(timestamp.tzinfo is UK_ZONE for timestamp in converted.values())
 
 
-def test_convert_timestamps_without_end_time_normal_input():
+def test_convert_timestamp_without_end_time_normal_input():
     """Tests converting timestamps without end time."""
 
-    timestamps = pd.DataFrame(TIMESTAMP_WITHOUT_END_TIME)
-    converted = convert_timestamps(timestamps, UK_TIMEZONE)
-    expected_df = pd.DataFrame(TIMESTAMP_OUTPUT_2)
-    assert_frame_equal(converted, expected_df)
+    converted = {key: convert_timestamp(timestamp, UK_ZONE)
+                 for key, timestamp in TIMESTAMP_WITHOUT_END_TIME.items()}
+    assert converted == TIMESTAMP_OUTPUT_2
+
+
+def test_process_xml_multiple_operators_and_routes():
+    """Tests that every affected operator is collected and routes are converted to text."""
+
+    operator = ("<ns3:AffectedOperator><ns3:OperatorRef>NT</ns3:OperatorRef>"
+                "<ns3:OperatorName>Northern</ns3:OperatorName></ns3:AffectedOperator>")
+    message = MSG.replace("<ns3:Operators>", f"<ns3:Operators>{operator}").replace(
+        "&lt;p&gt;Routes&lt;/p&gt;",
+        "&lt;p&gt;Leeds &amp;amp; York&lt;/p&gt;&lt;p&gt;Hull&lt;/p&gt;")
+
+    processed_msg = process_xml(message, NS)
+
+    assert processed_msg["operator_ref"] == ["NT", "VT"]
+    assert processed_msg["operator_name"] == ["Northern", "Avanti West Coast"]
+    assert processed_msg["routes_affected"] == "Leeds & York\nHull"
+
+
+def test_transform_data_clears_incidents_that_have_ended():
+    """Tests that an incident is cleared once its end time has passed."""
+
+    message = MSG.replace(
+        "<ns2:StartTime>",
+        "<ns2:EndTime>2024-04-24T12:00:00.000+01:00</ns2:EndTime><ns2:StartTime>")
+
+    before_end = transform_data(message, NS, datetime(2024, 4, 24, 10, tzinfo=timezone.utc))
+    after_end = transform_data(message, NS, datetime(2024, 4, 24, 11, tzinfo=timezone.utc))
+
+    assert before_end["cleared"] is False
+    assert after_end["cleared"] is True
+    assert after_end["end_time"] == datetime(2024, 4, 24, 12, tzinfo=UK_ZONE)
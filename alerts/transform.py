@@ -1,15 +1,23 @@
 """Functions to transform and clean messages upon receipt."""
 
-from datetime import datetime
+from datetime import datetime, timezone
+from html import unescape
+import re
+from zoneinfo import ZoneInfo
 
 import xml.etree.ElementTree as ET
 
-import pandas as pd
-from bs4 import BeautifulSoup
+UK_TIMEZONE = 'Europe/London'
+UK_ZONE = ZoneInfo(UK_TIMEZONE)
+TIMESTAMP_KEYS = ['created_at', 'last_updated', 'start_time', 'end_time']
+HTML_TAG = re.compile(r"<[^>]*>")
 
 
-UK_TIMEZONE = 'Europe/London'
-CURRENT_TIME = datetime.now().strftime("%Y-%m-%dT%H:%M:%S.%f%z")
+def html_to_text(fragment: str) -> str:
+    """Returns the text content of an HTML fragment, with its tags removed and its
+       entities unescaped."""
+
+    return unescape(HTML_TAG.sub("", fragment))
 
 
 def find_element_text(root: ET.Element, xpath: str, namespaces: dict) -> str:
@@ -51,8 +59,9 @@ def process_xml(xml_message: str, namespaces: dict) -> dict:
     planned = find_element_text(root, ".//ns:Planned", namespaces)
     summary = find_element_text(root, ".//ns:Summary", namespaces)
     cleared = find_element_text(root, ".//ns:ClearedIncident", namespaces)
-    info_link = find_element_text(
-        root, ".//ns:InfoLinks/ns:InfoLink/ns:Uri", namespaces).replace('/n', " ").strip()
+    info_link = find_element_text(root, ".//ns:InfoLinks/ns:InfoLink/ns:Uri", namespaces)
+    if info_link:
+        info_link = info_link.replace('/n', " ").strip()
     operator_ref = extract_operator_refs(root, namespaces)
     operator_name = extract_operator_names(root, namespaces)
     routes_affected = find_element_text(
@@ -62,13 +71,10 @@ def process_xml(xml_message: str, namespaces: dict) -> dict:
     if routes_affected:
         routes_affected = routes_affected.replace(
             "\n", " ").replace("</p><p>", "\n")
-        routes_soup = BeautifulSoup(routes_affected, "html.parser").get_text()
+        routes_soup = html_to_text(routes_affected)
     else:
         routes_soup = None
 
-    if not cleared and end_time:
-        cleared = CURRENT_TIME > end_time
-
     data = {
         "created_at": created_at,
         "last_updated": last_updated,
@@ -88,24 +94,40 @@ def process_xml(xml_message: str, namespaces: dict) -> dict:
     return data
 
 
-def convert_timestamps(data_frame: pd.DataFrame, timezone: str) -> pd.DataFrame:
-    """Converts timestamp to correct datetime format with correct time zone."""
+def convert_timestamp(timestamp: str, zone: ZoneInfo) -> datetime:
+    """Converts an ISO 8601 timestamp to a datetime in the given time zone.
+       Timestamps without an offset are taken to be in UTC."""
+
+    if not timestamp:
+        return None
 
-    columns_to_convert = ['created_at', 'last_updated',
-                          'start_time', 'end_time']
+    parsed = datetime.fromisoformat(timestamp)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(zone)
 
-    for col in columns_to_convert:
-        if data_frame[col].notnull().any():
-            data_frame[col] = pd.to_datetime(data_frame[col])
-            data_frame[col] = data_frame[col].dt.tz_convert(tz=timezone)
 
-    return data_frame
+def is_cleared(data: dict, now: datetime) -> bool:
+    """Returns whether an incident has been cleared, either explicitly
+       or by its end time having passed."""
 
+    cleared = data["cleared"]
+    if isinstance(cleared, str):
+        cleared = cleared.strip().lower() == "true"
 
-def transform_data(message: str, namespaces: dict) -> dict:
-    """Transforms/cleans each message."""
+    end_time = data["end_time"]
+    return bool(cleared) or (end_time is not None and end_time <= now)
+
+
+def transform_data(message: str, namespaces: dict, now: datetime = None) -> dict:
+    """Transforms/cleans each message, evaluating whether the incident
+       is cleared at the given time (by default, the current time)."""
 
     data = process_xml(message, namespaces)
-    data_frame = pd.DataFrame([data])
-    data_frame = convert_timestamps(data_frame, UK_TIMEZONE)
-    return data_frame.to_dict(orient='records')[0]
+    if data is None:
+        return None
+
+    for key in TIMESTAMP_KEYS:
+        data[key] = convert_timestamp(data[key], UK_ZONE)
+    data["cleared"] = is_cleared(data, now or datetime.now(timezone.utc))
+    return data
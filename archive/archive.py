@@ -1,27 +1,38 @@
 """This file is responsible for moving old data from
 the short-term storage to the long-term storage."""
 
-from functools import reduce
+from datetime import date, timedelta
+from functools import partial
 import logging
 from os import environ as ENV
+from time import monotonic
+from typing import Callable, Iterator
 
 from dotenv import load_dotenv
 from psycopg2 import connect, Error
 from psycopg2.extras import RealDictCursor
-from psycopg2.extensions import connection
-import pandas as pd
+from psycopg2.extensions import connection, cursor
 
-from sql_queries import (S_DELAYS, S_DELAYS_OVER_5_MIN, S_AVG_DELAY,
-                         S_TOTAL_ARRIVALS, S_TOTAL_CANCELLATIONS,
-                         O_DELAYS, O_DELAYS_OVER_5_MIN, O_AVG_DELAY,
-                         O_TOTAL_ARRIVALS, O_TOTAL_CANCELLATIONS,
+from sql_queries import (PERFORMANCE, SUMMARISE_ON_SERVER, LOCK_PARTITIONED_TABLES,
                          INSERT_STATION_PERFORMANCE, INSERT_OPERATOR_PERFORMANCE,
-                         DELETE_OLD_ARRIVAL_DATA, DELETE_OLD_CANCELLATION_DATA)
+                         DELETE_OLD_ARRIVAL_DATA, DELETE_OLD_CANCELLATION_DATA,
+                         RETENTION_CUTOFF, GET_WATERMARK, EARLIEST_DAY, SET_WATERMARK)
+from partitions import ensure_partitions, drop_expired_partitions
 
-STATION_QUERIES = [S_DELAYS, S_DELAYS_OVER_5_MIN, S_AVG_DELAY, S_TOTAL_ARRIVALS, S_TOTAL_CANCELLATIONS]
-OPERATOR_QUERIES = [O_DELAYS, O_DELAYS_OVER_5_MIN, O_AVG_DELAY, O_TOTAL_ARRIVALS, O_TOTAL_CANCELLATIONS]
 DELETION_QUERIES = [DELETE_OLD_ARRIVAL_DATA, DELETE_OLD_CANCELLATION_DATA]
-REQUIRED_KEYS = ['day', 'delay_1m_count', 'delay_5m_count', 'avg_delay_min', 'arrival_count', 'cancellation_count']
+PERFORMANCE_KEYS = ['id', 'day', 'delay_1m_count', 'delay_5m_count', 'avg_delay_min',
+                    'arrival_count', 'cancellation_count']
+
+# 'incremental' archives the days since the last run inside the database, a chunk of
+# days per transaction, recording how far it has got in a watermark. 'client' archives
+# the same chunks, streaming the aggregated rows through here in batches. 'server'
+# archives everything in one transaction inside the database.
+ARCHIVE_MODES = ['incremental', 'server', 'client']
+DEFAULT_ARCHIVE_MODE = 'incremental'
+DEFAULT_CHUNK_DAYS = 7
+DEFAULT_BATCH_ROWS = 5000
+DEFAULT_TIME_MARGIN_SECONDS = 30
+WATERMARK_NAME = 'performance'
 
 
 def setup_logging() -> None:
@@ -50,121 +61,177 @@ def close_connection(conn: connection) -> None:
     conn.close()
 
 
-def fetch_old_data(conn: connection, query: str) -> pd.DataFrame:
-    """Fetches historical data based on the query.
-    Returns the fetched data as a DataFrame."""
+def stream_old_data(cur: cursor, query: str, params: dict = None,
+                    batch_rows: int = DEFAULT_BATCH_ROWS) -> Iterator[list[dict]]:
+    """Runs the query on a named server-side cursor in the same transaction as cur,
+    yielding the rows batch_rows at a time so only one batch is held in memory."""
 
-    try:
+    with cur.connection.cursor(name='old_data') as named:
+        named.itersize = batch_rows
+        named.execute(query, params)
+        while rows := named.fetchmany(batch_rows):
+            yield rows
 
-        with conn.cursor() as cur:
-            cur.execute(query)
-            rows = cur.fetchall()
 
-        if not rows:
-            logging.warning("No data fetched for query: %s", query)
+def get_retention_cutoff(conn: connection) -> date:
+    """Returns the first day whose data is still kept in the short-term tables."""
 
-        return pd.DataFrame(rows)
+    with conn.cursor() as cur:
+        cur.execute(RETENTION_CUTOFF)
+        return cur.fetchone()['cutoff']
 
-    except Error as err:
 
-        conn.rollback()
-        logging.error("Failed to fetch data: %s", err)
-        if err.pgcode:
-            logging.error("Error code: %s", err.pgcode)
+def summarise_on_server(cur: cursor, until: date) -> dict:
+    """Summarises the data scheduled before the until day into the archive in a single
+    statement. Returns the number of station and operator rows archived."""
 
+    cur.execute(SUMMARISE_ON_SERVER, {'until': until})
+    return dict(cur.fetchone())
 
-def get_stations_performance(conn: connection, queries: list[str]) -> pd.DataFrame:
-    """Fetches the historical data for the stations based on the queries."""
 
-    performance_data = []  # list for adding the dataframes
+def summarise_on_client(cur: cursor, until: date,
+                        batch_rows: int = DEFAULT_BATCH_ROWS) -> dict:
+    """Streams the performance of the stations and operators before the until day
+    through the Lambda a batch at a time, loading each batch into the archive.
+    Returns the number of station and operator rows archived."""
 
-    for query in queries:
-        result = fetch_old_data(conn, query)
-        if not result.empty:
-            performance_data.append(result)
+    counts = {'station_rows': 0, 'operator_rows': 0}
 
-    if not performance_data:
-        return pd.DataFrame()
+    for rows in stream_old_data(cur, PERFORMANCE, {'until': until}, batch_rows):
+        stations_data, operators_data = [], []
+        for row in rows:
+            performance = tuple(row[key] for key in PERFORMANCE_KEYS)
+            if row['station_grain']:
+                stations_data.append(performance)
+            else:
+                operators_data.append(performance)
 
-    # combines the dataframes
-    return reduce(lambda left, right: pd.merge(left, right, on=['day', 'station_id'], how='outer'), performance_data)
+        cur.executemany(INSERT_STATION_PERFORMANCE, stations_data)
+        cur.executemany(INSERT_OPERATOR_PERFORMANCE, operators_data)
+        counts['station_rows'] += len(stations_data)
+        counts['operator_rows'] += len(operators_data)
 
+    return counts
 
-def get_operators_performance(conn: connection, queries: list[str]) -> pd.DataFrame:
-    """Fetches the historical data for the operators based on the queries."""
 
-    performance_data = []  # list for adding the dataframes
+def archive_until(cur: cursor, until: date,
+                  summarise: Callable[[cursor, date], dict] = summarise_on_server) -> dict:
+    """Summarises the data scheduled before the until day into the archive, then drops
+    the partitions of whole days and deletes anything left. Writes to the short-term
+    tables are held off until the transaction ends, so nothing arrives in between.
+    Returns the number of rows archived, partitions dropped and rows deleted."""
 
-    for query in queries:
-        result = fetch_old_data(conn, query)
-        if not result.empty:
-            performance_data.append(result)
+    cur.execute(LOCK_PARTITIONED_TABLES)
+    counts = summarise(cur, until)
 
-    if not performance_data:
-        return pd.DataFrame()
+    counts['dropped_partitions'] = drop_expired_partitions(cur, until)
+    for table, query in zip(['arrivals', 'cancellations'], DELETION_QUERIES):
+        cur.execute(query, {'until': until})
+        counts[f'deleted_{table}'] = cur.rowcount
 
-    # combines the dataframes
-    return reduce(lambda left, right: pd.merge(left, right, on=['day', 'operator_id'], how='outer'), performance_data)
+    return counts
 
 
-def clean_data(data: pd.DataFrame) -> pd.DataFrame:
-    """Cleans the data by converting the columns to the
-    correct data types and filling in the missing values."""
+def archive_on_server(conn: connection) -> dict:
+    """Archives all the old data in a single transaction, so the rows never leave the
+    database and either all of it happens or none of it does.
+    Returns the number of rows archived, partitions dropped and rows deleted."""
 
-    data['day'] = pd.to_datetime(data['day']).dt.date
-    data['delay_1m_count'] = data['delay_1m_count'].fillna(0).astype(int)
-    data['delay_5m_count'] = data['delay_5m_count'].fillna(0).astype(int)
-    data['avg_delay_min'] = data['avg_delay_min'].fillna(0).astype(int)
-    data['arrival_count'] = data['arrival_count'].fillna(0).astype(int)
-    data['cancellation_count'] = data['cancellation_count'].fillna(
-        0).astype(int)
+    until = get_retention_cutoff(conn)
 
-    return data
+    try:
+        with conn.cursor() as cur:
+            counts = archive_until(cur, until)
+        conn.commit()
+        return counts
 
+    except Error as err:
+        conn.rollback()
+        logging.error("Failed to archive old data: %s", err)
+        if err.pgcode:
+            logging.error("Error code: %s", err.pgcode)
+        raise
 
-def check_keys_exist(df: pd.DataFrame, keys: list[str]) -> bool:
-    """Check if all keys exist in the DataFrame."""
 
-    return all(key in df.columns for key in keys)
+def get_watermark(conn: connection) -> date | None:
+    """Returns the first day that hasn't been archived yet. If nothing has been
+    archived, this is the earliest day in the short-term tables, or None if they
+    are empty."""
 
+    with conn.cursor() as cur:
+        cur.execute(GET_WATERMARK, (WATERMARK_NAME,))
+        row = cur.fetchone()
+        if row:
+            return row['archived_until']
 
-def convert_to_list(df: str) -> list[tuple]:
-    """Converts a DataFrame to a list of tuples."""
+        cur.execute(EARLIEST_DAY)
+        return cur.fetchone()['earliest_day']
 
-    return df.to_records(index=False).tolist()
 
+def get_time_left(context) -> Callable[[], float] | None:
+    """Returns a function giving the seconds left before the Lambda times out,
+    or None when not running in a Lambda."""
 
-def load_to_db(conn: connection, data: list[tuple], query: str) -> None:
-    """Loads the data to the database using the query provided."""
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return None
 
-    try:
-        with conn.cursor() as cur:
-            cur.executemany(query, data)
-        conn.commit()
+    return lambda: context.get_remaining_time_in_millis() / 1000
 
-    except Error as err:
-        conn.rollback()
-        logging.error("Failed to load data: %s", err)
-        if err.pgcode:
-            logging.error("Error code: %s", err.pgcode)
 
+def archive_incrementally(conn: connection, chunk_days: int = DEFAULT_CHUNK_DAYS,
+                          summarise: Callable[[cursor, date], dict] = summarise_on_server,
+                          time_left: Callable[[], float] = None,
+                          time_margin: float = DEFAULT_TIME_MARGIN_SECONDS) -> dict:
+    """Archives the days from the watermark up to the retention cutoff, chunk_days at a
+    time. Each chunk is archived and the watermark moved past it in one transaction,
+    so a failed run leaves every day either archived once or not at all, and the next
+    run carries on from where it stopped. Data that arrives for a day that has already
+    been archived is added to that day by the next chunk.
 
-def delete_old_data(conn: connection, queries: list[str]) -> None:
-    """Deletes old data from 'arrivals' and 'cancellations'
-    tables in the database that are older than 30 days."""
+    When time_left is given, no chunk is started unless the seconds it returns exceed
+    both time_margin and the longest chunk so far, leaving the rest to the next run.
+    Returns the totals of the rows archived, partitions dropped and rows deleted, and
+    whether everything up to the cutoff has been archived."""
 
-    try:
-        with conn.cursor() as cur:
-            cur.execute("BEGIN;")
-            for query in queries:
-                cur.execute(query)
+    cutoff = get_retention_cutoff(conn)
+    watermark = get_watermark(conn)
+    conn.commit()
+
+    totals = {'chunks': 0, 'complete': True}
+    if watermark is None:
+        return totals
+
+    longest_chunk = 0
+    while watermark < cutoff:
+        if time_left and time_left() < max(time_margin, longest_chunk):
+            logging.warning("Stopping before the time limit, archived up to %s.", watermark)
+            totals['complete'] = False
+            break
+
+        until = min(watermark + timedelta(days=chunk_days), cutoff)
+        started = monotonic()
+
+        try:
+            with conn.cursor() as cur:
+                counts = archive_until(cur, until, summarise)
+                cur.execute(SET_WATERMARK, (WATERMARK_NAME, until))
             conn.commit()
 
-    except Error as err:
-        conn.rollback()
-        logging.error("Failed to delete old data: %s", err)
-        if err.pgcode:
-            logging.error("Error code: %s", err.pgcode)
+        except Error as err:
+            conn.rollback()
+            logging.error("Failed to archive the days before %s: %s", until, err)
+            if err.pgcode:
+                logging.error("Error code: %s", err.pgcode)
+            raise
+
+        logging.info("Archived the days before %s: %s", until, counts)
+        for key, value in counts.items():
+            totals[key] = totals.get(key, 0) + value
+        totals['chunks'] += 1
+        longest_chunk = max(longest_chunk, monotonic() - started)
+        watermark = until
+
+    return totals
 
 
 def handler(event: dict = None, context: dict = None) -> dict:
@@ -177,24 +244,34 @@ def handler(event: dict = None, context: dict = None) -> dict:
 
     load_dotenv()
 
+    mode = ENV.get("ARCHIVE_MODE", DEFAULT_ARCHIVE_MODE)
+    if mode not in ARCHIVE_MODES:
+        raise ValueError(f"ARCHIVE_MODE must be one of {ARCHIVE_MODES}, not {mode!r}.")
+
     try:
 
         conn = get_db_connection(ENV)
         logging.info("Connected to the database successful.")
 
-        stations_data = get_stations_performance(conn, STATION_QUERIES)
-        operators_data = get_operators_performance(conn, OPERATOR_QUERIES)
-
-        if check_keys_exist(stations_data, REQUIRED_KEYS) and check_keys_exist(operators_data, REQUIRED_KEYS):
-            logging.info("Required keys exist in the data.")
-
-            stations_data = clean_data(stations_data)
-            operators_data = clean_data(operators_data)
-
-            load_to_db(conn, convert_to_list(stations_data), INSERT_STATION_PERFORMANCE)
-            load_to_db(conn, convert_to_list(operators_data), INSERT_OPERATOR_PERFORMANCE)
-
-            delete_old_data(conn, DELETION_QUERIES)
+        created = ensure_partitions(conn)
+        logging.info("Created %s new partitions.", created)
+
+        if mode == 'server':
+            counts = archive_on_server(conn)
+            logging.info("Archived on the server: %s", counts)
+            archived = any(counts.values())
+        else:
+            summarise = summarise_on_server
+            if mode == 'client':
+                summarise = partial(summarise_on_client, batch_rows=int(
+                    ENV.get("ARCHIVE_BATCH_ROWS", DEFAULT_BATCH_ROWS)))
+            counts = archive_incrementally(
+                conn, int(ENV.get("ARCHIVE_CHUNK_DAYS", DEFAULT_CHUNK_DAYS)),
+                summarise, get_time_left(context))
+            logging.info("Archived incrementally: %s", counts)
+            archived = True
+
+        if archived:
             logging.info("Old data deleted successfully.")
 
             close_connection(conn)
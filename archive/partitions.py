@@ -0,0 +1,68 @@
+"""This file is responsible for managing the daily partitions
+of the arrivals and cancellations tables."""
+
+from datetime import date, datetime
+import logging
+
+from psycopg2 import sql
+from psycopg2.extensions import connection, cursor
+
+from sql_queries import PARTITIONS, ENSURE_DAILY_PARTITIONS
+
+PARTITIONED_TABLES = ['arrivals', 'cancellations']
+DEFAULT_DAYS_AHEAD = 7
+
+
+def ensure_partitions(conn: connection, days_ahead: int = DEFAULT_DAYS_AHEAD) -> int:
+    """Creates the partitions for today and the coming days that don't exist yet,
+    so that new rows never wait in the default partitions.
+    Returns the number of partitions created."""
+
+    created = 0
+    with conn.cursor() as cur:
+        for table in PARTITIONED_TABLES:
+            cur.execute(ENSURE_DAILY_PARTITIONS, (table, days_ahead))
+            created += cur.fetchone()['created']
+    conn.commit()
+
+    return created
+
+
+def get_partition_day(table: str, partition_name: str) -> date | None:
+    """Returns the day a partition named <table>_pYYYYMMDD holds,
+    or None for the default partition and any others."""
+
+    prefix = f"{table}_p"
+    if not partition_name.startswith(prefix):
+        return None
+
+    try:
+        return datetime.strptime(partition_name[len(prefix):], "%Y%m%d").date()
+    except ValueError:
+        return None
+
+
+def get_expired_partitions(cur: cursor, table: str, cutoff: date) -> list[str]:
+    """Returns the partitions of the table that only hold days before the cutoff."""
+
+    cur.execute(PARTITIONS, (table,))
+
+    return [row['partition_name'] for row in cur.fetchall()
+            if (day := get_partition_day(table, row['partition_name'])) and day < cutoff]
+
+
+def drop_expired_partitions(cur: cursor, until: date) -> int:
+    """Detaches and drops the partitions holding only days before the until day.
+    Dropping a day's partition is instant however many rows it holds, and leaves
+    nothing behind to vacuum. Returns the number of partitions dropped."""
+
+    dropped = 0
+    for table in PARTITIONED_TABLES:
+        for partition_name in get_expired_partitions(cur, table, until):
+            cur.execute(sql.SQL("ALTER TABLE {} DETACH PARTITION {};").format(
+                sql.Identifier(table), sql.Identifier(partition_name)))
+            cur.execute(sql.SQL("DROP TABLE {};").format(sql.Identifier(partition_name)))
+            logging.info("Dropped partition %s.", partition_name)
+            dropped += 1
+
+    return dropped
@@ -1,202 +1,218 @@
 """Contains SQL queries for the archiving process"""
 
-# Station_performance queries
-S_DELAYS = """
-SELECT
-    arrivals.station_id, DATE(scheduled_arrival) AS day, COUNT(*) AS delay_1m_count
-FROM
-    arrivals
-WHERE
-    arrivals.scheduled_arrival < CURRENT_DATE - INTERVAL '30 days'
-        AND
-    arrivals.actual_arrival > arrivals.scheduled_arrival
-GROUP BY
-    arrivals.station_id , day
-ORDER BY
-    day, arrivals.station_id ASC;
-"""
-
-S_DELAYS_OVER_5_MIN = """
-SELECT
-    arrivals.station_id, DATE(scheduled_arrival) AS day, COUNT(*) AS delay_5m_count
-FROM
-    arrivals
-WHERE
-    arrivals.scheduled_arrival < CURRENT_DATE - INTERVAL '30 days'
-        AND
-    arrivals.actual_arrival > arrivals.scheduled_arrival + INTERVAL '5 minutes'
-GROUP BY
-    arrivals.station_id, day
-ORDER BY
-    day, arrivals.station_id ASC;
+# Performance queries
+
+# Aggregates everything scheduled before the until day in one pass over arrivals and
+# cancellations, producing a row per station and day and a row per operator and day.
+# Delays only count arrivals that were late, and station_grain tells the two kinds of
+# row apart.
+PERFORMANCE_CTES = """
+old_calls AS (
+    SELECT
+        station_id, service_id, scheduled_arrival, actual_arrival, FALSE AS cancelled
+    FROM
+        arrivals
+    WHERE
+        scheduled_arrival < %(until)s
+    UNION ALL
+    SELECT
+        station_id, service_id, scheduled_arrival, NULL, TRUE
+    FROM
+        cancellations
+    WHERE
+        scheduled_arrival < %(until)s
+),
+performance AS (
+    SELECT
+        GROUPING(old_calls.station_id) = 0 AS station_grain,
+        CASE WHEN GROUPING(old_calls.station_id) = 0
+            THEN old_calls.station_id ELSE services.operator_id END AS id,
+        DATE(old_calls.scheduled_arrival) AS day,
+        COUNT(*) FILTER (WHERE actual_arrival > scheduled_arrival) AS delay_1m_count,
+        COUNT(*) FILTER (
+            WHERE actual_arrival > scheduled_arrival + INTERVAL '5 minutes') AS delay_5m_count,
+        COALESCE(ROUND(AVG(EXTRACT(EPOCH FROM (actual_arrival - scheduled_arrival)) / 60)
+                       FILTER (WHERE actual_arrival > scheduled_arrival), 2), 0)
+            AS avg_delay_min,
+        COUNT(*) FILTER (WHERE NOT cancelled) AS arrival_count,
+        COUNT(*) FILTER (WHERE cancelled) AS cancellation_count
+    FROM
+        old_calls
+    LEFT JOIN
+        services ON old_calls.service_id = services.service_id
+    GROUP BY GROUPING SETS
+        ((DATE(old_calls.scheduled_arrival), old_calls.station_id),
+         (DATE(old_calls.scheduled_arrival), services.operator_id))
+    HAVING
+        GROUPING(old_calls.station_id) = 0 OR services.operator_id IS NOT NULL
+)
 """
 
-S_AVG_DELAY = """
+PERFORMANCE = f"""
+WITH {PERFORMANCE_CTES}
 SELECT
-    arrivals.station_id, DATE(scheduled_arrival) AS day,
-    ROUND(AVG(EXTRACT(EPOCH FROM (arrivals.actual_arrival - arrivals.scheduled_arrival))/60), 2) AS avg_delay_min
+    *
 FROM
-    arrivals
-WHERE
-    arrivals.scheduled_arrival < CURRENT_DATE - INTERVAL '30 days'
-        AND
-    arrivals.actual_arrival > arrivals.scheduled_arrival
-GROUP BY
-    arrivals.station_id, day
+    performance
 ORDER BY
-    day, arrivals.station_id ASC;
+    station_grain DESC, day, id;
 """
 
-S_TOTAL_ARRIVALS = """
-SELECT
-    arrivals.station_id, DATE(scheduled_arrival) AS day, COUNT(*) AS arrival_count
-FROM
-    arrivals
-WHERE
-    arrivals.scheduled_arrival < CURRENT_DATE - INTERVAL '30 days'
-GROUP BY
-    arrivals.station_id, day
-ORDER BY
-    day, arrivals.station_id ASC;
+# Each station and operator has one archive row per day. Rows for a day that has
+# already been archived, such as late arrivals, are added to it, with the average
+# delay weighted by the number of delayed arrivals.
+MERGE_PERFORMANCE = """
+DO UPDATE SET
+    avg_delay_min = CASE WHEN archived.delay_1m_count + EXCLUDED.delay_1m_count > 0
+        THEN ROUND((archived.avg_delay_min * archived.delay_1m_count
+                    + EXCLUDED.avg_delay_min * EXCLUDED.delay_1m_count)
+                   / (archived.delay_1m_count + EXCLUDED.delay_1m_count), 2)
+        ELSE 0 END,
+    delay_1m_count = archived.delay_1m_count + EXCLUDED.delay_1m_count,
+    delay_5m_count = archived.delay_5m_count + EXCLUDED.delay_5m_count,
+    arrival_count = archived.arrival_count + EXCLUDED.arrival_count,
+    cancellation_count = archived.cancellation_count + EXCLUDED.cancellation_count
 """
 
-S_TOTAL_CANCELLATIONS = """
+# Summarises everything scheduled before the until day into the archive in a single
+# statement.
+SUMMARISE_ON_SERVER = f"""
+WITH {PERFORMANCE_CTES},
+station_rows AS (
+    INSERT INTO
+        archive.station_performance AS archived
+        (station_id, day, delay_1m_count, delay_5m_count, avg_delay_min, arrival_count,
+         cancellation_count)
+    SELECT
+        id, day, delay_1m_count, delay_5m_count, avg_delay_min, arrival_count,
+        cancellation_count
+    FROM
+        performance
+    WHERE
+        station_grain
+    ON CONFLICT (station_id, day)
+    {MERGE_PERFORMANCE}
+    RETURNING 1
+),
+operator_rows AS (
+    INSERT INTO
+        archive.operator_performance AS archived
+        (operator_id, day, delay_1m_count, delay_5m_count, avg_delay_min, arrival_count,
+         cancellation_count)
+    SELECT
+        id, day, delay_1m_count, delay_5m_count, avg_delay_min, arrival_count,
+        cancellation_count
+    FROM
+        performance
+    WHERE
+        NOT station_grain
+    ON CONFLICT (operator_id, day)
+    {MERGE_PERFORMANCE}
+    RETURNING 1
+)
 SELECT
-    cancellations.station_id, DATE(cancellations.scheduled_arrival) AS day, COUNT(*) AS cancellation_count
-FROM
-    cancellations
-WHERE
-    cancellations.scheduled_arrival < CURRENT_DATE - INTERVAL '30 days'
-GROUP BY
-    cancellations.station_id, day
-ORDER BY
-    day, cancellations.station_id ASC;
-"""
-
-# Operator_performance queries
-
-O_DELAYS = """
-SELECT 
-    operators.operator_id, DATE(arrivals.scheduled_arrival) AS day, COUNT(*) AS delay_1m_count 
-FROM 
-    arrivals
-INNER JOIN 
-    services ON arrivals.service_id=services.service_id
-INNER JOIN 
-    operators ON services.operator_id=operators.operator_id
-WHERE 
-    arrivals.actual_arrival>arrivals.scheduled_arrival
-        AND
-    arrivals.scheduled_arrival < CURRENT_DATE - INTERVAL '30 days'
-GROUP BY 
-    operators.operator_id, day
-ORDER BY 
-    day, operators.operator_id ASC;
-"""
-
-O_DELAYS_OVER_5_MIN = """
-SELECT 
-    operators.operator_id,  DATE(arrivals.scheduled_arrival) AS day, COUNT(*) AS delay_5m_count 
-FROM 
-    arrivals
-INNER JOIN 
-    services ON arrivals.service_id=services.service_id
-INNER JOIN 
-    operators ON services.operator_id=operators.operator_id
-WHERE
-    arrivals.actual_arrival > arrivals.scheduled_arrival + INTERVAL '5 minutes'
-AND
-    arrivals.scheduled_arrival < CURRENT_DATE - INTERVAL '30 days'
-GROUP BY 
-    operators.operator_id, day
-ORDER BY 
-    day, operators.operator_id ASC;
-"""
-
-O_AVG_DELAY = """
-SELECT 
-    operators.operator_id, DATE(arrivals.scheduled_arrival) AS day,
-    ROUND(AVG((EXTRACT(EPOCH FROM (actual_arrival - scheduled_arrival)) / 60)), 2) AS avg_delay_min
-FROM 
-    arrivals
-INNER JOIN 
-    services ON arrivals.service_id = services.service_id
-INNER JOIN 
-    operators ON services.operator_id = operators.operator_id
-WHERE 
-    arrivals.actual_arrival > arrivals.scheduled_arrival
-        AND 
-    arrivals.scheduled_arrival < CURRENT_DATE - INTERVAL '30 days'
-GROUP BY 
-    operators.operator_id, day
-ORDER BY 
-    day, operators.operator_id ASC;
-"""
-
-O_TOTAL_ARRIVALS = """
-SELECT 
-    operators.operator_id, DATE(arrivals.scheduled_arrival) AS day, COUNT(*) AS arrival_count
-FROM 
-    arrivals
-INNER JOIN 
-    services ON arrivals.service_id = services.service_id
-INNER JOIN 
-    operators ON services.operator_id = operators.operator_id
-WHERE 
-    arrivals.scheduled_arrival < CURRENT_DATE - INTERVAL '30 days'
-GROUP BY 
-    operators.operator_id, day
-ORDER BY 
-    day, operators.operator_id ASC;
-"""
-
-O_TOTAL_CANCELLATIONS = """
-SELECT 
-    operators.operator_id, DATE(cancellations.scheduled_arrival) AS day, COUNT(*) AS cancellation_count
-FROM 
-    cancellations
-INNER JOIN 
-    services ON cancellations.service_id = services.service_id
-INNER JOIN 
-    operators ON services.operator_id = operators.operator_id
-WHERE 
-    cancellations.scheduled_arrival < CURRENT_DATE - INTERVAL '30 days'
-GROUP BY 
-    operators.operator_id, day
-ORDER BY 
-    day, operators.operator_id ASC;
+    (SELECT COUNT(*) FROM station_rows) AS station_rows,
+    (SELECT COUNT(*) FROM operator_rows) AS operator_rows;
 """
 
 # Insert queries
 
-INSERT_STATION_PERFORMANCE = """
+INSERT_STATION_PERFORMANCE = f"""
 INSERT INTO 
-    archive.station_performance 
+    archive.station_performance AS archived
     (station_id, day, delay_1m_count, delay_5m_count, avg_delay_min, arrival_count, cancellation_count) 
 VALUES
-    (%s, %s, %s, %s, %s, %s, %s);
+    (%s, %s, %s, %s, %s, %s, %s)
+ON CONFLICT (station_id, day)
+{MERGE_PERFORMANCE};
 """
 
-INSERT_OPERATOR_PERFORMANCE = """
+INSERT_OPERATOR_PERFORMANCE = f"""
 INSERT INTO 
-    archive.operator_performance 
+    archive.operator_performance AS archived
     (operator_id, day, delay_1m_count, delay_5m_count, avg_delay_min, arrival_count, cancellation_count) 
 VALUES 
-(%s, %s, %s, %s, %s, %s, %s);
+(%s, %s, %s, %s, %s, %s, %s)
+ON CONFLICT (operator_id, day)
+{MERGE_PERFORMANCE};
+"""
+
+# Stops new arrivals and cancellations being written while old data is archived,
+# so that nothing arrives between summarising the old data and removing it.
+LOCK_PARTITIONED_TABLES = """
+LOCK TABLE arrivals, cancellations IN SHARE MODE;
 """
 
 # Delete queries
 
+# Whole days are retired by dropping their partitions, so these only remove rows
+# scheduled before the until day that are still waiting in the default partitions.
+
 DELETE_OLD_ARRIVAL_DATA = """
 DELETE FROM 
     arrivals
 WHERE 
-    scheduled_arrival < CURRENT_DATE - INTERVAL '30 days';
+    scheduled_arrival < %(until)s;
 """
 
 DELETE_OLD_CANCELLATION_DATA = """
 DELETE FROM 
     cancellations
 WHERE 
-    scheduled_arrival < CURRENT_DATE - INTERVAL '30 days';
+    scheduled_arrival < %(until)s;
+"""
+
+# Data is kept in the short-term tables for 30 days.
+RETENTION_CUTOFF = """
+SELECT
+    CURRENT_DATE - 30 AS cutoff;
+"""
+
+# Watermark queries
+
+GET_WATERMARK = """
+SELECT
+    archived_until
+FROM
+    archive.archive_watermark
+WHERE
+    watermark_name = %s;
+"""
+
+EARLIEST_DAY = """
+SELECT
+    DATE(LEAST((SELECT MIN(scheduled_arrival) FROM arrivals),
+               (SELECT MIN(scheduled_arrival) FROM cancellations))) AS earliest_day;
+"""
+
+SET_WATERMARK = """
+INSERT INTO
+    archive.archive_watermark (watermark_name, archived_until)
+VALUES
+    (%s, %s)
+ON CONFLICT (watermark_name) DO UPDATE SET
+    archived_until = EXCLUDED.archived_until,
+    updated_at = NOW();
+"""
+
+# Partition queries
+
+PARTITIONS = """
+SELECT
+    child.relname AS partition_name
+FROM
+    pg_inherits
+INNER JOIN
+    pg_class AS parent ON pg_inherits.inhparent = parent.oid
+INNER JOIN
+    pg_class AS child ON pg_inherits.inhrelid = child.oid
+WHERE
+    parent.relname = %s
+ORDER BY
+    child.relname;
+"""
+
+ENSURE_DAILY_PARTITIONS = """
+SELECT
+    ensure_daily_partitions(%s, CURRENT_DATE, CURRENT_DATE + %s) AS created;
 """
@@ -1,36 +1,123 @@
 """Tests for the archive module."""
 
-import pandas as pd
+from datetime import date
+from unittest.mock import MagicMock
 
-from archive import convert_to_list
+import pytest
 
+import archive
+from archive import archive_incrementally, get_time_left, handler
 
-def test_convert_to_list_non_empty_df():
-    """Tests that `convert_to_list` correctly converts a DataFrame 
-    with non-empty data into a list of tuples."""
 
-    data = pd.DataFrame({
-        'col1': [1, 2, 3],
-        'col2': ['a', 'b', 'c']
-    })
+def test_handler_rejects_unknown_archive_mode(monkeypatch):
+    """Tests that `handler` refuses an unknown ARCHIVE_MODE before connecting
+    to the database."""
 
-    result = convert_to_list(data)
+    monkeypatch.setenv("ARCHIVE_MODE", "everywhere")
 
-    expected_result = [(1, 'a'), (2, 'b'), (3, 'c')]
-    assert result == expected_result
+    with pytest.raises(ValueError):
+        handler()
 
 
-def test_convert_to_list_mixed_data_types():
-    """Tests that `convert_to_list` handles DataFrame with mixed data types 
-    by converting it into a list of tuples whilst preserving the data types."""
+def test_get_time_left_reads_the_lambda_context():
+    """Tests that `get_time_left` reports the seconds left from the Lambda context,
+    and nothing outside a Lambda."""
 
-    data = pd.DataFrame({
-        'col1': [1, 2, 3],
-        'col2': ['a', 'b', 'c'],
-        'col3': [1.1, 2.2, 3.3]
-    })
+    class FakeContext:
+        """Has 90 seconds left."""
 
-    result = convert_to_list(data)
+        def get_remaining_time_in_millis(self):
+            return 90000
 
-    expected_result = [(1, 'a', 1.1), (2, 'b', 2.2), (3, 'c', 3.3)]
-    assert result == expected_result
+    assert get_time_left(FakeContext())() == 90
+    assert get_time_left(None) is None
+
+
+class FakeConnection:
+    """Records commits and rollbacks, and hands out a cursor that does nothing."""
+
+    def __init__(self):
+        self.commits = 0
+
+    def cursor(self):
+        """Returns a cursor that ignores everything executed on it."""
+
+        return MagicMock()
+
+    def commit(self):
+        """Records the commit."""
+
+        self.commits += 1
+
+    def rollback(self):
+        """Does nothing, as nothing was executed."""
+
+
+@pytest.fixture
+def chunks(monkeypatch):
+    """Archives with a cutoff of 1 May 2024 and records the until day of each chunk."""
+
+    archived = []
+
+    def archive_until(cur, until, summarise):
+        archived.append(until)
+        return {'station_rows': 1}
+
+    monkeypatch.setattr(archive, "get_retention_cutoff", lambda conn: date(2024, 5, 1))
+    monkeypatch.setattr(archive, "archive_until", archive_until)
+    return archived
+
+
+def test_archive_incrementally_resumes_from_the_watermark(monkeypatch, chunks):
+    """Tests that `archive_incrementally` archives from the watermark to the cutoff,
+    clamping the last chunk to the cutoff and committing each chunk."""
+
+    monkeypatch.setattr(archive, "get_watermark", lambda conn: date(2024, 4, 15))
+    conn = FakeConnection()
+
+    totals = archive_incrementally(conn, chunk_days=7)
+
+    assert chunks == [date(2024, 4, 22), date(2024, 4, 29), date(2024, 5, 1)]
+    assert totals == {'chunks': 3, 'complete': True, 'station_rows': 3}
+    assert conn.commits == 4
+
+
+def test_archive_incrementally_does_nothing_when_up_to_date(monkeypatch, chunks):
+    """Tests that `archive_incrementally` archives nothing when the short-term tables
+    are empty or the watermark has reached the cutoff."""
+
+    for watermark in [None, date(2024, 5, 1)]:
+        monkeypatch.setattr(archive, "get_watermark", lambda conn, day=watermark: day)
+
+        assert archive_incrementally(FakeConnection()) == {'chunks': 0, 'complete': True}
+    assert not chunks
+
+
+def test_archive_incrementally_stops_before_the_time_limit(monkeypatch, chunks):
+    """Tests that `archive_incrementally` doesn't start a chunk when the time left is
+    below the margin, reporting that it didn't complete."""
+
+    monkeypatch.setattr(archive, "get_watermark", lambda conn: date(2024, 4, 1))
+    time_left = iter([100, 100, 10])
+
+    totals = archive_incrementally(FakeConnection(), chunk_days=7,
+                                   time_left=lambda: next(time_left), time_margin=30)
+
+    assert chunks == [date(2024, 4, 8), date(2024, 4, 15)]
+    assert totals['complete'] is False
+
+
+def test_archive_incrementally_leaves_time_for_the_longest_chunk(monkeypatch, chunks):
+    """Tests that `archive_incrementally` doesn't start a chunk when the time left is
+    less than the longest chunk so far."""
+
+    monkeypatch.setattr(archive, "get_watermark", lambda conn: date(2024, 4, 1))
+    clock = iter([0, 50])
+    monkeypatch.setattr(archive, "monotonic", lambda: next(clock))
+    time_left = iter([100, 40])
+
+    totals = archive_incrementally(FakeConnection(), chunk_days=7,
+                                   time_left=lambda: next(time_left), time_margin=30)
+
+    assert chunks == [date(2024, 4, 8)]
+    assert totals == {'chunks': 1, 'complete': False, 'station_rows': 1}
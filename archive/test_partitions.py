@@ -0,0 +1,20 @@
+"""Tests for the partitions module."""
+
+from datetime import date
+
+from partitions import get_partition_day
+
+
+def test_get_partition_day_daily_partition():
+    """Tests that `get_partition_day` reads the day from a daily partition's name."""
+
+    assert get_partition_day('arrivals', 'arrivals_p20240430') == date(2024, 4, 30)
+
+
+def test_get_partition_day_other_partitions():
+    """Tests that `get_partition_day` ignores the default partition and any
+    partition not named after a day of the table."""
+
+    assert get_partition_day('arrivals', 'arrivals_default') is None
+    assert get_partition_day('arrivals', 'arrivals_p2024') is None
+    assert get_partition_day('arrivals', 'cancellations_p20240430') is None
@@ -170,21 +170,23 @@ def get_daily_stats(
 
 def get_current_incidents(cur: cursor, station_name: str):
     """
-    Returns a dataframe listing all incidents for operators who operate trains
-    at the given station.
+    Returns a dataframe listing all incidents that have not been cleared for operators
+    who operate trains at the given station.
     """
     query = """
-    SELECT DISTINCT(incidents.*)
+    SELECT incidents.*
     FROM incidents
-    LEFT JOIN operators
-    ON incidents.operator_id = operators.operator_id
-    LEFT JOIN services
-    ON operators.operator_id = services.operator_id
-    lEFT JOIN arrivals
-    ON services.service_id = arrivals.service_id
-    LEFT JOIN stations
-    ON arrivals.station_id = stations.station_id
-    WHERE station_name = %s
+    WHERE NOT incidents.is_cleared
+    AND EXISTS (
+        SELECT 1
+        FROM services
+        JOIN arrivals
+        ON services.service_id = arrivals.service_id
+        JOIN stations
+        ON arrivals.station_id = stations.station_id
+        WHERE services.operator_id = incidents.operator_id
+        AND station_name = %s
+    )
     ORDER BY creation_date DESC;
     """
 
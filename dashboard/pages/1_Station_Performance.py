@@ -172,8 +172,6 @@ if __name__ == "__main__":
 
     incidents = incidents[incidents["Planned?"] == False]
 
-    incidents = incidents[incidents["Cleared?"] == False]
-
     incidents = incidents.drop(["Planned?", "Cleared?"], axis=1)
 
     st.markdown(
@@ -1,3 +1,4 @@
+DROP TABLE IF EXISTS archive.archive_watermark;
 DROP TABLE IF EXISTS archive.station_performance;
 DROP TABLE IF EXISTS archive.operator_performance;
 
@@ -10,7 +11,8 @@ CREATE TABLE archive.station_performance
     delay_5m_count         INT           DEFAULT 0,
     avg_delay_min          DECIMAL(4, 2) DEFAULT 0,
     arrival_count          INT  NOT NULL,
-    cancellation_count     INT           DEFAULT 0
+    cancellation_count     INT           DEFAULT 0,
+    UNIQUE (station_id, day)
 );
 
 CREATE TABLE archive.operator_performance
@@ -22,5 +24,15 @@ CREATE TABLE archive.operator_performance
     delay_5m_count          INT           DEFAULT 0,
     avg_delay_min           DECIMAL(4, 2) DEFAULT 0,
     arrival_count           INT  NOT NULL,
-    cancellation_count      INT           DEFAULT 0
+    cancellation_count      INT           DEFAULT 0,
+    UNIQUE (operator_id, day)
+);
+
+-- The first day that hasn't been archived yet. Everything scheduled before it has been
+-- summarised into the performance tables and removed from the short-term tables.
+CREATE TABLE archive.archive_watermark
+(
+    watermark_name VARCHAR(30) PRIMARY KEY,
+    archived_until DATE      NOT NULL,
+    updated_at     TIMESTAMP NOT NULL DEFAULT NOW()
 );
\ No newline at end of file
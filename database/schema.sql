@@ -1,3 +1,4 @@
+DROP TABLE IF EXISTS load_checkpoints;
 DROP TABLE IF EXISTS incidents;
 DROP TABLE IF EXISTS operator_subscriptions;
 DROP TABLE IF EXISTS station_subscriptions;
@@ -34,20 +35,71 @@ CREATE TABLE cancellation_types (
     description TEXT
 );
 
+-- Arrivals and cancellations are partitioned by day of scheduled arrival, so old days
+-- are retired by dropping whole partitions. Rows for days without a partition yet
+-- land in the default partition until ensure_daily_partitions creates one.
 CREATE TABLE cancellations (
-    cancellation_id SERIAL PRIMARY KEY,
+    cancellation_id SERIAL,
     scheduled_arrival TIMESTAMP NOT NULL,
     cancellation_type_id INT REFERENCES cancellation_types(cancellation_type_id),
     station_id INT REFERENCES stations(station_id),
-    service_id INT REFERENCES services(service_id)
-);
+    service_id INT REFERENCES services(service_id),
+    PRIMARY KEY (cancellation_id, scheduled_arrival),
+    UNIQUE (service_id, station_id, scheduled_arrival)
+) PARTITION BY RANGE (scheduled_arrival);
+
+CREATE TABLE cancellations_default PARTITION OF cancellations DEFAULT;
 
 CREATE TABLE arrivals (
-    arrival_id SERIAL PRIMARY KEY,
+    arrival_id SERIAL,
     scheduled_arrival TIMESTAMP NOT NULL,
     actual_arrival TIMESTAMP NOT NULL,
     station_id INT REFERENCES stations(station_id),
-    service_id INT REFERENCES services(service_id)
+    service_id INT REFERENCES services(service_id),
+    PRIMARY KEY (arrival_id, scheduled_arrival),
+    UNIQUE (service_id, station_id, scheduled_arrival)
+) PARTITION BY RANGE (scheduled_arrival);
+
+CREATE TABLE arrivals_default PARTITION OF arrivals DEFAULT;
+
+-- Creates a partition of the table for each day from first_day to last_day that doesn't
+-- have one, named <table>_pYYYYMMDD, moving in any rows for the day that are waiting in
+-- the default partition. Returns the number of partitions created.
+CREATE OR REPLACE FUNCTION ensure_daily_partitions(parent TEXT, first_day DATE, last_day DATE)
+RETURNS INT AS $$
+DECLARE
+    day DATE;
+    partition_name TEXT;
+    created INT := 0;
+BEGIN
+    FOR day IN SELECT generate_series(first_day, last_day, INTERVAL '1 day')::DATE LOOP
+        partition_name := format('%s_p%s', parent, to_char(day, 'YYYYMMDD'));
+        CONTINUE WHEN to_regclass(partition_name) IS NOT NULL;
+
+        EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+                       partition_name, parent);
+        EXECUTE format('WITH moved AS (DELETE FROM %I WHERE scheduled_arrival >= %L
+                                       AND scheduled_arrival < %L RETURNING *)
+                        INSERT INTO %I SELECT * FROM moved',
+                       parent || '_default', day, day + 1, partition_name);
+        EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                       parent, partition_name, day, day + 1);
+        created := created + 1;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT ensure_daily_partitions('arrivals', CURRENT_DATE - 31, CURRENT_DATE + 7);
+SELECT ensure_daily_partitions('cancellations', CURRENT_DATE - 31, CURRENT_DATE + 7);
+
+CREATE TABLE load_checkpoints (
+    crs_code VARCHAR(3) NOT NULL,
+    day DATE NOT NULL,
+    arrival_count INT NOT NULL,
+    cancellation_count INT NOT NULL,
+    loaded_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (crs_code, day)
 );
 
 CREATE TABLE users (
@@ -84,5 +136,8 @@ CREATE TABLE incidents (
     is_cleared BOOLEAN NOT NULL,
     affected_routes TEXT,
     summary TEXT NOT NULL,
-    info_link TEXT
-);
\ No newline at end of file
+    info_link TEXT,
+    UNIQUE (operator_id, incident_uuid)
+);
+
+CREATE INDEX incidents_current_idx ON incidents (operator_id) WHERE NOT is_cleared;
\ No newline at end of file
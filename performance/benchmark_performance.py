@@ -0,0 +1,281 @@
+"""
+Benchmarks for the performance pipeline. Run with:
+
+    python3 benchmark_performance.py --services 20000 --repeats 5
+
+Synthetic RTT payloads are generated from a fixed seed and every result is the median
+of several repeats, so numbers are comparable from run to run.
+
+Load throughput is only measured if BENCH_DB_NAME (and optionally BENCH_DB_USER,
+BENCH_DB_PASS, BENCH_DB_HOST and BENCH_DB_PORT) point at a PostgreSQL database with the
+schema in database/schema.sql loaded. The arrivals, cancellations and load_checkpoints
+tables of that database are truncated, so never point it at a live database.
+"""
+
+from argparse import ArgumentParser, Namespace
+from datetime import date, datetime
+from os import environ as ENV
+import random
+from statistics import median
+from time import perf_counter
+from timeit import repeat
+
+import psycopg2
+from psycopg2._psycopg import connection
+
+from dimension_cache import DimensionCache
+from performance_load import upload_service_batch, upload_train_data
+from performance_transform import (
+    transform_train_services_data,
+    transform_train_services_data_columnar,
+)
+from time_resolution import parse_hhmm, resolve_actual_time, resolve_scheduled_time
+
+RUN_DATE = date(2024, 4, 30)
+
+TIME_STRINGS = [f"{minute // 60:02d}{minute % 60:02d}" for minute in range(24 * 60)]
+
+OPERATORS = [
+    ("NT", "Northern"),
+    ("TP", "TransPennine Express"),
+    ("GR", "London North Eastern Railway"),
+    ("XC", "CrossCountry"),
+    ("EM", "East Midlands Railway"),
+]
+
+CANCELLATION_REASONS = [
+    ("TG", "a shortage of train crew"),
+    ("IA", "a signalling problem"),
+    ("YI", "a late running train being in front of this one"),
+    ("JX", "a fault with the train"),
+]
+
+# Arrival delays in minutes and their relative frequencies.
+DELAYS = [-2, -1, 0, 1, 2, 3, 5, 8, 12, 20, 35, 60]
+DELAY_WEIGHTS = [3, 8, 35, 18, 11, 8, 6, 4, 3, 2, 1, 1]
+
+# Services are booked between 05:00 and 00:59 the following day.
+FIRST_MINUTE = 5 * 60
+LAST_MINUTE = 25 * 60
+
+
+def strptime_datetime(run_date: date, time_str: str) -> datetime:
+    """The original strptime-based time parser, kept as a baseline."""
+    return datetime.combine(run_date, datetime.strptime(time_str, "%H%M").time())
+
+
+def lookup_datetime(run_date: date, time_str: str) -> datetime:
+    """The lookup table time parser."""
+    return datetime.combine(run_date, parse_hhmm(time_str))
+
+
+def resolve_arrival(run_date: date, time_str: str) -> datetime:
+    """Resolves a scheduled and an actual time, as the transform does per arrival."""
+    scheduled = resolve_scheduled_time(run_date, time_str)
+    return resolve_actual_time(run_date, scheduled, time_str)
+
+
+def format_minutes(minutes: int) -> tuple[str, bool]:
+    """Returns a minute offset from midnight as an HHMM string and a next day flag."""
+    return f"{minutes // 60 % 24:02d}{minutes % 60:02d}", minutes >= 24 * 60
+
+
+def generate_services(
+    count: int,
+    station_crs: str = "LDS",
+    station_name: str = "Leeds",
+    seed: int = 0,
+    cancellation_rate: float = 0.03,
+    origin_rate: float = 0.05,
+    bus_rate: float = 0.01,
+) -> list[dict]:
+    """
+    Returns `count` synthetic services shaped like those in an RTT location search
+    response. A fraction of services are cancelled, start at the station (so only have
+    departure times) or are replacement buses, and some run past midnight.
+    The same seed always produces the same services.
+    """
+    rng = random.Random(seed)
+    services = []
+
+    for index in range(count):
+        operator_code, operator_name = rng.choice(OPERATORS)
+        booked = rng.randrange(FIRST_MINUTE, LAST_MINUTE)
+        booked_str, booked_next_day = format_minutes(booked)
+        prefix = "Departure" if rng.random() < origin_rate else "Arrival"
+
+        location = {
+            "tiploc": station_crs,
+            "crs": station_crs,
+            "description": station_name,
+            f"gbttBooked{prefix}": booked_str,
+            "displayAs": "ORIGIN" if prefix == "Departure" else "CALL",
+        }
+        if booked_next_day:
+            location[f"gbttBooked{prefix}NextDay"] = True
+
+        if rng.random() < cancellation_rate:
+            code, reason = rng.choice(CANCELLATION_REASONS)
+            location["displayAs"] = "CANCELLED_CALL"
+            location["cancelReasonCode"] = code
+            location["cancelReasonShortText"] = reason
+            location["cancelReasonLongText"] = (
+                f"This train has been cancelled because of {reason}"
+            )
+        else:
+            realtime = booked + rng.choices(DELAYS, DELAY_WEIGHTS)[0]
+            realtime_str, realtime_next_day = format_minutes(realtime)
+            location[f"realtime{prefix}"] = realtime_str
+            location[f"realtime{prefix}Actual"] = True
+            if realtime_next_day:
+                location[f"realtime{prefix}NextDay"] = True
+
+        headcode = f"{rng.randrange(10)}{rng.choice('ABCDEFGHJKLMNPRSTUVWXY')}"
+
+        services.append(
+            {
+                "locationDetail": location,
+                "serviceUid": f"{chr(65 + index // 100_000 % 26)}{index % 100_000:05d}",
+                "runDate": RUN_DATE.isoformat(),
+                "trainIdentity": f"{headcode}{rng.randrange(100):02d}",
+                "atocCode": operator_code,
+                "atocName": operator_name,
+                "serviceType": "bus" if rng.random() < bus_rate else "train",
+                "isPassenger": True,
+            }
+        )
+
+    return services
+
+
+def benchmark(func, number: int = 10, repeats: int = 5) -> float:
+    """Returns the median time in seconds of `repeats` runs of `number` calls to func."""
+    return median(repeat(func, number=number, repeat=repeats))
+
+
+def benchmark_time_parsing() -> dict[str, float]:
+    """Returns the median time per call, in microseconds, of each time parser."""
+    number = 10
+    results = {}
+
+    for parser in (strptime_datetime, lookup_datetime, resolve_arrival):
+        elapsed = benchmark(
+            lambda parser=parser: [parser(RUN_DATE, value) for value in TIME_STRINGS],
+            number=number,
+        )
+        results[parser.__name__] = elapsed / (number * len(TIME_STRINGS)) * 1e6
+
+    return results
+
+
+def benchmark_transform(services: list[dict], repeats: int = 5) -> dict[str, float]:
+    """Returns the median throughput, in services per second, of each transform."""
+    results = {}
+
+    for transform in (
+        transform_train_services_data,
+        transform_train_services_data_columnar,
+    ):
+        elapsed = benchmark(
+            lambda transform=transform: transform(services, RUN_DATE),
+            number=1,
+            repeats=repeats,
+        )
+        results[transform.__name__] = len(services) / elapsed
+
+    return results
+
+
+def get_benchmark_connection(config: dict[str, str]) -> connection | None:
+    """Returns a benchmark database connection, or None if one isn't configured."""
+    if not config.get("BENCH_DB_NAME"):
+        return None
+
+    return psycopg2.connect(
+        database=config["BENCH_DB_NAME"],
+        user=config.get("BENCH_DB_USER"),
+        password=config.get("BENCH_DB_PASS"),
+        host=config.get("BENCH_DB_HOST"),
+        port=config.get("BENCH_DB_PORT"),
+    )
+
+
+def truncate_facts(conn: connection) -> None:
+    """Empties the tables that each benchmarked load writes to."""
+    with conn, conn.cursor() as cur:
+        cur.execute("TRUNCATE arrivals, cancellations, load_checkpoints;")
+
+
+def benchmark_load(
+    conn: connection, services: list[dict], repeats: int = 5
+) -> dict[str, float]:
+    """
+    Returns the median throughput, in services per second, of each loader. Every repeat
+    loads into empty fact tables with a cold dimension cache, after a warm-up load has
+    created the operators, stations, services and cancellation types, and is followed
+    by a reload of the same rows to measure the upsert path.
+    """
+    station_crs = services[0]["locationDetail"]["crs"]
+    arrivals, cancellations = transform_train_services_data(services, RUN_DATE)
+    batch = transform_train_services_data_columnar(services, RUN_DATE)
+
+    loaders = {
+        upload_train_data.__name__: lambda cache: upload_train_data(
+            conn, arrivals, cancellations, cache, (station_crs, RUN_DATE)
+        ),
+        upload_service_batch.__name__: lambda cache: upload_service_batch(
+            conn, batch, cache, (station_crs, RUN_DATE)
+        ),
+    }
+
+    results = {}
+    for name, load in loaders.items():
+        load(None)
+
+        timings = {"insert": [], "reload": []}
+        for _ in range(repeats):
+            truncate_facts(conn)
+            cache = DimensionCache()
+            for phase in ("insert", "reload"):
+                start = perf_counter()
+                load(cache)
+                timings[phase].append(perf_counter() - start)
+
+        for phase, elapsed in timings.items():
+            results[f"{name} ({phase})"] = len(services) / median(elapsed)
+
+    truncate_facts(conn)
+
+    return results
+
+
+def parse_args(args: list[str] = None) -> Namespace:
+    """Parses the command line arguments."""
+    parser = ArgumentParser(description="Benchmarks the performance pipeline.")
+    parser.add_argument("--services", type=int, default=20_000)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    print("Time parsing:")
+    for name, microseconds in benchmark_time_parsing().items():
+        print(f"  {name:<40} {microseconds:12.3f} us/call")
+
+    services = generate_services(args.services, seed=args.seed)
+
+    print(f"Transform ({args.services} services, seed {args.seed}):")
+    for name, throughput in benchmark_transform(services, args.repeats).items():
+        print(f"  {name:<40} {throughput:12,.0f} services/s")
+
+    conn = get_benchmark_connection(ENV)
+    if conn is None:
+        print("Load: skipped, BENCH_DB_NAME is not set.")
+    else:
+        print(f"Load ({args.services} services, seed {args.seed}):")
+        for name, throughput in benchmark_load(conn, services, args.repeats).items():
+            print(f"  {name:<40} {throughput:12,.0f} services/s")
+        conn.close()
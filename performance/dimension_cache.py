@@ -0,0 +1,103 @@
+"""An in-process cache of the primary keys of the performance pipeline's lookup tables."""
+
+from __future__ import annotations
+
+from collections import Counter, OrderedDict
+from collections.abc import Iterable
+
+from psycopg2._psycopg import cursor
+
+DEFAULT_MAX_SERVICES = 50_000
+
+WARM_QUERIES = {
+    "operators": "SELECT operator_code, operator_id FROM operators;",
+    "stations": "SELECT crs_code, station_id FROM stations;",
+    "cancellation_types": """
+        SELECT cancellation_code, cancellation_type_id FROM cancellation_types;
+        """,
+    "services": """
+        SELECT service_uid, service_id
+        FROM services
+        ORDER BY service_id DESC
+        LIMIT %s;
+        """,
+}
+
+
+class DimensionCache:
+    """
+    Maps the natural keys of operators, stations, services and cancellation types to
+    their primary keys so that the loader only touches the database for keys it has not
+    seen before. The operators, stations and cancellation types tables are small and are
+    cached in full; services are held in a least-recently-used cache of bounded size.
+    """
+
+    def __init__(self, max_services: int = DEFAULT_MAX_SERVICES):
+        self.max_services = max_services
+        self.tables = {
+            "operators": {},
+            "stations": {},
+            "cancellation_types": {},
+            "services": OrderedDict(),
+        }
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def warm(self, cur: cursor) -> None:
+        """Loads the existing keys of every lookup table from the database."""
+        for table, query in WARM_QUERIES.items():
+            if table == "services":
+                cur.execute(query, (self.max_services,))
+                # Oldest first, so that the most recent services are the last evicted.
+                self.store(table, reversed(cur.fetchall()))
+            else:
+                cur.execute(query)
+                self.store(table, cur.fetchall())
+
+    def lookup(self, table: str, keys: Iterable) -> tuple[dict, list]:
+        """
+        Returns a mapping of the cached natural keys to primary keys, along with a
+        list of the keys that were not found in the cache.
+        """
+        cached = self.tables[table]
+        found = {}
+        missing = []
+
+        for key in keys:
+            if key in cached:
+                found[key] = cached[key]
+                if table == "services":
+                    cached.move_to_end(key)
+            else:
+                missing.append(key)
+
+        self.hits[table] += len(found)
+        self.misses[table] += len(missing)
+
+        return found, missing
+
+    def store(self, table: str, items: Iterable[tuple]) -> None:
+        """Adds (natural key, primary key) pairs to the cache."""
+        cached = self.tables[table]
+
+        if table != "services":
+            cached.update(items)
+            return
+
+        for key, value in items:
+            cached[key] = value
+            cached.move_to_end(key)
+
+        while len(cached) > self.max_services:
+            cached.popitem(last=False)
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """Returns the number of hits, misses and cached keys for each table."""
+        return {
+            table: {
+                "hits": self.hits[table],
+                "misses": self.misses[table],
+                "size": len(cached),
+            }
+            for table, cached in self.tables.items()
+        }
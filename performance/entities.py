@@ -2,26 +2,28 @@ from dataclasses import dataclass
 from typing import Optional
 from datetime import datetime
 
+import numpy as np
 
-@dataclass
+
+@dataclass(frozen=True, slots=True)
 class Operator:
     operator_name: str
     operator_code: str
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Station:
     crs_code: str
     station_name: str
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Service:
     operator: Operator
     service_uid: str
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Arrival:
     station: Station
     service: Service
@@ -29,15 +31,69 @@ class Arrival:
     actual_arrival: datetime
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class CancellationType:
     cancellation_code: str
     description: str
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Cancellation:
     cancellation_type: CancellationType
     station: Station
     service: Service
     scheduled_arrival: datetime
+
+
+class EntityInterner:
+    """
+    Hands out one shared instance per distinct entity value, so that a batch holds a
+    single object for each operator, service or cancellation type however many rows
+    refer to it. Entities are frozen, so sharing them is safe.
+    """
+
+    __slots__ = ("_entities",)
+
+    def __init__(self):
+        self._entities = {}
+
+    def get(self, entity_type: type, *args):
+        """Returns the shared instance of entity_type constructed from args."""
+        key = (entity_type, *args)
+        entity = self._entities.get(key)
+        if entity is None:
+            entity = self._entities[key] = entity_type(*args)
+        return entity
+
+    def __len__(self) -> int:
+        return len(self._entities)
+
+
+@dataclass
+class ServiceBatch:
+    """
+    A columnar batch of the train services at one station on one day. Each array holds
+    one element per service; rows are arrivals or cancellations according to
+    `is_cancelled`, and rows that could not be parsed are excluded by `valid`.
+    """
+
+    station: Station
+    service_uids: np.ndarray
+    operator_codes: np.ndarray
+    operator_names: np.ndarray
+    scheduled_arrivals: np.ndarray
+    actual_arrivals: np.ndarray
+    cancellation_codes: np.ndarray
+    cancellation_descriptions: np.ndarray
+    is_cancelled: np.ndarray
+    valid: np.ndarray
+
+    @property
+    def arrival_mask(self) -> np.ndarray:
+        """Returns a mask of the valid arrivals in the batch."""
+        return self.valid & ~self.is_cancelled
+
+    @property
+    def cancellation_mask(self) -> np.ndarray:
+        """Returns a mask of the valid cancellations in the batch."""
+        return self.valid & self.is_cancelled
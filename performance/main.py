@@ -1,45 +1,233 @@
-"""Main script for data pipeline."""
+"""
+Main script for data pipeline.
 
+By default, loads yesterday's data for every station in the stations file. A date range
+and list of stations can be given to backfill missed days, e.g.
+
+    python3 main.py --start 2024-04-01 --end 2024-04-14 --stations LDS YRK
+
+Station-days that have already been loaded are skipped, and reloaded rows are upserted,
+so an interrupted run can simply be restarted.
+
+If a cache directory is given (or RESPONSE_CACHE_DIR is set), raw API responses are
+stored in it, and --replay transforms and loads from that cache without network access
+(combine with --force to reprocess days that have already been loaded).
+
+--columnar transforms each station-day into a columnar batch with vectorised time
+parsing instead of building an object per service.
+
+At the end of each run, stage timings and counters (fetch latency and payload size per
+station-day, services parsed and skipped, rows loaded and database round trips) are
+printed as JSON lines, and written in the Prometheus text format to --metrics-file (or
+METRICS_FILE) if given.
+"""
+
+from argparse import ArgumentParser, Namespace
 from datetime import date, timedelta
+import logging
 from os import environ as ENV
 
 import psycopg2
+from psycopg2._psycopg import connection
 from dotenv import load_dotenv
 
-from performance_extract import fetch_train_services_data_for_station, load_row_from_csv
-from performance_load import upload_arrivals, upload_cancellations
-from performance_transform import transform_train_services_data
+from dimension_cache import DimensionCache
+from pipeline_metrics import PipelineMetrics
+from performance_extract import (
+    fetch_train_services_data_for_station_days,
+    replay_train_services_data_for_station_days,
+    load_row_from_csv,
+    DEFAULT_MAX_WORKERS,
+    DEFAULT_REQUESTS_PER_SECOND,
+)
+from performance_load import (
+    get_loaded_station_days,
+    upload_service_batch,
+    upload_train_data,
+)
+from performance_transform import (
+    transform_train_services_data,
+    transform_train_services_data_columnar,
+)
+from response_cache import ResponseCache
 
 STATIONS_FILENAME = "stations.csv"
 
 DAY_DELTA = 1
 
+
+def parse_args(args: list[str] = None) -> Namespace:
+    """Parses the command line arguments, defaulting to yesterday for all stations."""
+    yesterday = date.today() - timedelta(days=DAY_DELTA)
+
+    parser = ArgumentParser(description="Loads RTT arrivals and cancellations.")
+    parser.add_argument("--start", type=date.fromisoformat, default=yesterday)
+    parser.add_argument("--end", type=date.fromisoformat, default=None)
+    parser.add_argument("--stations", nargs="+", default=None)
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Reload station-days even if they have already been loaded.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=ENV.get("RESPONSE_CACHE_DIR"),
+        help="Directory in which raw API responses are cached.",
+    )
+    parser.add_argument(
+        "--replay",
+        action="store_true",
+        help="Load from the response cache instead of the API.",
+    )
+    parser.add_argument(
+        "--columnar",
+        action="store_true",
+        help="Use the columnar transform and batch loader.",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        default=ENV.get("METRICS_FILE"),
+        help="File to which run metrics are written in the Prometheus text format.",
+    )
+
+    parsed = parser.parse_args(args)
+    parsed.end = parsed.end or parsed.start
+
+    if parsed.end < parsed.start:
+        parser.error("--end must not be before --start")
+
+    if parsed.replay and not parsed.cache_dir:
+        parser.error("--replay requires --cache-dir or RESPONSE_CACHE_DIR")
+
+    return parsed
+
+
+def get_station_days(
+    stations: list[str], start: date, end: date
+) -> list[tuple[str, date]]:
+    """Returns every (station crs, date) pair between the start and end dates inclusive."""
+    return [
+        (station, start + timedelta(days=offset))
+        for offset in range((end - start).days + 1)
+        for station in stations
+    ]
+
+
+def get_db_connection(config: dict[str, str], cursor_factory=None) -> connection:
+    """Returns a connection to the database."""
+    return psycopg2.connect(
+        database=config["DB_NAME"],
+        user=config["DB_USER"],
+        password=config["DB_PASS"],
+        host=config["DB_HOST"],
+        port=config["DB_PORT"],
+        cursor_factory=cursor_factory,
+    )
+
+
+def transform_and_upload(
+    conn: connection,
+    station: str,
+    day: date,
+    services: list[dict],
+    cache: DimensionCache,
+    metrics: PipelineMetrics,
+    columnar: bool = False,
+) -> None:
+    """Transforms and uploads a station-day's services, recording what was loaded."""
+    with metrics.stage("transform"):
+        if services and columnar:
+            batch = transform_train_services_data_columnar(services, day)
+            arrival_count = int(batch.arrival_mask.sum())
+            cancellation_count = int(batch.cancellation_mask.sum())
+        elif services:
+            arrivals, cancellations = transform_train_services_data(services, day)
+            arrival_count, cancellation_count = len(arrivals), len(cancellations)
+        else:
+            arrivals, cancellations = [], []
+            arrival_count = cancellation_count = 0
+
+    with metrics.stage("load"):
+        if services and columnar:
+            upload_service_batch(conn, batch, cache, (station, day))
+        else:
+            upload_train_data(conn, arrivals, cancellations, cache, (station, day))
+
+    metrics.record_station_day(
+        station,
+        day,
+        services_parsed=arrival_count + cancellation_count,
+        services_skipped=len(services) - arrival_count - cancellation_count,
+        arrivals_loaded=arrival_count,
+        cancellations_loaded=cancellation_count,
+    )
+
+
 if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s:%(levelname)s:%(message)s"
+    )
+
     load_dotenv()
 
-    conn = psycopg2.connect(
-        database=ENV["DB_NAME"],
-        user=ENV["DB_USER"],
-        password=ENV["DB_PASS"],
-        host=ENV["DB_HOST"],
-        port=ENV["DB_PORT"],
-    )
+    args = parse_args()
+
+    response_cache = ResponseCache(args.cache_dir) if args.cache_dir else None
 
-    date = date.today() - timedelta(days=DAY_DELTA)
+    metrics = PipelineMetrics()
 
-    stations = load_row_from_csv(STATIONS_FILENAME)
+    conn = get_db_connection(ENV, cursor_factory=metrics.cursor_factory())
 
-    for station in stations:
-        services = fetch_train_services_data_for_station(
-            station,
-            date,
+    cache = DimensionCache()
+    with conn, conn.cursor() as cur:
+        cache.warm(cur)
+
+    stations = args.stations or load_row_from_csv(STATIONS_FILENAME)
+
+    station_days = get_station_days(stations, args.start, args.end)
+
+    if not args.force:
+        loaded = get_loaded_station_days(conn, args.start, args.end)
+        station_days = [
+            station_day for station_day in station_days if station_day not in loaded
+        ]
+
+    logging.info("Loading %s station-days.", len(station_days))
+
+    if args.replay:
+        fetched = replay_train_services_data_for_station_days(
+            station_days, response_cache
+        )
+    else:
+        fetched = fetch_train_services_data_for_station_days(
+            station_days,
             username=ENV["REALTIME_API_USER"],
             password=ENV["REALTIME_API_PASS"],
+            max_workers=int(ENV.get("FETCH_MAX_WORKERS", DEFAULT_MAX_WORKERS)),
+            requests_per_second=float(
+                ENV.get("FETCH_REQUESTS_PER_SECOND", DEFAULT_REQUESTS_PER_SECOND)
+            ),
+            skip_failures=True,
+            cache=response_cache,
+            metrics=metrics,
         )
 
-        arrivals, cancellations = transform_train_services_data(services, date)
+    while True:
+        with metrics.stage("fetch_wait"):
+            result = next(fetched, None)
+
+        if result is None:
+            break
+
+        transform_and_upload(conn, *result, cache, metrics, args.columnar)
 
-        upload_arrivals(conn=conn, arrivals=arrivals)
-        upload_cancellations(conn=conn, cancellations=cancellations)
+    logging.info("Dimension cache statistics: %s", cache.stats())
 
     conn.close()
+
+    for line in metrics.to_json_lines():
+        print(line)
+
+    if args.metrics_file:
+        with open(args.metrics_file, "w", encoding="UTF-8") as file:
+            file.write(metrics.to_prometheus())
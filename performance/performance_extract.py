@@ -1,35 +1,207 @@
 """Extract script for the station_performance pipeline."""
 
 import csv
+import json
+import logging
+import threading
+import time
+from collections.abc import Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import date
+from itertools import islice
+from urllib.parse import urlparse
 
 import requests
 from requests.auth import HTTPBasicAuth
 
+from pipeline_metrics import PipelineMetrics
+from response_cache import ResponseCache
+
 RTT_API_URL = "https://api.rtt.io/api/v1/json/search/"
 
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_REQUESTS_PER_SECOND = 5.0
+
+
+class RateLimiter:
+    """
+    Spaces out requests to each host so that no more than `requests_per_second`
+    requests are started against any single host. Safe to share between threads.
+    """
+
+    def __init__(self, requests_per_second: float):
+        self.interval = 1 / requests_per_second if requests_per_second > 0 else 0
+        self._lock = threading.Lock()
+        self._next_slot = {}
+
+    def wait(self, url: str) -> None:
+        """Blocks until a request to the host of the given url may be started."""
+        if not self.interval:
+            return
+
+        host = urlparse(url).netloc
+
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval
+
+        if slot > now:
+            time.sleep(slot - now)
+
 
 def fetch_train_services_data_for_station(
-    station_crs, date: date, username: str, password: str
+    station_crs,
+    date: date,
+    username: str,
+    password: str,
+    api_url: str = RTT_API_URL,
+    rate_limiter: RateLimiter = None,
+    cache: ResponseCache = None,
+    metrics: PipelineMetrics = None,
 ) -> list[dict]:
     """This function accepts the crs code of a station and returns a list of dictionaries.
     Each dictionary represents a train that arrived at the station or intended to arrive
     at the station on this current day.
     The keys of the dictionary correspond to information about the train, the service
-    of the train, its arrival/departure times, or information on cancellations."""
+    of the train, its arrival/departure times, or information on cancellations.
+    If a cache is given, the raw response is stored in it, and if metrics are given,
+    the request's latency and payload size are recorded."""
+
+    url = f"{api_url}{station_crs}/{date.year}/{date.month:02d}/{date.day:02d}"
+
+    if rate_limiter:
+        rate_limiter.wait(url)
+
+    start = time.perf_counter()
 
     response = requests.get(
-        f"{RTT_API_URL}{station_crs}/{date.year}/{date.month:02d}/{date.day:02d}",
+        url,
         auth=HTTPBasicAuth(username, password),
         timeout=60,
     )
 
+    if metrics:
+        metrics.record_station_day(
+            station_crs,
+            date,
+            fetch_seconds=round(time.perf_counter() - start, 3),
+            payload_bytes=len(response.content),
+            status_code=str(response.status_code),
+        )
+
     response.raise_for_status()
 
-    if "services" not in response.json().keys():
-        raise ValueError(f"Station {station_crs} caused an error: {response.text}")
+    if cache:
+        cache.put(station_crs, date, response.content)
+
+    return get_services_from_payload(station_crs, response.json(), response.text)
+
+
+def get_services_from_payload(station_crs: str, payload: dict, raw: str) -> list[dict]:
+    """
+    Returns the list of services from a parsed RTT API response, raising a ValueError
+    including the raw response if it does not contain any. RTT gives null services for
+    a station with no services that day, which is returned as an empty list.
+    """
+    if "services" not in payload.keys():
+        raise ValueError(f"Station {station_crs} caused an error: {raw}")
+
+    return payload["services"] or []
+
+
+def fetch_train_services_data_for_station_days(
+    station_days: Iterable[tuple[str, date]],
+    username: str,
+    password: str,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    requests_per_second: float = DEFAULT_REQUESTS_PER_SECOND,
+    api_url: str = RTT_API_URL,
+    skip_failures: bool = False,
+    cache: ResponseCache = None,
+    metrics: PipelineMetrics = None,
+) -> Iterator[tuple[str, date, list[dict]]]:
+    """
+    Fetches the services for each (station crs, date) pair concurrently using a bounded
+    pool of worker threads, yielding (station crs, date, services) tuples in the order
+    that the requests complete so that they can be transformed and loaded straight away.
+    At most twice `max_workers` station-days are fetched or waiting to be yielded at
+    once, so a slow consumer holds back fetching rather than letting responses pile up.
+    Requests to the API host are rate limited to `requests_per_second`.
+    If `skip_failures` is set, station-days that fail to fetch are logged and skipped
+    rather than raising. If a cache is given, every raw response is stored in it.
+    If metrics are given, each request's latency and payload size are recorded.
+    """
+    rate_limiter = RateLimiter(requests_per_second)
+    station_days = iter(station_days)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+
+        def submit(station_days_to_fetch: Iterable[tuple[str, date]]) -> None:
+            """Starts fetching each of the station-days."""
+            for station_crs, day in station_days_to_fetch:
+                future = executor.submit(
+                    fetch_train_services_data_for_station,
+                    station_crs,
+                    day,
+                    username,
+                    password,
+                    api_url,
+                    rate_limiter,
+                    cache,
+                    metrics,
+                )
+                futures[future] = (station_crs, day)
+
+        submit(islice(station_days, 2 * max_workers))
+
+        try:
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    station_crs, day = futures.pop(future)
+                    submit(islice(station_days, 1))
+                    try:
+                        services = future.result()
+                    except (requests.RequestException, ValueError) as err:
+                        if metrics:
+                            metrics.increment("fetch_failures")
+                        if not skip_failures:
+                            raise
+                        logging.error(
+                            "Failed to fetch %s for %s: %s", station_crs, day, err
+                        )
+                        continue
+                    yield station_crs, day, services
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def replay_train_services_data_for_station_days(
+    station_days: Iterable[tuple[str, date]], cache: ResponseCache
+) -> Iterator[tuple[str, date, list[dict]]]:
+    """
+    Yields (station crs, date, services) tuples from previously cached RTT responses
+    without any network access. Station-days missing from the cache, or whose cached
+    response contains no services, are logged and skipped.
+    """
+    for station_crs, day in station_days:
+        payload = cache.get(station_crs, day)
+
+        if payload is None:
+            logging.warning("No cached response for %s on %s.", station_crs, day)
+            continue
+
+        raw = payload.decode("UTF-8")
+        try:
+            services = get_services_from_payload(station_crs, json.loads(raw), raw)
+        except ValueError as err:
+            logging.error("Failed to replay %s for %s: %s", station_crs, day, err)
+            continue
 
-    return response.json()["services"]
+        yield station_crs, day, services
 
 
 def load_row_from_csv(
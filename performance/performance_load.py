@@ -2,270 +2,432 @@
 
 from __future__ import annotations
 
+from collections.abc import Iterable
+from datetime import date
+
+import numpy as np
+from psycopg2 import sql
 from psycopg2._psycopg import connection, cursor
+from psycopg2.extras import execute_values
+
+from dimension_cache import DimensionCache
+from entities import Arrival, Cancellation, ServiceBatch
 
-from entities import Arrival, Operator, Station, Service, Cancellation, CancellationType
+PAGE_SIZE = 1000
 
 
-def upload_arrivals(arrivals: list[Arrival], conn: connection) -> None:
+def upload_arrivals(
+    arrivals: list[Arrival], conn: connection, cache: DimensionCache = None
+) -> None:
     """
     Uploads transformed arrival data to the specified database. Tries to obtain the keys of
     existing entities in the database; if it does not exist, uploads the entity.
     """
-    cur = conn.cursor()
+    upload_train_data(conn, arrivals, [], cache)
 
-    for arrival in arrivals:
-        station_id, service_id = upload_metadata(conn, cur, arrival)
 
-        upload_arrival(conn, cur, arrival, station_id, service_id)
-
-
-def upload_cancellations(cancellations: list[Cancellation], conn: connection) -> None:
+def upload_cancellations(
+    cancellations: list[Cancellation], conn: connection, cache: DimensionCache = None
+) -> None:
     """
     Uploads transformed cancellation/arrival data to the specified database. Tries to
     obtain the keys of existing entities in the database; if it does not exist,
     uploads the entity.
     """
-    cur = conn.cursor()
-
-    for cancellation in cancellations:
-        station_id, service_id = upload_metadata(conn, cur, cancellation)
-
-        cancellation_type_id = get_cancellation_type_id(
-            cur, cancellation.cancellation_type
-        )
-        if cancellation_type_id is None:
-            cancellation_type_id = upload_cancellation_type(
-                conn, cur, cancellation.cancellation_type
-            )
-
-        upload_cancellation(
-            conn, cur, cancellation, station_id, service_id, cancellation_type_id
-        )
+    upload_train_data(conn, [], cancellations, cache)
 
 
-def upload_metadata(conn: connection, cur: cursor, train) -> tuple:
+def upload_train_data(
+    conn: connection,
+    arrivals: list[Arrival],
+    cancellations: list[Cancellation],
+    cache: DimensionCache = None,
+    checkpoint: tuple[str, date] = None,
+) -> None:
     """
-    Uploads train metadata - including operator, station, and service - if it does not
-    already exist in the database, returning the new or existing IDs.
+    Uploads a batch of arrivals and cancellations (typically one station-day) in a single
+    transaction. See upload_rows.
     """
-
-    operator_id = get_operator_id(cur, train.service.operator)
-    if operator_id is None:
-        operator_id = upload_operator(conn, cur, train.service.operator)
-
-    station_id = get_station_id(cur, train.station)
-    if station_id is None:
-        station_id = upload_station(conn, cur, train.station)
-
-    service_id = get_service_id(cur, train.service)
-    if service_id is None:
-        service_id = upload_service(conn, cur, train.service, operator_id)
-
-    return station_id, service_id
+    trains = [*arrivals, *cancellations]
+    if not trains and checkpoint is None:
+        return
+
+    upload_rows(
+        conn,
+        operators=[
+            (train.service.operator.operator_code, train.service.operator.operator_name)
+            for train in trains
+        ],
+        stations=[
+            (train.station.crs_code, train.station.station_name) for train in trains
+        ],
+        services=[
+            (train.service.service_uid, train.service.operator.operator_code)
+            for train in trains
+        ],
+        cancellation_types=[
+            (
+                cancellation.cancellation_type.cancellation_code,
+                cancellation.cancellation_type.description,
+            )
+            for cancellation in cancellations
+        ],
+        arrivals=[
+            (
+                arrival.station.crs_code,
+                arrival.service.service_uid,
+                arrival.scheduled_arrival,
+                arrival.actual_arrival,
+            )
+            for arrival in arrivals
+        ],
+        cancellations=[
+            (
+                cancellation.station.crs_code,
+                cancellation.service.service_uid,
+                cancellation.scheduled_arrival,
+                cancellation.cancellation_type.cancellation_code,
+            )
+            for cancellation in cancellations
+        ],
+        cache=cache,
+        checkpoint=checkpoint,
+    )
 
 
-def get_operator_id(cur: cursor, operator: Operator) -> int | None:
+def upload_service_batch(
+    conn: connection,
+    batch: ServiceBatch,
+    cache: DimensionCache = None,
+    checkpoint: tuple[str, date] = None,
+) -> None:
     """
-    Attempts to match the operator object to an existing entity in the database and extract
-    its primary key. Otherwise, returns None.
+    Uploads the valid rows of a columnar service batch in a single transaction.
+    See upload_rows.
     """
-    cur.execute(
-        """
-        SELECT operator_id
-        FROM operators
-        WHERE operator_code = %s;
-        """,
-        (operator.operator_code,),
+    arrival_mask = batch.arrival_mask
+    cancellation_mask = batch.cancellation_mask
+    valid = batch.valid
+
+    crs_code = batch.station.crs_code
+    service_uids = batch.service_uids.tolist()
+    scheduled_arrivals = batch.scheduled_arrivals.astype("datetime64[us]").tolist()
+
+    upload_rows(
+        conn,
+        operators=zip(
+            batch.operator_codes[valid].tolist(), batch.operator_names[valid].tolist()
+        ),
+        stations=[(crs_code, batch.station.station_name)] if valid.any() else [],
+        services=zip(
+            batch.service_uids[valid].tolist(), batch.operator_codes[valid].tolist()
+        ),
+        cancellation_types=zip(
+            batch.cancellation_codes[cancellation_mask].tolist(),
+            batch.cancellation_descriptions[cancellation_mask].tolist(),
+        ),
+        arrivals=[
+            (crs_code, service_uids[index], scheduled_arrivals[index], actual_arrival)
+            for index, actual_arrival in zip(
+                np.flatnonzero(arrival_mask).tolist(),
+                batch.actual_arrivals[arrival_mask].astype("datetime64[us]").tolist(),
+            )
+        ],
+        cancellations=[
+            (crs_code, service_uids[index], scheduled_arrivals[index], code)
+            for index, code in zip(
+                np.flatnonzero(cancellation_mask).tolist(),
+                batch.cancellation_codes[cancellation_mask].tolist(),
+            )
+        ],
+        cache=cache,
+        checkpoint=checkpoint,
     )
 
-    res = cur.fetchone()
-
-    return res[0] if res else None
-
 
-def upload_operator(conn: connection, cur: cursor, operator: Operator) -> int:
-    """Uploads an operator object to the database, returning the new ID of the uploaded entity."""
-    sql = """
-        INSERT INTO operators
-            ("operator_name", "operator_code")
-        VALUES 
-            (%s, %s)
-        RETURNING operator_id;
-          """
-
-    params = (operator.operator_name, operator.operator_code)
+def upload_rows(
+    conn: connection,
+    operators: Iterable[tuple[str, str]],
+    stations: Iterable[tuple[str, str]],
+    services: Iterable[tuple[str, str]],
+    cancellation_types: Iterable[tuple[str, str]],
+    arrivals: list[tuple],
+    cancellations: list[tuple],
+    cache: DimensionCache = None,
+    checkpoint: tuple[str, date] = None,
+) -> None:
+    """
+    Uploads a batch of arrivals and cancellations in a single transaction. Operators,
+    stations, services and cancellation types are resolved for the whole batch with one
+    set-based statement each, and the arrivals and cancellations are then upserted in
+    pages rather than one row at a time.
+    Arrivals are given as (crs, service uid, scheduled, actual) tuples and cancellations
+    as (crs, service uid, scheduled, cancellation code) tuples.
+    If a cache is given, only keys missing from it are resolved against the database,
+    and the cache is updated once the transaction has been committed.
+    If a (station crs, date) checkpoint is given, the station-day is recorded as loaded
+    in the same transaction.
+    """
+    with conn:
+        with conn.cursor() as cur:
+            operator_ids = upload_operators(cur, operators, cache)
+            station_ids = upload_stations(cur, stations, cache)
+            service_ids = upload_services(cur, services, operator_ids, cache)
+            cancellation_type_ids = upload_cancellation_types(
+                cur, cancellation_types, cache
+            )
 
-    cur.execute(sql, params)
+            insert_arrivals(cur, arrivals, station_ids, service_ids)
+            insert_cancellations(
+                cur, cancellations, station_ids, service_ids, cancellation_type_ids
+            )
 
-    conn.commit()
+            if checkpoint:
+                record_loaded_station_day(
+                    cur, *checkpoint, len(arrivals), len(cancellations)
+                )
 
-    return cur.fetchone()[0]
+    if cache:
+        cache.store("operators", operator_ids.items())
+        cache.store("stations", station_ids.items())
+        cache.store("services", service_ids.items())
+        cache.store("cancellation_types", cancellation_type_ids.items())
 
 
-def get_station_id(cur: cursor, station: Station):
+def upsert_keys(
+    cur: cursor,
+    table: str,
+    id_column: str,
+    columns: tuple[str, ...],
+    rows: Iterable[tuple],
+    cache: DimensionCache = None,
+) -> dict:
     """
-    Attempts to match the station object to an existing entity in the database and extract
-    its primary key. Otherwise, returns None.
+    Inserts any rows that do not already exist in the given lookup table and returns a
+    mapping of each row's natural key (its first column, which must be unique) to its
+    primary key. Existing rows are left untouched, so repeated runs do not rewrite them.
+    Keys already held in the cache are not sent to the database at all.
     """
-    cur.execute(
-        """
-        SELECT station_id
-        FROM stations
-        WHERE station_name = %s;
-        """,
-        (station.station_name,),
+    rows_by_key = {row[0]: row for row in rows}
+
+    keys = {}
+    if cache:
+        keys, missing = cache.lookup(table, rows_by_key)
+        rows_by_key = {key: rows_by_key[key] for key in missing}
+
+    unique_rows = list(rows_by_key.values())
+    if not unique_rows:
+        return keys
+
+    key_column = columns[0]
+    query = sql.SQL("""
+        WITH input ({columns}) AS (
+            VALUES %s
+        ), inserted AS (
+            INSERT INTO {table} ({columns})
+            SELECT {columns} FROM input
+            ON CONFLICT ({key_column}) DO NOTHING
+            RETURNING {key_column}, {id_column}
+        )
+        SELECT {key_column}, {id_column} FROM inserted
+        UNION ALL
+        SELECT {table}.{key_column}, {table}.{id_column}
+        FROM {table}
+        JOIN input ON input.{key_column} = {table}.{key_column};
+        """).format(
+        table=sql.Identifier(table),
+        id_column=sql.Identifier(id_column),
+        key_column=sql.Identifier(key_column),
+        columns=sql.SQL(", ").join(map(sql.Identifier, columns)),
     )
 
-    res = cur.fetchone()
-
-    return res[0] if res else None
+    result = execute_values(cur, query, unique_rows, page_size=PAGE_SIZE, fetch=True)
 
+    keys.update(result)
 
-def upload_station(conn: connection, cur: cursor, station: Station) -> int:
-    """Uploads a station object to the database, returning the new ID of the uploaded entity."""
-    sql = """
-        INSERT INTO stations
-            ("crs_code", "station_name")
-        VALUES 
-            (%s, %s)
-        RETURNING
-            station_id;
-          """
+    return keys
 
-    params = (station.crs_code, station.station_name)
 
-    cur.execute(sql, params)
-
-    conn.commit()
-
-    return cur.fetchone()[0]
-
-
-def get_service_id(cur: cursor, service: Service):
+def upload_operators(
+    cur: cursor, operators: Iterable[tuple[str, str]], cache: DimensionCache = None
+) -> dict[str, int]:
     """
-    Attempts to match the service object to an existing entity in the database and extract
-    its primary key. Otherwise, returns None.
+    Uploads any new (operator code, operator name) pairs, returning a mapping of
+    operator code to operator ID.
     """
-    cur.execute(
-        """
-        SELECT service_id
-        FROM services
-        WHERE service_uid = %s;
-        """,
-        (service.service_uid,),
+    return upsert_keys(
+        cur,
+        "operators",
+        "operator_id",
+        ("operator_code", "operator_name"),
+        operators,
+        cache,
     )
 
-    res = cur.fetchone()
-
-    return res[0] if res else None
-
 
-def upload_service(
-    conn: connection, cur: cursor, service: Service, operator_id: int
-) -> int:
-    """Uploads a service object to the database, returning the new ID of the uploaded entity."""
-    sql = """
-        INSERT INTO services
-            ("operator_id", "service_uid")
-        VALUES 
-            (%s, %s)
-        RETURNING service_id;
-          """
+def upload_stations(
+    cur: cursor, stations: Iterable[tuple[str, str]], cache: DimensionCache = None
+) -> dict[str, int]:
+    """
+    Uploads any new (CRS code, station name) pairs, returning a mapping of CRS code to
+    station ID.
+    """
+    return upsert_keys(
+        cur,
+        "stations",
+        "station_id",
+        ("crs_code", "station_name"),
+        stations,
+        cache,
+    )
 
-    params = (operator_id, service.service_uid)
 
-    cur.execute(sql, params)
+def upload_services(
+    cur: cursor,
+    services: Iterable[tuple[str, str]],
+    operator_ids: dict[str, int],
+    cache: DimensionCache = None,
+) -> dict[str, int]:
+    """
+    Uploads any new (service UID, operator code) pairs, returning a mapping of service
+    UID to service ID.
+    """
+    return upsert_keys(
+        cur,
+        "services",
+        "service_id",
+        ("service_uid", "operator_id"),
+        (
+            (service_uid, operator_ids[operator_code])
+            for service_uid, operator_code in services
+        ),
+        cache,
+    )
 
-    conn.commit()
 
-    return cur.fetchone()[0]
+def upload_cancellation_types(
+    cur: cursor,
+    cancellation_types: Iterable[tuple[str, str]],
+    cache: DimensionCache = None,
+) -> dict[str, int]:
+    """
+    Uploads any new (cancellation code, description) pairs, returning a mapping of
+    cancellation code to cancellation type ID.
+    """
+    return upsert_keys(
+        cur,
+        "cancellation_types",
+        "cancellation_type_id",
+        ("cancellation_code", "description"),
+        cancellation_types,
+        cache,
+    )
 
 
-def upload_arrival(
-    conn: connection, cur: cursor, arrival: Arrival, station_id: int, service_id: int
+def insert_arrivals(
+    cur: cursor,
+    arrivals: Iterable[tuple],
+    station_ids: dict[str, int],
+    service_ids: dict[str, int],
 ) -> None:
-    """Uploads an arrival object to the database."""
-    sql = """
-            INSERT INTO arrivals
-                ("station_id", "service_id", "scheduled_arrival", "actual_arrival")
-            VALUES 
-                (%s, %s, %s, %s);
-              """
-
-    params = (station_id, service_id, arrival.scheduled_arrival, arrival.actual_arrival)
+    """
+    Upserts a batch of arrivals using the resolved station and service IDs. Arrivals
+    are unique on their service, station and scheduled time, so reloading a station-day
+    updates the existing rows rather than duplicating them.
+    """
+    sql_query = """
+        INSERT INTO arrivals
+            ("station_id", "service_id", "scheduled_arrival", "actual_arrival")
+        VALUES %s
+        ON CONFLICT (service_id, station_id, scheduled_arrival)
+        DO UPDATE SET actual_arrival = EXCLUDED.actual_arrival;
+        """
 
-    cur.execute(sql, params)
+    rows = unique_by_natural_key(
+        (station_ids[crs_code], service_ids[service_uid], scheduled, actual)
+        for crs_code, service_uid, scheduled, actual in arrivals
+    )
 
-    conn.commit()
+    execute_values(cur, sql_query, rows, page_size=PAGE_SIZE)
 
 
-def get_cancellation_type_id(cur: cursor, cancellation_type: CancellationType):
+def insert_cancellations(
+    cur: cursor,
+    cancellations: Iterable[tuple],
+    station_ids: dict[str, int],
+    service_ids: dict[str, int],
+    cancellation_type_ids: dict[str, int],
+) -> None:
     """
-    Attempts to match the service object to an existing entity in the database and extract
-    its primary key. Otherwise, returns None.
+    Upserts a batch of cancellations using the resolved station, service and
+    cancellation type IDs. Cancellations are unique on their service, station and
+    scheduled time.
     """
-    cur.execute(
+    sql_query = """
+        INSERT INTO cancellations
+            ("station_id", "service_id", "scheduled_arrival", "cancellation_type_id")
+        VALUES %s
+        ON CONFLICT (service_id, station_id, scheduled_arrival)
+        DO UPDATE SET cancellation_type_id = EXCLUDED.cancellation_type_id;
         """
-        SELECT cancellation_type_id
-        FROM cancellation_types
-        WHERE cancellation_code = %s;
-        """,
-        (cancellation_type.cancellation_code,),
-    )
 
-    res = cur.fetchone()
+    rows = unique_by_natural_key(
+        (
+            station_ids[crs_code],
+            service_ids[service_uid],
+            scheduled,
+            cancellation_type_ids[cancellation_code],
+        )
+        for crs_code, service_uid, scheduled, cancellation_code in cancellations
+    )
 
-    return res[0] if res else None
+    execute_values(cur, sql_query, rows, page_size=PAGE_SIZE)
 
 
-def upload_cancellation_type(
-    conn: connection, cur: cursor, cancellation_type: CancellationType
-) -> int:
+def unique_by_natural_key(rows: Iterable[tuple]) -> list[tuple]:
     """
-    Uploads a cancellation type object to the database,
-    returning the new ID of the uploaded entity.
+    De-duplicates (station ID, service ID, scheduled time, ...) rows on their first
+    three columns, keeping the last occurrence, as a single upsert statement cannot
+    affect the same row twice.
     """
-    sql = """
-        INSERT INTO cancellation_types
-            ("cancellation_code", "description")
-        VALUES 
-            (%s, %s)
-        RETURNING cancellation_type_id;
-          """
-
-    params = (cancellation_type.cancellation_code, cancellation_type.description)
-
-    cur.execute(sql, params)
-
-    conn.commit()
+    return list({row[:3]: row for row in rows}.values())
+
+
+def get_loaded_station_days(
+    conn: connection, start: date, end: date
+) -> set[tuple[str, date]]:
+    """Returns the (station crs, date) pairs already loaded between the given dates."""
+    with conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT crs_code, day
+            FROM load_checkpoints
+            WHERE day BETWEEN %s AND %s;
+            """,
+            (start, end),
+        )
 
-    return cur.fetchone()[0]
+        return set(cur.fetchall())
 
 
-def upload_cancellation(
-    conn: connection,
+def record_loaded_station_day(
     cur: cursor,
-    cancellation: Cancellation,
-    station_id: int,
-    service_id: int,
-    cancellation_type_id: int,
+    station_crs: str,
+    day: date,
+    arrival_count: int,
+    cancellation_count: int,
 ) -> None:
-    """Uploads a cancellation object to the database."""
-    sql = """
-            INSERT INTO cancellations
-                ("station_id", "service_id", "cancellation_type_id", "scheduled_arrival")
-            VALUES 
-                (%s, %s, %s, %s);
-              """
-
-    params = (
-        station_id,
-        service_id,
-        cancellation_type_id,
-        cancellation.scheduled_arrival,
+    """Records that a station-day has been loaded, along with its row counts."""
+    cur.execute(
+        """
+        INSERT INTO load_checkpoints
+            ("crs_code", "day", "arrival_count", "cancellation_count")
+        VALUES
+            (%s, %s, %s, %s)
+        ON CONFLICT (crs_code, day) DO UPDATE SET
+            arrival_count = EXCLUDED.arrival_count,
+            cancellation_count = EXCLUDED.cancellation_count,
+            loaded_at = NOW();
+        """,
+        (station_crs, day, arrival_count, cancellation_count),
     )
-
-    cur.execute(sql, params)
-
-    conn.commit()
@@ -1,8 +1,38 @@
 """Transforms raw data from the RTT API and converts it into cancellation and arrival objects."""
 
 from datetime import date, datetime
+import logging
 
-from entities import Arrival, Cancellation, Operator, Station, Service, CancellationType
+import numpy as np
+
+from entities import (
+    Arrival,
+    Cancellation,
+    Operator,
+    Station,
+    Service,
+    CancellationType,
+    EntityInterner,
+    ServiceBatch,
+)
+from time_resolution import (
+    ROLLOVER_THRESHOLD,
+    parse_hhmm,
+    resolve_actual_time,
+    resolve_scheduled_time,
+)
+
+# The location detail fields read by the columnar transform, in column order.
+TIME_FIELDS = (
+    "gbttBookedArrival",
+    "realtimeArrival",
+    "gbttBookedDeparture",
+    "realtimeDeparture",
+)
+NEXT_DAY_FIELDS = tuple(f"{field}NextDay" for field in TIME_FIELDS)
+
+MINUTES_PER_DAY = 24 * 60
+ROLLOVER_THRESHOLD_MINUTES = int(ROLLOVER_THRESHOLD.total_seconds() // 60)
 
 
 def transform_train_services_data(
@@ -10,7 +40,8 @@ def transform_train_services_data(
 ) -> tuple[list[Arrival], list[Cancellation]]:
     """This function accepts a list of dictionaries corresponding to the trains that
     arrived, or were expected to arrive, at a specific station and returns a tuple
-    consisting of a list of Arrival objects and a list of Cancellation objects."""
+    consisting of a list of Arrival objects and a list of Cancellation objects.
+    Repeated operators, services and cancellation types share a single object."""
 
     if not train_services:
         raise ValueError("No services for provided station.")
@@ -20,6 +51,8 @@ def transform_train_services_data(
         station_name=train_services[0]["locationDetail"]["description"],
     )
 
+    interner = EntityInterner()
+
     arrivals = []
     cancellations = []
     for service in train_services:
@@ -27,28 +60,20 @@ def transform_train_services_data(
             continue
 
         try:
-            operator = Operator(
-                operator_name=service["atocName"], operator_code=service["atocCode"]
-            )
+            operator = interner.get(Operator, service["atocName"], service["atocCode"])
 
-            train_service = Service(
-                operator=operator, service_uid=service["serviceUid"]
-            )
+            train_service = interner.get(Service, operator, service["serviceUid"])
 
             if "cancelReasonCode" in service["locationDetail"].keys():
-                cancellation_type = CancellationType(
-                    cancellation_code=service["locationDetail"]["cancelReasonCode"],
-                    description=service["locationDetail"]["cancelReasonLongText"],
+                cancellation_type = interner.get(
+                    CancellationType,
+                    service["locationDetail"]["cancelReasonCode"],
+                    service["locationDetail"]["cancelReasonLongText"],
                 )
 
-                if "gbttBookedArrival" in service["locationDetail"]:
-                    scheduled_time = get_datetime_from_time_str(
-                        date, service["locationDetail"]["gbttBookedArrival"]
-                    )
-                else:
-                    scheduled_time = get_datetime_from_time_str(
-                        date, service["locationDetail"]["gbttBookedDeparture"]
-                    )
+                scheduled_time = resolve_scheduled_time(
+                    date, *get_booked_time(service["locationDetail"])
+                )
 
                 cancellations.append(
                     Cancellation(
@@ -59,23 +84,13 @@ def transform_train_services_data(
                     )
                 )
             else:
-                if (
-                    "gbttBookedArrival" in service["locationDetail"]
-                    and "realtimeArrival" in service["locationDetail"]
-                ):
-                    scheduled_time = get_datetime_from_time_str(
-                        date, service["locationDetail"]["gbttBookedArrival"]
-                    )
-                    actual_time = get_datetime_from_time_str(
-                        date, service["locationDetail"]["realtimeArrival"]
-                    )
-                else:
-                    scheduled_time = get_datetime_from_time_str(
-                        date, service["locationDetail"]["gbttBookedDeparture"]
-                    )
-                    actual_time = get_datetime_from_time_str(
-                        date, service["locationDetail"]["realtimeDeparture"]
-                    )
+                booked, booked_next_day, realtime, realtime_next_day = (
+                    get_arrival_times(service["locationDetail"])
+                )
+                scheduled_time = resolve_scheduled_time(date, booked, booked_next_day)
+                actual_time = resolve_actual_time(
+                    date, scheduled_time, realtime, realtime_next_day
+                )
 
                 arrivals.append(
                     Arrival(
@@ -86,11 +101,18 @@ def transform_train_services_data(
                     )
                 )
         except KeyError as e:
-            print(
-                (
-                    f"KeyError: Missing {e} for service {service['serviceUid']} "
-                    f"at station {station.station_name}."
-                )
+            logging.warning(
+                "Skipping service %s at station %s: missing %s.",
+                service.get("serviceUid"),
+                station.station_name,
+                e,
+            )
+        except ValueError as e:
+            logging.warning(
+                "Skipping service %s at station %s: %s.",
+                service.get("serviceUid"),
+                station.station_name,
+                e,
             )
 
     return arrivals, cancellations
@@ -101,4 +123,189 @@ def get_datetime_from_time_str(date: date, time: str) -> datetime:
     Combines a given date object with a time string provided in the format %H%M
     and returns a datetime object.
     """
-    return datetime.combine(date, datetime.strptime(time, "%H%M").time())
+    return datetime.combine(date, parse_hhmm(time))
+
+
+def get_booked_time(location: dict) -> tuple[str, bool]:
+    """
+    Returns the booked arrival time of a service at a location, falling back to the
+    booked departure time, along with whether it falls on the next day.
+    """
+    if "gbttBookedArrival" in location:
+        return location["gbttBookedArrival"], location.get(
+            "gbttBookedArrivalNextDay", False
+        )
+
+    return location["gbttBookedDeparture"], location.get(
+        "gbttBookedDepartureNextDay", False
+    )
+
+
+def get_arrival_times(location: dict) -> tuple[str, bool, str, bool]:
+    """
+    Returns the booked and realtime arrival times of a service at a location, falling
+    back to the departure times if either arrival time is missing, along with whether
+    each falls on the next day.
+    """
+    if "gbttBookedArrival" in location and "realtimeArrival" in location:
+        prefix = "Arrival"
+    else:
+        prefix = "Departure"
+
+    return (
+        location[f"gbttBooked{prefix}"],
+        location.get(f"gbttBooked{prefix}NextDay", False),
+        location[f"realtime{prefix}"],
+        location.get(f"realtime{prefix}NextDay", False),
+    )
+
+
+def transform_train_services_data_columnar(
+    train_services: list[dict], date: date
+) -> ServiceBatch:
+    """
+    Columnar alternative to transform_train_services_data. Gathers the fields of every
+    train service into arrays in a single pass, then selects and parses the scheduled and
+    actual times for the whole batch at once. Services with missing or malformed fields
+    are excluded by the batch's `valid` mask rather than raising.
+    """
+
+    if not train_services:
+        raise ValueError("No services for provided station.")
+
+    station = Station(
+        crs_code=train_services[0]["locationDetail"]["crs"],
+        station_name=train_services[0]["locationDetail"]["description"],
+    )
+
+    rows = [
+        (
+            service.get("serviceUid", ""),
+            service.get("atocCode", ""),
+            service.get("atocName", ""),
+            location.get("cancelReasonCode", ""),
+            location.get("cancelReasonLongText", ""),
+            "cancelReasonCode" in location,
+            "cancelReasonLongText" in location,
+            *(location.get(field, "") for field in TIME_FIELDS),
+            *(bool(location.get(field, False)) for field in NEXT_DAY_FIELDS),
+        )
+        for service in train_services
+        if service["serviceType"] == "train"
+        for location in (service["locationDetail"],)
+    ]
+
+    columns = (
+        list(zip(*rows))
+        if rows
+        else [()] * (7 + len(TIME_FIELDS) + len(NEXT_DAY_FIELDS))
+    )
+    (
+        service_uids,
+        operator_codes,
+        operator_names,
+        cancellation_codes,
+        cancellation_descriptions,
+        is_cancelled,
+        has_description,
+    ) = (np.array(column) for column in columns[:7])
+    booked_arrival, realtime_arrival, booked_departure, realtime_departure = (
+        np.array(column, dtype="U5") for column in columns[7:11]
+    )
+    (
+        booked_arrival_next_day,
+        realtime_arrival_next_day,
+        booked_departure_next_day,
+        realtime_departure_next_day,
+    ) = (np.array(column, dtype=bool) for column in columns[11:])
+
+    is_cancelled = is_cancelled.astype(bool)
+    has_arrival_times = (booked_arrival != "") & (realtime_arrival != "")
+
+    scheduled_times = np.where(
+        is_cancelled,
+        np.where(booked_arrival != "", booked_arrival, booked_departure),
+        np.where(has_arrival_times, booked_arrival, booked_departure),
+    )
+    scheduled_next_day = np.where(
+        is_cancelled,
+        np.where(
+            booked_arrival != "", booked_arrival_next_day, booked_departure_next_day
+        ),
+        np.where(has_arrival_times, booked_arrival_next_day, booked_departure_next_day),
+    )
+    actual_times = np.where(has_arrival_times, realtime_arrival, realtime_departure)
+    actual_next_day = np.where(
+        has_arrival_times, realtime_arrival_next_day, realtime_departure_next_day
+    )
+
+    scheduled_minutes, scheduled_valid = parse_hhmm_array(scheduled_times)
+    actual_minutes, actual_valid = parse_hhmm_array(actual_times)
+
+    scheduled_minutes += MINUTES_PER_DAY * scheduled_next_day
+    actual_minutes = resolve_actual_minutes(
+        scheduled_minutes, actual_minutes, actual_next_day
+    )
+
+    valid = (
+        (service_uids != "")
+        & (operator_codes != "")
+        & (operator_names != "")
+        & scheduled_valid
+        & np.where(is_cancelled, has_description.astype(bool), actual_valid)
+    )
+
+    midnight = np.datetime64(date, "m")
+
+    return ServiceBatch(
+        station=station,
+        service_uids=service_uids,
+        operator_codes=operator_codes,
+        operator_names=operator_names,
+        scheduled_arrivals=midnight + scheduled_minutes.astype("timedelta64[m]"),
+        actual_arrivals=np.where(
+            is_cancelled,
+            np.datetime64("NaT"),
+            midnight + actual_minutes.astype("timedelta64[m]"),
+        ),
+        cancellation_codes=cancellation_codes,
+        cancellation_descriptions=cancellation_descriptions,
+        is_cancelled=is_cancelled,
+        valid=valid,
+    )
+
+
+def resolve_actual_minutes(
+    scheduled_minutes: np.ndarray, actual_minutes: np.ndarray, next_day: np.ndarray
+) -> np.ndarray:
+    """
+    Vectorised equivalent of resolve_actual_time, working in minutes since midnight on
+    the run date. Actual times flagged as falling on the next day are moved forward a
+    day; otherwise, they are moved to whichever day puts them within the rollover
+    threshold of the scheduled time.
+    """
+    inferred = actual_minutes + (scheduled_minutes // MINUTES_PER_DAY) * MINUTES_PER_DAY
+    difference = inferred - scheduled_minutes
+
+    inferred -= MINUTES_PER_DAY * (difference > ROLLOVER_THRESHOLD_MINUTES)
+    inferred += MINUTES_PER_DAY * (difference < -ROLLOVER_THRESHOLD_MINUTES)
+
+    return np.where(next_day, actual_minutes + MINUTES_PER_DAY, inferred)
+
+
+def parse_hhmm_array(times: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Converts an array of time strings in the format %H%M to minutes past midnight,
+    returning the minutes along with a mask of which strings were valid times.
+    Invalid strings are given zero minutes.
+    """
+    digits = times.astype("U5").view(np.uint32).reshape(-1, 5).astype(np.int32) - 48
+
+    valid = ((digits[:, :4] >= 0) & (digits[:, :4] <= 9)).all(axis=1)
+    valid &= digits[:, 4] == -48
+
+    hours = digits[:, 0] * 10 + digits[:, 1]
+    minutes = digits[:, 2] * 10 + digits[:, 3]
+    valid &= (hours < 24) & (minutes < 60)
+
+    return np.where(valid, hours * 60 + minutes, 0), valid
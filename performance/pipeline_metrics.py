@@ -0,0 +1,138 @@
+"""Timings and counters for a single run of the performance pipeline."""
+
+from __future__ import annotations
+
+import json
+import threading
+import time
+from collections import Counter, defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from datetime import date
+
+from psycopg2.extensions import cursor
+
+PROMETHEUS_PREFIX = "railway_performance"
+
+
+class PipelineMetrics:
+    """
+    Collects per-stage durations, run-wide counters and per station-day measurements.
+    Safe to update from the fetch worker threads.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.counters = Counter()
+        self.stage_seconds = defaultdict(float)
+        self.station_days = defaultdict(dict)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Adds the time spent inside the with block to the named stage's duration."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.stage_seconds[name] += elapsed
+
+    def increment(self, name: str, value: int = 1) -> None:
+        """Increments the named run-wide counter."""
+        with self._lock:
+            self.counters[name] += value
+
+    def record_station_day(self, station_crs: str, day: date, **values) -> None:
+        """Records measurements for a station-day, adding them to the run-wide counters."""
+        with self._lock:
+            self.station_days[(station_crs, day)].update(values)
+            for name, value in values.items():
+                if isinstance(value, int):
+                    self.counters[name] += value
+
+    def cursor_factory(self) -> type[cursor]:
+        """
+        Returns a cursor class that counts every statement it sends to the database,
+        for use as a psycopg2 connection's cursor_factory.
+        """
+        metrics = self
+
+        class CountingCursor(cursor):
+            """A cursor that counts database round trips."""
+
+            def execute(self, query, params=None):
+                """Counts and executes a statement."""
+                metrics.increment("db_round_trips")
+                return super().execute(query, params)
+
+            def executemany(self, query, params_seq):
+                """Counts and executes a statement against each set of parameters."""
+                metrics.increment("db_round_trips")
+                return super().executemany(query, params_seq)
+
+        return CountingCursor
+
+    def to_json_lines(self) -> list[str]:
+        """
+        Returns the metrics as JSON lines: one summary line for the run, then one line
+        per station-day.
+        """
+        lines = [
+            json.dumps(
+                {
+                    "type": "run",
+                    "started": self.started,
+                    "duration_seconds": round(time.time() - self.started, 3),
+                    "stage_seconds": {
+                        stage: round(seconds, 3)
+                        for stage, seconds in self.stage_seconds.items()
+                    },
+                    "counters": dict(self.counters),
+                }
+            )
+        ]
+
+        for (station_crs, day), values in sorted(self.station_days.items()):
+            lines.append(
+                json.dumps(
+                    {
+                        "type": "station_day",
+                        "station": station_crs,
+                        "day": day.isoformat(),
+                        **values,
+                    }
+                )
+            )
+
+        return lines
+
+    def to_prometheus(self) -> str:
+        """Returns the metrics in the Prometheus text exposition format."""
+        lines = [
+            f"# TYPE {PROMETHEUS_PREFIX}_stage_seconds gauge",
+            *(
+                f'{PROMETHEUS_PREFIX}_stage_seconds{{stage="{stage}"}} {seconds:.6f}'
+                for stage, seconds in sorted(self.stage_seconds.items())
+            ),
+        ]
+
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name}_total counter")
+            lines.append(f"{PROMETHEUS_PREFIX}_{name}_total {value}")
+
+        fetch_seconds = [
+            (station_crs, day, values["fetch_seconds"])
+            for (station_crs, day), values in sorted(self.station_days.items())
+            if "fetch_seconds" in values
+        ]
+        if fetch_seconds:
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_fetch_seconds gauge")
+            lines.extend(
+                f"{PROMETHEUS_PREFIX}_fetch_seconds"
+                f'{{station="{station_crs}",day="{day.isoformat()}"}} {seconds:.6f}'
+                for station_crs, day, seconds in fetch_seconds
+            )
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,67 @@
+"""
+An on-disk, content-addressed cache of raw responses from the RTT API.
+
+Payloads are stored gzip-compressed under the SHA-256 of their content, and an index
+maps each (station crs, date) pair to the payload last fetched for it:
+
+    <directory>/objects/<first two hex digits>/<sha256>.json.gz
+    <directory>/index/<station crs>/<YYYY-MM-DD>
+"""
+
+import gzip
+import hashlib
+import os
+from datetime import date
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+
+
+class ResponseCache:
+    """Stores and retrieves raw RTT API responses keyed by station and date."""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+
+    def object_path(self, digest: str) -> Path:
+        """Returns the path of the compressed payload with the given SHA-256 digest."""
+        return self.directory / "objects" / digest[:2] / f"{digest}.json.gz"
+
+    def index_path(self, station_crs: str, day: date) -> Path:
+        """Returns the path of the index entry for a station-day."""
+        return self.directory / "index" / station_crs / day.isoformat()
+
+    def put(self, station_crs: str, day: date, payload: bytes) -> str:
+        """
+        Stores a raw payload for a station-day, returning its digest. Identical payloads
+        are only stored once.
+        """
+        digest = hashlib.sha256(payload).hexdigest()
+
+        object_path = self.object_path(digest)
+        if not object_path.exists():
+            write_atomically(object_path, gzip.compress(payload))
+
+        write_atomically(self.index_path(station_crs, day), digest.encode())
+
+        return digest
+
+    def get(self, station_crs: str, day: date) -> bytes | None:
+        """Returns the raw payload stored for a station-day, or None if there isn't one."""
+        try:
+            digest = self.index_path(station_crs, day).read_text(encoding="UTF-8")
+            return gzip.decompress(self.object_path(digest.strip()).read_bytes())
+        except FileNotFoundError:
+            return None
+
+
+def write_atomically(path: Path, data: bytes) -> None:
+    """
+    Writes data to a temporary file alongside the destination and renames it into place,
+    so that concurrent readers never see a partially written file.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    with NamedTemporaryFile(dir=path.parent, delete=False) as file:
+        file.write(data)
+
+    os.replace(file.name, path)
@@ -0,0 +1,25 @@
+from dimension_cache import DimensionCache
+
+
+def test_lookup_counts_hits_and_misses():
+    cache = DimensionCache()
+    cache.store("operators", [("NT", 1), ("TP", 2)])
+
+    found, missing = cache.lookup("operators", ["NT", "TP", "XC"])
+
+    assert found == {"NT": 1, "TP": 2}
+    assert missing == ["XC"]
+    assert cache.stats()["operators"] == {"hits": 2, "misses": 1, "size": 2}
+
+
+def test_services_are_evicted_least_recently_used_first():
+    cache = DimensionCache(max_services=2)
+    cache.store("services", [("A1", 1), ("A2", 2)])
+
+    cache.lookup("services", ["A1"])
+    cache.store("services", [("A3", 3)])
+
+    found, missing = cache.lookup("services", ["A1", "A2", "A3"])
+
+    assert found == {"A1": 1, "A3": 3}
+    assert missing == ["A2"]
@@ -1,6 +1,18 @@
-import pytest
-from performance_extract import load_row_from_csv
+import json
 import os
+import threading
+import time
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from performance_extract import (
+    RateLimiter,
+    fetch_train_services_data_for_station_days,
+    load_row_from_csv,
+    replay_train_services_data_for_station_days,
+)
+from response_cache import ResponseCache
 
 
 @pytest.fixture
@@ -25,3 +37,108 @@ def test_load_row_from_csv(sample_csv_file):
 
     expected_result = ["D", "E", "F"]
     assert result == expected_result
+
+
+@pytest.fixture
+def stub_rtt_server():
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            station_crs = self.path.split("/")[1]
+            body = json.dumps(
+                {"services": [{"locationDetail": {"crs": station_crs}}]}
+            ).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/"
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch_train_services_data_for_station_days(stub_rtt_server, tmpdir):
+    station_days = [(crs, date(2024, 4, 30)) for crs in ["LDS", "YRK", "MAN", "EUS"]]
+    cache = ResponseCache(tmpdir)
+
+    results = list(
+        fetch_train_services_data_for_station_days(
+            station_days,
+            username="user",
+            password="pass",
+            max_workers=2,
+            requests_per_second=0,
+            api_url=stub_rtt_server,
+            cache=cache,
+        )
+    )
+
+    assert sorted(crs for crs, _, _ in results) == ["EUS", "LDS", "MAN", "YRK"]
+    for crs, day, services in results:
+        assert day == date(2024, 4, 30)
+        assert services == [{"locationDetail": {"crs": crs}}]
+        assert json.loads(cache.get(crs, day)) == {"services": services}
+
+
+def test_fetch_train_services_data_for_station_days_bounds_fetches_in_flight(
+    stub_rtt_server,
+):
+    requested = []
+
+    def station_days():
+        for index in range(50):
+            requested.append(index)
+            yield f"S{index:02d}", date(2024, 4, 30)
+
+    results = fetch_train_services_data_for_station_days(
+        station_days(),
+        username="user",
+        password="pass",
+        max_workers=2,
+        requests_per_second=0,
+        api_url=stub_rtt_server,
+    )
+    next(results)
+
+    assert len(requested) <= 5
+    assert len(list(results)) == 49
+    assert len(requested) == 50
+
+
+def test_rate_limiter_spaces_requests_to_the_same_host():
+    rate_limiter = RateLimiter(requests_per_second=20)
+
+    start = time.monotonic()
+    for _ in range(5):
+        rate_limiter.wait("https://api.rtt.io/api/v1/json/search/LDS")
+
+    assert time.monotonic() - start >= 4 / 20
+
+
+def test_replay_train_services_data_for_station_days(tmpdir):
+    cache = ResponseCache(tmpdir)
+    cache.put("LDS", date(2024, 4, 30), b'{"services": [{"serviceUid": "A1"}]}')
+    cache.put("MAN", date(2024, 4, 30), b'{"services": null}')
+
+    results = list(
+        replay_train_services_data_for_station_days(
+            [
+                ("LDS", date(2024, 4, 30)),
+                ("YRK", date(2024, 4, 30)),
+                ("MAN", date(2024, 4, 30)),
+            ],
+            cache,
+        )
+    )
+
+    assert results == [
+        ("LDS", date(2024, 4, 30), [{"serviceUid": "A1"}]),
+        ("MAN", date(2024, 4, 30), []),
+    ]
@@ -0,0 +1,106 @@
+from datetime import datetime
+from itertools import count
+from unittest.mock import MagicMock
+
+from psycopg2 import sql
+
+import performance_load
+from performance_load import unique_by_natural_key, upload_rows, upsert_keys
+
+SCHEDULED = datetime(2024, 4, 30, 8, 30)
+
+
+class FakeDatabase:
+    """
+    Stands in for execute_values, giving new natural keys the next free ID and
+    recording every statement sent.
+    """
+
+    def __init__(self, existing: dict):
+        self.ids = dict(existing)
+        self.next_id = count(100)
+        self.lookups = []
+        self.inserts = []
+
+    def execute_values(self, cur, query, rows, page_size=None, fetch=False):
+        """Returns the (natural key, ID) pairs of upserted lookup rows."""
+        rows = list(rows)
+        if not isinstance(query, sql.Composable):
+            self.inserts.append((query, rows))
+            return None
+
+        self.lookups.append((query, rows))
+        for row in rows:
+            if row[0] not in self.ids:
+                self.ids[row[0]] = next(self.next_id)
+        return [(row[0], self.ids[row[0]]) for row in rows]
+
+
+def test_unique_by_natural_key_keeps_last_occurrence():
+    scheduled = datetime(2024, 4, 30, 8, 30)
+    rows = [
+        (1, 10, scheduled, datetime(2024, 4, 30, 8, 31)),
+        (1, 11, scheduled, datetime(2024, 4, 30, 8, 30)),
+        (1, 10, scheduled, datetime(2024, 4, 30, 8, 35)),
+    ]
+
+    result = unique_by_natural_key(rows)
+
+    assert result == [
+        (1, 10, scheduled, datetime(2024, 4, 30, 8, 35)),
+        (1, 11, scheduled, datetime(2024, 4, 30, 8, 30)),
+    ]
+
+
+def test_upsert_keys_maps_inserted_and_existing_keys_in_one_statement(monkeypatch):
+    database = FakeDatabase({"NT": 1})
+    monkeypatch.setattr(performance_load, "execute_values", database.execute_values)
+
+    keys = upsert_keys(
+        MagicMock(),
+        "operators",
+        "operator_id",
+        ("operator_code", "operator_name"),
+        [("NT", "Northern"), ("TP", "TransPennine Express"), ("NT", "Northern")],
+    )
+
+    assert keys == {"NT": 1, "TP": 100}
+    assert [rows for _, rows in database.lookups] == [
+        [("NT", "Northern"), ("TP", "TransPennine Express")]
+    ]
+
+
+def test_upload_rows_upserts_each_dimension_once_and_maps_foreign_keys(monkeypatch):
+    database = FakeDatabase({"NT": 1, "LDS": 2, "S1": 3})
+    monkeypatch.setattr(performance_load, "execute_values", database.execute_values)
+
+    upload_rows(
+        MagicMock(),
+        operators=[
+            ("NT", "Northern"),
+            ("TP", "TransPennine Express"),
+            ("NT", "Northern"),
+        ],
+        stations=[("LDS", "Leeds")] * 3,
+        services=[("S1", "NT"), ("S2", "TP"), ("S3", "NT")],
+        cancellation_types=[("M8", "Train fault")],
+        arrivals=[
+            ("LDS", "S1", SCHEDULED, datetime(2024, 4, 30, 8, 31)),
+            ("LDS", "S2", SCHEDULED, datetime(2024, 4, 30, 8, 35)),
+        ],
+        cancellations=[("LDS", "S3", SCHEDULED, "M8")],
+    )
+
+    assert [rows for _, rows in database.lookups] == [
+        [("NT", "Northern"), ("TP", "TransPennine Express")],
+        [("LDS", "Leeds")],
+        [("S1", 1), ("S2", 100), ("S3", 1)],
+        [("M8", "Train fault")],
+    ]
+
+    (_, arrivals), (_, cancellations) = database.inserts
+    assert arrivals == [
+        (2, 3, SCHEDULED, datetime(2024, 4, 30, 8, 31)),
+        (2, 101, SCHEDULED, datetime(2024, 4, 30, 8, 35)),
+    ]
+    assert cancellations == [(2, 102, SCHEDULED, 103)]
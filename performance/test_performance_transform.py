@@ -1,8 +1,34 @@
 import pytest
-from performance_transform import get_datetime_from_time_str
+import numpy as np
+from benchmark_performance import generate_services
+from performance_transform import (
+    get_datetime_from_time_str,
+    parse_hhmm_array,
+    transform_train_services_data,
+    transform_train_services_data_columnar,
+)
 from datetime import date, datetime
 
 
+def make_service(uid, booked, realtime, cancel_code=None, service_type="train"):
+    location = {
+        "crs": "LDS",
+        "description": "Leeds",
+        "gbttBookedArrival": booked,
+        "realtimeArrival": realtime,
+    }
+    if cancel_code:
+        location["cancelReasonCode"] = cancel_code
+        location["cancelReasonLongText"] = "A reason."
+    return {
+        "serviceType": service_type,
+        "atocName": "Northern",
+        "atocCode": "NT",
+        "serviceUid": uid,
+        "locationDetail": location,
+    }
+
+
 def test_get_datetime_from_time_str():
     test_date = date(2024, 4, 30)
     test_time_str = "0830"
@@ -12,3 +38,90 @@ def test_get_datetime_from_time_str():
     expected_result = datetime(2024, 4, 30, 8, 30)
 
     assert result == expected_result
+
+
+def test_parse_hhmm_array():
+    times = np.array(["0830", "2359", "", "2460", "08a0", "08300"])
+
+    minutes, valid = parse_hhmm_array(times)
+
+    assert valid.tolist() == [True, True, False, False, False, False]
+    assert minutes[valid].tolist() == [510, 1439]
+
+
+def test_columnar_transform_matches_object_transform():
+    services = [
+        make_service("A1", "0800", "0802"),
+        make_service("A2", "0900", "0900", cancel_code="TG"),
+        make_service("A3", "1000", "1005", service_type="bus"),
+        make_service("A4", "1100", "11:0"),
+    ]
+    test_date = date(2024, 4, 30)
+
+    arrivals, cancellations = transform_train_services_data(services[:3], test_date)
+    batch = transform_train_services_data_columnar(services, test_date)
+
+    assert batch.service_uids[batch.arrival_mask].tolist() == [
+        arrival.service.service_uid for arrival in arrivals
+    ]
+    assert batch.scheduled_arrivals[batch.arrival_mask].tolist() == [
+        arrival.scheduled_arrival for arrival in arrivals
+    ]
+    assert batch.actual_arrivals[batch.arrival_mask].tolist() == [
+        arrival.actual_arrival for arrival in arrivals
+    ]
+    assert batch.service_uids[batch.cancellation_mask].tolist() == [
+        cancellation.service.service_uid for cancellation in cancellations
+    ]
+    assert batch.valid.tolist() == [True, True, False]
+
+
+def test_transform_shares_repeated_entities():
+    services = [
+        make_service("A1", "0800", "0802"),
+        make_service("A2", "0900", "0901"),
+        make_service("A3", "1000", "1000", cancel_code="TG"),
+        make_service("A4", "1100", "1100", cancel_code="TG"),
+    ]
+
+    arrivals, cancellations = transform_train_services_data(services, date(2024, 4, 30))
+
+    assert arrivals[0].service.operator is arrivals[1].service.operator
+    assert arrivals[0].service.operator is cancellations[0].service.operator
+    assert cancellations[0].cancellation_type is cancellations[1].cancellation_type
+    assert not hasattr(arrivals[0], "__dict__")
+
+
+def test_transforms_resolve_arrivals_after_midnight():
+    late = make_service("A1", "2358", "0003")
+    early = make_service("A2", "0002", "2359")
+    early["locationDetail"]["gbttBookedArrivalNextDay"] = True
+    test_date = date(2024, 4, 30)
+
+    arrivals, _ = transform_train_services_data([late, early], test_date)
+    batch = transform_train_services_data_columnar([late, early], test_date)
+
+    expected_scheduled = [datetime(2024, 4, 30, 23, 58), datetime(2024, 5, 1, 0, 2)]
+    expected_actual = [datetime(2024, 5, 1, 0, 3), datetime(2024, 4, 30, 23, 59)]
+
+    assert [arrival.scheduled_arrival for arrival in arrivals] == expected_scheduled
+    assert [arrival.actual_arrival for arrival in arrivals] == expected_actual
+    assert batch.scheduled_arrivals.tolist() == expected_scheduled
+    assert batch.actual_arrivals.tolist() == expected_actual
+
+
+def test_transforms_agree_on_synthetic_services():
+    services = generate_services(2000, seed=1)
+    test_date = date(2024, 4, 30)
+
+    arrivals, cancellations = transform_train_services_data(services, test_date)
+    batch = transform_train_services_data_columnar(services, test_date)
+
+    assert generate_services(2000, seed=1) == services
+    assert len(arrivals) + len(cancellations) == batch.valid.sum()
+    assert batch.scheduled_arrivals[batch.arrival_mask].tolist() == [
+        arrival.scheduled_arrival for arrival in arrivals
+    ]
+    assert batch.actual_arrivals[batch.arrival_mask].tolist() == [
+        arrival.actual_arrival for arrival in arrivals
+    ]
@@ -0,0 +1,50 @@
+import json
+from datetime import date
+
+from pipeline_metrics import PipelineMetrics
+
+
+def test_record_station_day_adds_counts_to_run_counters():
+    metrics = PipelineMetrics()
+    metrics.record_station_day(
+        "LDS", date(2024, 4, 30), fetch_seconds=0.5, payload_bytes=100
+    )
+    metrics.record_station_day(
+        "YRK", date(2024, 4, 30), fetch_seconds=0.2, payload_bytes=50
+    )
+    metrics.increment("fetch_failures")
+
+    assert metrics.counters == {"payload_bytes": 150, "fetch_failures": 1}
+
+
+def test_to_json_lines():
+    metrics = PipelineMetrics()
+    with metrics.stage("load"):
+        pass
+    metrics.record_station_day("LDS", date(2024, 4, 30), arrivals_loaded=3)
+
+    run, station_day = [json.loads(line) for line in metrics.to_json_lines()]
+
+    assert run["type"] == "run"
+    assert set(run["stage_seconds"]) == {"load"}
+    assert run["counters"] == {"arrivals_loaded": 3}
+    assert station_day == {
+        "type": "station_day",
+        "station": "LDS",
+        "day": "2024-04-30",
+        "arrivals_loaded": 3,
+    }
+
+
+def test_to_prometheus():
+    metrics = PipelineMetrics()
+    metrics.increment("db_round_trips", 4)
+    metrics.record_station_day("LDS", date(2024, 4, 30), fetch_seconds=0.25)
+
+    text = metrics.to_prometheus()
+
+    assert "railway_performance_db_round_trips_total 4\n" in text
+    assert (
+        'railway_performance_fetch_seconds{station="LDS",day="2024-04-30"} 0.250000\n'
+        in text
+    )
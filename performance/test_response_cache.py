@@ -0,0 +1,24 @@
+from datetime import date
+
+from response_cache import ResponseCache
+
+
+def test_put_and_get_round_trip(tmpdir):
+    cache = ResponseCache(tmpdir)
+    payload = b'{"services": []}'
+
+    cache.put("LDS", date(2024, 4, 30), payload)
+
+    assert cache.get("LDS", date(2024, 4, 30)) == payload
+    assert cache.get("LDS", date(2024, 5, 1)) is None
+
+
+def test_identical_payloads_are_stored_once(tmpdir):
+    cache = ResponseCache(tmpdir)
+    payload = b'{"services": []}'
+
+    first = cache.put("LDS", date(2024, 4, 30), payload)
+    second = cache.put("YRK", date(2024, 4, 30), payload)
+
+    assert first == second
+    assert len(list((tmpdir / "objects").visit(fil="*.json.gz"))) == 1
@@ -0,0 +1,47 @@
+from datetime import date, datetime, time
+
+import pytest
+from time_resolution import parse_hhmm, resolve_actual_time, resolve_scheduled_time
+
+RUN_DATE = date(2024, 4, 30)
+
+
+def test_parse_hhmm():
+    assert parse_hhmm("0830") == time(8, 30)
+    assert parse_hhmm("2359") == time(23, 59)
+
+
+@pytest.mark.parametrize("value", ["2400", "0860", "830", "08:30", "", None])
+def test_parse_hhmm_invalid(value):
+    with pytest.raises(ValueError):
+        parse_hhmm(value)
+
+
+def test_resolve_scheduled_time_next_day():
+    assert resolve_scheduled_time(RUN_DATE, "0003", next_day=True) == datetime(
+        2024, 5, 1, 0, 3
+    )
+
+
+def test_resolve_actual_time_late_past_midnight():
+    scheduled = resolve_scheduled_time(RUN_DATE, "2358")
+
+    actual = resolve_actual_time(RUN_DATE, scheduled, "0003")
+
+    assert actual == datetime(2024, 5, 1, 0, 3)
+
+
+def test_resolve_actual_time_early_before_midnight():
+    scheduled = resolve_scheduled_time(RUN_DATE, "0002", next_day=True)
+
+    actual = resolve_actual_time(RUN_DATE, scheduled, "2359")
+
+    assert actual == datetime(2024, 4, 30, 23, 59)
+
+
+def test_resolve_actual_time_uses_next_day_flag():
+    scheduled = resolve_scheduled_time(RUN_DATE, "1200")
+
+    actual = resolve_actual_time(RUN_DATE, scheduled, "0100", next_day=True)
+
+    assert actual == datetime(2024, 5, 1, 1, 0)
@@ -0,0 +1,60 @@
+"""
+Resolves the HHMM times given by the RTT API into datetimes, handling services whose
+times fall after midnight on the day after the date they run.
+"""
+
+from datetime import date, datetime, time, timedelta
+
+# Every valid HHMM string mapped to its time, so that parsing is a dictionary lookup.
+HHMM_TIMES = {
+    f"{hour:02d}{minute:02d}": time(hour, minute)
+    for hour in range(24)
+    for minute in range(60)
+}
+
+ONE_DAY = timedelta(days=1)
+
+# An actual time more than this far from the scheduled time is assumed to be on the
+# neighbouring day, e.g. booked for 23:58 and arriving at 00:03.
+ROLLOVER_THRESHOLD = timedelta(hours=12)
+
+
+def parse_hhmm(value: str) -> time:
+    """Parses a time string in the format %H%M, raising a ValueError if it is invalid."""
+    try:
+        return HHMM_TIMES[value]
+    except (KeyError, TypeError) as err:
+        raise ValueError(f"Invalid HHMM time: {value!r}") from err
+
+
+def resolve_scheduled_time(
+    run_date: date, booked: str, next_day: bool = False
+) -> datetime:
+    """
+    Returns the datetime of a booked time for a service running on run_date. RTT flags
+    booked times that fall on the following day (e.g. gbttBookedArrivalNextDay).
+    """
+    scheduled = datetime.combine(run_date, parse_hhmm(booked))
+    return scheduled + ONE_DAY if next_day else scheduled
+
+
+def resolve_actual_time(
+    run_date: date, scheduled: datetime, realtime: str, next_day: bool = False
+) -> datetime:
+    """
+    Returns the datetime of a realtime time, given the resolved scheduled datetime.
+    If RTT flags the realtime as falling on the day after run_date, that is used;
+    otherwise the day is inferred as the one that puts it within twelve hours of the
+    scheduled time, so a train booked for 23:58 that arrives at 00:03 is five minutes
+    late rather than 23 hours and 55 minutes early.
+    """
+    if next_day:
+        return datetime.combine(run_date + ONE_DAY, parse_hhmm(realtime))
+
+    actual = datetime.combine(scheduled.date(), parse_hhmm(realtime))
+
+    if actual - scheduled > ROLLOVER_THRESHOLD:
+        return actual - ONE_DAY
+    if scheduled - actual > ROLLOVER_THRESHOLD:
+        return actual + ONE_DAY
+    return actual
@@ -85,6 +85,17 @@ resource "aws_ecs_task_definition" "trains-incidents-task-definition" {
         {
           "name" : "USERNAME",
           "value" : var.USERNAME
+        },
+        {
+          "name" : "OUTBOX_PATH",
+          "value" : "/var/lib/alerts/outbox.sqlite3"
+        }
+      ]
+
+      mountPoints : [
+        {
+          "sourceVolume" : "alerts-outbox",
+          "containerPath" : "/var/lib/alerts"
         }
       ]
     }
@@ -94,6 +105,17 @@ resource "aws_ecs_task_definition" "trains-incidents-task-definition" {
   memory                   = 2048
   cpu                      = 1024
   execution_role_arn       = data.aws_iam_role.ecs-role.arn
+
+  # Incidents are acknowledged once they are in the outbox, so it is kept on EFS to
+  # survive the task being replaced.
+  volume {
+    name = "alerts-outbox"
+
+    efs_volume_configuration {
+      file_system_id     = aws_efs_file_system.alerts-outbox.id
+      transit_encryption = "ENABLED"
+    }
+  }
 }
 
 data "aws_vpc" "cohort-10-vpc" {
@@ -126,7 +148,52 @@ data "aws_subnet" "subnet-3" {
 }
 
 
+resource "aws_security_group" "alerts-security-group" {
+  name        = "c10-railway-alerts-sg"
+  description = "Allows the alerts service to reach the feed, database, SNS and its outbox"
+  vpc_id      = data.aws_vpc.cohort-10-vpc.id
+
+  egress {
+    from_port   = 0
+    to_port     = 0
+    protocol    = "-1"
+    cidr_blocks = ["0.0.0.0/0"]
+  }
+}
+
+resource "aws_security_group" "alerts-outbox-security-group" {
+  name        = "c10-railway-alerts-outbox-sg"
+  description = "Allows NFS access to the alerts outbox from the alerts service"
+  vpc_id      = data.aws_vpc.cohort-10-vpc.id
+
+  ingress {
+    from_port       = 2049
+    to_port         = 2049
+    protocol        = "tcp"
+    security_groups = [aws_security_group.alerts-security-group.id]
+  }
+}
 
+resource "aws_efs_file_system" "alerts-outbox" {
+  creation_token = "c10-railway-alerts-outbox"
+  encrypted      = true
+
+  tags = {
+    Name = "c10-railway-alerts-outbox"
+  }
+}
+
+resource "aws_efs_mount_target" "alerts-outbox-mount-target" {
+  for_each = {
+    subnet-1 = data.aws_subnet.subnet-1.id
+    subnet-2 = data.aws_subnet.subnet-2.id
+    subnet-3 = data.aws_subnet.subnet-3.id
+  }
+
+  file_system_id  = aws_efs_file_system.alerts-outbox.id
+  subnet_id       = each.value
+  security_groups = [aws_security_group.alerts-outbox-security-group.id]
+}
 
 resource "aws_ecs_service" "alerts-service" {
 
@@ -136,11 +203,18 @@ resource "aws_ecs_service" "alerts-service" {
   launch_type     = "FARGATE"
   desired_count   = 1
 
+  # Only one task may hold the outbox, so the old task is stopped before a new one starts.
+  deployment_minimum_healthy_percent = 0
+  deployment_maximum_percent         = 100
+
   network_configuration {
     subnets          = [data.aws_subnet.subnet-1.id, data.aws_subnet.subnet-2.id, data.aws_subnet.subnet-3.id]
+    security_groups  = [aws_security_group.alerts-security-group.id]
     assign_public_ip = true
   }
 
+  depends_on = [aws_efs_mount_target.alerts-outbox-mount-target]
+
   deployment_controller {
     type = "ECS"
   }